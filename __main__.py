@@ -2,23 +2,33 @@
 # Github: https://github.com/Toolage13/HawkEye
 """
 This is the main .py file that is called for HawkEye. It launches a background thread to monitor and validate the
-clipboard, and then passes validated clipboard data to analyze.py for processing. Then it passes the result data from
-analyze.py to gui.py for presentation in the gui.
+clipboard, which hands validated clipboard data to a second background thread that passes it to analyze.py for
+processing. Then it passes the result data from analyze.py to gui.py for presentation in the gui. Only the newest paste
+matters, a paste arriving while an older one is being analyzed cancels that analysis.
 """
 import analyze
 import config
 import gui
+import history
 import logging
+import multiprocessing
 import re
 import threading
 import time
 import wx
 import pyperclip
+import statspool
 import statusmsg
 import updatedialog
+import warmer
 
 Logger = logging.getLogger(__name__)
 
+_JOB_LOCK = threading.Lock()
+_JOB_READY = threading.Event()
+_next_job = None  # (pilot_names, paste time) of the newest paste not picked up yet
+_current_job = None  # analyze.Analysis of the paste being analyzed
+
 
 def watch_clpbd():
     """
@@ -38,11 +48,69 @@ def watch_clpbd():
             if valid:
                 statusmsg.push_status("Clipboard change detected...")
                 recent_value = clipboard
-                analyze_chars(clipboard.splitlines())
-                config.OPTIONS_OBJECT.Set("show_popup", True)
+                submit_paste(clipboard.splitlines())
         time.sleep(0.5)  # Short sleep between loops to reduce CPU load
 
 
+def submit_paste(pilot_names):
+    """
+    Queue a paste for run_jobs(). Only the newest paste is kept, and the analysis of an older paste still running is
+    cancelled. Whatever it finished (resolved pilot IDs, zkill pages, fetched killmails and pilot rows) is cached, so
+    the new paste picks up where it left off.
+    :param pilot_names: List of pilot names to process
+    """
+    global _next_job
+    with _JOB_LOCK:
+        _next_job = (pilot_names, time.time())
+        if _current_job is not None:
+            _current_job.cancel()
+        # Set under the lock, so run_jobs() can't take this job and clear the event before it is set
+        _JOB_READY.set()
+
+
+def run_jobs():
+    """
+    Analysis thread loop, waits for submit_paste() and runs the newest paste through analyze_chars()
+    """
+    global _next_job, _current_job
+    while True:
+        _JOB_READY.wait()
+        with _JOB_LOCK:
+            job = _next_job
+            _next_job = None
+            _JOB_READY.clear()
+        if job is None:
+            continue
+        pilot_names, pasted_at = job
+        try:
+            analyze_chars(pilot_names, pasted_at)
+        finally:
+            with _JOB_LOCK:
+                _current_job = None
+        config.OPTIONS_OBJECT.Set("show_popup", True)
+
+
+def _start_job(analysis):
+    """
+    Make analysis the current job, submit_paste() cancels it from now on
+    :param analysis: analyze.Analysis about to run
+    """
+    global _current_job
+    with _JOB_LOCK:
+        _current_job = analysis
+        if _next_job is not None:
+            # Superseded before it even started
+            analysis.cancel()
+
+
+def _is_superseded():
+    """
+    :return: Boolean, True if a newer paste is waiting
+    """
+    with _JOB_LOCK:
+        return _next_job is not None
+
+
 def check_name_validity(pilot_name):
     """
     Check if a name matches regex below
@@ -57,39 +125,76 @@ def check_name_validity(pilot_name):
     return True
 
 
-def analyze_chars(pilot_names):
+def get_visible_pilots():
+    """
+    Ask the GUI thread which pilots are scrolled into view, see gui.Frame.getVisiblePilots()
+    :return: Set of pilot IDs, empty if the GUI doesn't answer within a second
+    """
+    visible = set()
+    done = threading.Event()
+
+    def collect():
+        try:
+            visible.update(app.MyFrame.getVisiblePilots())
+        finally:
+            done.set()
+
+    wx.CallAfter(collect)
+    done.wait(1)
+    return set(visible)
+
+
+def analyze_chars(pilot_names, pasted_at=None):
     """
-    Send list of pilot names to analyze.main() and send it to gui.App.MyFrame.grid.sortOutlist()
+    Run list of pilot names through an analyze.Analysis, stream every finished pilot to gui.App.MyFrame.upsertPilot()
+    and finally send the complete result to gui.App.MyFrame.sortOutlist(). If a newer paste superseded this one the
+    final result is dropped, the newer paste replaces it.
     :param pilot_names: List of pilot names to process
+    :param pasted_at: Time of the paste, the reported duration is measured from it
     """
-    start_time = time.time()
-    # wx.CallAfter(app.MyFrame.grid.ClearGrid)
+    start_time = pasted_at or time.time()
+    streamed = []
+
+    def stream_pilot(stats):
+        if not streamed:
+            wx.CallAfter(app.MyFrame.startOutlist)
+        streamed.append(stats)
+        wx.CallAfter(app.MyFrame.upsertPilot, stats)
+
     try:
-        outlist, filtered = analyze.main(pilot_names, config.OPTIONS_OBJECT.Get("pop", True))
-        config.OPTIONS_OBJECT.Set("stop", False)
+        analysis = analyze.Analysis(pilot_names, config.OPTIONS_OBJECT.Snapshot().populate_all, callback=stream_pilot,
+                                    visible=get_visible_pilots())
+        _start_job(analysis)
+        outlist, filtered = analysis.run()
         duration = round(time.time() - start_time, 1)
-        if outlist is not None:
-            orig = config.OPTIONS_OBJECT.Get("outlist", [])
-            orig.append(outlist)
-            config.OPTIONS_OBJECT.Set("outlist", orig)
-            index = config.OPTIONS_OBJECT.Get("index", 0)
-            if config.OPTIONS_OBJECT.Get("index", 0) < len(config.OPTIONS_OBJECT.Get("outlist")) - 1:
-                config.OPTIONS_OBJECT.Set("index", len(config.OPTIONS_OBJECT.Get("outlist")) - 1)
-
+        if analysis.cancelled and _is_superseded():
+            Logger.info('Dropped the result of a paste superseded after {} seconds'.format(duration))
+            if streamed:
+                wx.CallAfter(app.MyFrame.finishOutlist)
+        elif outlist is not None:
             # Need to use keyword args as sortOutlist can also get called
             # by event handler which would pass event object as first argument.
-            wx.CallAfter(app.MyFrame.sortOutlist, outlist=outlist, duration=duration, filtered=filtered)
+            wx.CallAfter(app.MyFrame.sortOutlist, outlist=outlist, duration=duration, filtered=filtered,
+                         streamed=bool(streamed))
         else:
             statusmsg.push_status("No valid character names found. Please try again...")
     except Exception:
         Logger.error("Failed to collect character information. Clipboard content was: {}".format(str(pilot_names)), exc_info=True)
 
 
-config.OPTIONS_OBJECT.Set("outlist", [])
-config.OPTIONS_OBJECT.Set("index", -1)
-app = gui.App(0)
-if updatedialog.CheckVersion():
-    app.MyFrame._ShowUpdate()
-background_thread = threading.Thread(target=watch_clpbd, daemon=True)
-background_thread.start()
-app.MainLoop()
+if __name__ == "__main__":
+    # Stats worker processes are spawned, they must not start another app when they import this module
+    multiprocessing.freeze_support()
+    history.get_store()  # Moves outlists saved by older versions out of the options
+    app = gui.App(0)
+    config.OPTIONS_OBJECT.AutoSave(config.OPTIONS_SAVE_DELAY)
+    statusmsg.add_sink(statusmsg.GuiSink(app.MyFrame))
+    if updatedialog.CheckVersion():
+        app.MyFrame._ShowUpdate()
+    background_thread = threading.Thread(target=watch_clpbd, daemon=True)
+    background_thread.start()
+    analysis_thread = threading.Thread(target=run_jobs, daemon=True)
+    analysis_thread.start()
+    warmer.start()
+    app.MainLoop()
+    statspool.shutdown()
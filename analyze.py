@@ -4,88 +4,232 @@
 This is the big boy that handles all the fetching of data, and analysis of the fetched data.
 """
 import asyncio
-from aiohttp import ClientSession
 import datetime
 import eveDB
 import config
+import httpclient
 import json
+import killmails
 import logging
-import os
-import random
+import metrics
+import npstats
+import pagecache
+import profiling
+import ratelimit
+import resultcache
+import statspool
 import statusmsg
+import threading
 import time
 
 Logger = logging.getLogger(__name__)
+ZKILL_LIMITER = ratelimit.TokenBucket(config.ZKILL_RATE, config.ZKILL_BURST)
+ACCUMULATOR_VERSION = 1  # Bump when the accumulator layout changes, stored accumulators are rebuilt
+_RUNNING = set()
+_RUNNING_LOCK = threading.Lock()
 
 
-def main(pilot_names, populate_all):
+def main(pilot_names, populate_all, callback=None, visible=None):
     """
     The main method takes the list of pilot_names, filters and then transforms it into a list of dictionaries
-    containing pilot data using _filter_pilots(). The list is then broken into chunks of size config.MAX_CHUNK and
-    the chunks passed through _concurrent_run_characters(), the result of this is a list of dictionaries containing
-    expanded pilot data. Each dictionary is appended to character_stats, which is finally returned.
+    containing pilot data using _filter_pilots(). The pilots are queued by _get_priority(), and config.PILOT_WORKERS
+    workers take the most urgent one as soon as they are free and pass it through _get_pilot_data(), the result of
+    this is a dictionary containing expanded pilot data. Each dictionary is handed to callback as soon as it completes
+    and appended to character_stats, which is finally returned. The whole paste runs as an Analysis on the calling
+    thread's persistent event loop, see httpclient.get_event_loop(), and can be stopped with cancel_all().
     :param pilot_names: A list of pilot names to parse
     :param populate_all: Whether to just grab pilot name and associations, or all data.
+    :param callback: Optional function called with each pilot's expanded data as soon as that pilot is finished
+    :param visible: Optional set of pilot IDs currently visible in the grid, they are analyzed first
     :return character_stats: A list of dictionaries containing expanded pilot data
     """
-    with eveDB.EveDB() as db:
-        filtered_pilot_data = _filter_pilots(pilot_names, db)
-        if not populate_all:
-            character_stats = []
-            for pilot in filtered_pilot_data:
-                character_stats.append(_get_stats_dictionary(pilot, True))
-                for character in character_stats:
-                    character['query'] = False
-            return character_stats, len(pilot_names) - len(filtered_pilot_data)
-
-        if filtered_pilot_data is None:
-            return (None, None)
-        if len(filtered_pilot_data) == 0:
-            Logger.warning('Filtered out all pilots provided...')
-            statusmsg.push_status("Filtered out all pilots provided...")
-            return (None, None)
+    return Analysis(pilot_names, populate_all, callback, visible).run()
+
+
+def cancel_all():
+    """
+    Cancel every running Analysis, this is what the Stop button does
+    """
+    with _RUNNING_LOCK:
+        running = list(_RUNNING)
+    for analysis in running:
+        analysis.cancel()
 
-        character_stats = []
-        for chunk in divide_chunks(filtered_pilot_data, config.MAX_CHUNK):
-            statusmsg.push_status("Retrieving killboard data for {}...".format(', '.join([c['pilot_name'] for c in chunk])))
-            Logger.info('Running {} pilots through concurrent_run_character(...)'.format(len(chunk)))
-            start_time = time.time()
-            loop = asyncio.new_event_loop()
-            details = loop.run_until_complete(_concurrent_run_character(chunk, db, 'kills'))
-            loop.close()
-            for c in details:
-                character_stats.append(c)
-            statusmsg.push_status('Ran {} pilots in {} seconds.'.format(len(chunk), round(time.time() - start_time, 2)))
-            Logger.info('Ran {} pilots in {} seconds.'.format(len(chunk), round(time.time() - start_time, 2)))
-
-            loop = asyncio.new_event_loop()
-            details = loop.run_until_complete(_concurrent_run_character(chunk, db, 'losses'))
-            loop.close()
-            for c in details:
-                for e in character_stats:
-                    if c['pilot_id'] == e['pilot_id']:
-                        for k in c:
-                            e[k] = c[k]
-                        break
 
-        for char in character_stats:
-            if config.OPTIONS_OBJECT.Get("stop", False):
-                char['query'] = False
+class Analysis:
+    """
+    Handle of a single paste. run() executes it as one task on the calling thread's persistent event loop, cancel()
+    can be called from any thread and cancels that task, and with it every zkill and killmail request it has in flight,
+    on the loop's next iteration. Pilots finished before the cancel are kept, the rest come back as blank rows.
+    """
+    def __init__(self, pilot_names, populate_all, callback=None, visible=None):
+        self.pilot_names = pilot_names
+        self.populate_all = populate_all
+        self.callback = callback
+        self.visible = visible
+        self.cancelled = False
+        self.pilots = None  # Filtered pilot data, once known
+        self.settings = None  # optstore.Settings snapshot the analysis runs with, taken when it starts
+        self.character_stats = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._task = None
+
+    def run(self):
+        """
+        :return: Tuple of (character_stats, number of pilots filtered out), see main()
+        """
+        with _RUNNING_LOCK:
+            _RUNNING.add(self)
+        recorder, token = metrics.begin_paste(len(self.pilot_names))
+        self.settings = config.OPTIONS_OBJECT.Snapshot()
+        try:
+            with profiling.profile(len(self.pilot_names), self.settings.max_killmails), eveDB.EveDB() as db:
+                loop = httpclient.get_event_loop()
+                with self._lock:
+                    if self.cancelled:
+                        return None, None
+                    self._loop = loop
+                    self._task = loop.create_task(_run(self, db))
+                try:
+                    return loop.run_until_complete(self._task)
+                except asyncio.CancelledError:
+                    statusmsg.end()
+                    Logger.info('Analysis cancelled after {} pilots'.format(len(self.character_stats)))
+                    statusmsg.push_status('Stopped after {} pilots.'.format(len(self.character_stats)))
+                    return self._partial_result()
+                finally:
+                    # However the analysis ended, nothing it started may keep running on the loop into the next paste
+                    _cancel_pending(loop)
+        finally:
+            metrics.finish_paste(recorder, token)
+            with _RUNNING_LOCK:
+                _RUNNING.discard(self)
+
+    def cancel(self):
+        """
+        Cancel the analysis, safe to call from any thread and more than once
+        """
+        with self._lock:
+            self.cancelled = True
+            if self._task is not None:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+
+    def _partial_result(self):
+        """
+        :return: Tuple of (character_stats, number of pilots filtered out) with a blank row for every pilot that didn't
+        finish, or (None, None) if the analysis was cancelled before the pilots were known
+        """
+        if self.pilots is None:
+            return None, None
+        finished = set(c['pilot_id'] for c in self.character_stats)
+        for pilot in self.pilots:
+            if pilot['pilot_id'] not in finished:
+                blank = _get_stats_dictionary(pilot, True)
+                blank['query'] = False
+                self.character_stats.append(blank)
+        return self.character_stats, len(self.pilot_names) - len(self.pilots)
+
+
+def is_running():
+    """
+    :return: Boolean, True while any Analysis is running
+    """
+    with _RUNNING_LOCK:
+        return len(_RUNNING) > 0
 
+
+def _cancel_pending(loop):
+    """
+    Cancel whatever a cancelled or failed analysis left behind on loop, like killmail loads shared between pilots, and
+    let it unwind so nothing keeps running on the loop until the next paste.
+    :param loop: Event loop the analysis ran on
+    """
+    pending = [t for t in asyncio.all_tasks(loop) if not t.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+
+async def _run(analysis, db):
+    """
+    Coroutine behind main(), see main() for details.
+    :param analysis: Analysis being run, holds the paste and collects the finished pilots
+    :param db: EveDB object to run queries on
+    :return character_stats: A list of dictionaries containing expanded pilot data
+    """
+    pilot_names = analysis.pilot_names
+    ZKILL_LIMITER.reset_stats()
+    filtered_pilot_data = await _filter_pilots(pilot_names, db, analysis.settings)
+    if not analysis.populate_all:
+        character_stats = []
+        for pilot in filtered_pilot_data:
+            character_stats.append(_get_stats_dictionary(pilot, True))
+            for character in character_stats:
+                character['query'] = False
         return character_stats, len(pilot_names) - len(filtered_pilot_data)
 
+    if filtered_pilot_data is None:
+        return (None, None)
+    if len(filtered_pilot_data) == 0:
+        Logger.warning('Filtered out all pilots provided...')
+        statusmsg.push_status("Filtered out all pilots provided...")
+        return (None, None)
+
+    analysis.pilots = filtered_pilot_data
+    character_stats = analysis.character_stats
+    resolver = killmails.KillmailResolver(db)
+    queue = asyncio.PriorityQueue()
+    priorities = await asyncio.get_event_loop().run_in_executor(
+        None, _get_priorities, filtered_pilot_data, analysis.visible or set(), analysis.settings.highlighted_ids)
+    for index, pilot in enumerate(filtered_pilot_data):
+        # The paste index breaks ties, so equally urgent pilots keep paste order and dicts are never compared
+        queue.put_nowait((priorities[index], index, pilot))
+
+    async def worker():
+        while not queue.empty():
+            priority, index, pilot = queue.get_nowait()
+            statusmsg.push_status("Retrieving killboard data for {}...".format(pilot['pilot_name']))
+            metrics.set_pilot(pilot['pilot_id'])
+            try:
+                with metrics.span('pilot'):
+                    c = await _get_pilot_data(pilot, db, resolver, analysis.settings)
+            except Exception:
+                # One broken pilot must not cost the paste every other row, its blank row can be queried again from the grid
+                Logger.error('Failed to analyze {}'.format(pilot['pilot_name']), exc_info=True)
+                c = _get_stats_dictionary(pilot, ret_blank=True)
+                c['query'] = False
+            statusmsg.count('pilots_done')
+            character_stats.append(c)
+            if analysis.callback is not None:
+                analysis.callback(c)
+
+    Logger.info('Running {} pilots through _get_pilot_data(...)'.format(len(filtered_pilot_data)))
+    start_time = time.time()
+    statusmsg.begin(len(filtered_pilot_data))
+    await asyncio.gather(*[worker() for i in range(min(config.PILOT_WORKERS, len(filtered_pilot_data)))])
+    duration = round(time.time() - start_time, 2)
+    statusmsg.end()
+    statusmsg.push_status('Ran {} pilots in {} seconds.'.format(len(character_stats), duration))
+    Logger.info('Ran {} pilots in {} seconds.'.format(len(character_stats), duration))
+
+    Logger.info(resolver.summary())
+    Logger.info('zKillboard rate limiter: {}'.format(ZKILL_LIMITER.summary()))
+    return character_stats, len(pilot_names) - len(filtered_pilot_data)
 
-def _filter_pilots(pilot_names, db):
+
+async def _filter_pilots(pilot_names, db, settings):
     """
-    Get ignoredList from config, filter our list of pilot_names based on the pilot names stored in ignoredList
+    Filter our list of pilot_names based on the pilot names stored in ignoredList
     Get pilot_map with _get_pilot_ids() containing dictionaries with both pilot_id and pilot_name
     Get pilot_affiliations with db.get_pilot_affiliations() which contains additional pilot_data (corp and alliance)
     :param pilot_names: List of pilot names
     :param db: EveDB object to run queries on
+    :param settings: optstore.Settings snapshot of the analysis
     :return: Filtered list
     """
-    ignore_list = config.OPTIONS_OBJECT.Get("ignoredList", default=[])
-    filtered_by_name = [p for p in pilot_names if p not in [i[1] for i in ignore_list]]
+    filtered_by_name = [p for p in pilot_names if p not in settings.ignored_names]
     if filtered_by_name is None:
         return None
     if len(filtered_by_name) == 0:
@@ -94,17 +238,17 @@ def _filter_pilots(pilot_names, db):
     start_time = time.time()
     Logger.info('Retrieving {} pilot IDs from CCP...'.format(len(filtered_by_name)))
     statusmsg.push_status('Retrieving {} pilot IDs from CCP...'.format(len(filtered_by_name)))
-    loop = asyncio.new_event_loop()
-    pilot_map = loop.run_until_complete(_get_pilot_ids(filtered_by_name, db))
-    loop.close()
+    with metrics.span('id_resolution'):
+        pilot_map = await _get_pilot_ids(filtered_by_name, db)
     logging.info('Retrieved {} pilot IDs from CCP in {} seconds.'.format(len(filtered_by_name),
                                                                          round(time.time() - start_time, 2)))
     statusmsg.push_status('Retrieved {} pilot IDs from CCP in {} seconds.'.format(len(filtered_by_name),
                                                                                   round(time.time() - start_time, 2)))
 
-    pilot_affiliations = db.get_pilot_affiliations([p for p in pilot_map if p is not None])
-    return [p for p in pilot_affiliations if p['corp_id'] not in [i[0] for i in ignore_list] and
-            p['alliance_id'] not in [i[0] for i in ignore_list]]
+    with metrics.span('affiliations'):
+        pilot_affiliations = await db.get_pilot_affiliations([p for p in pilot_map if p is not None])
+    return [p for p in pilot_affiliations if p['corp_id'] not in settings.ignored_ids and
+            p['alliance_id'] not in settings.ignored_ids]
 
 
 async def _get_pilot_ids(pilot_names, db):
@@ -118,90 +262,421 @@ async def _get_pilot_ids(pilot_names, db):
     return await asyncio.gather(*coros)
 
 
-def divide_chunks(my_list, n):
+def _get_priorities(pilots, visible, highlighted):
     """
-    Divide a list l into chunks of n size, yield each list as iterated
-    :param my_list: Original list
-    :param n: Size of chunks
-    :yield: Each chunk
+    _get_priority() of every pilot, run in an executor thread as it queries resultcache and pagecache
+    :param pilots: List of dictionaries of pilot data
+    :param visible: Set of pilot IDs visible in the grid
+    :param highlighted: Set of IDs in highlightedList
+    :return: List of priorities, in the order of pilots
     """
-    for i in range(0, len(my_list), n):
-        yield my_list[i:i + n]
+    return [_get_priority(p, visible, highlighted) for p in pilots]
 
 
-async def _concurrent_run_character(pilot_chunk, db, kills_loss):
+def _get_priority(pilot_data, visible, highlighted):
     """
-    Run pilot_data p through _get_kill_data() asynchronously and assemble all expanded pilot data via asyncio.gather()
-    :param pilot_chunk: List of pilot data stored as dictionaries
-    :param db: EveDB to use
-    :return: List of dictionaries containing expanded pilot data
+    Order in which pilots are analyzed, lower first: 0 pilots visible in the grid, 1 highlighted pilots, corporations
+    and alliances, 2 pilots whose row and zkill pages are cached so they finish instantly, 3 everybody else.
+    :param pilot_data: Dictionary of pilot data
+    :param visible: Set of pilot IDs visible in the grid
+    :param highlighted: Set of IDs in highlightedList
+    :return: Priority
     """
-    if kills_loss == 'kills':
-        coros = [_get_kill_data(p, db) for p in pilot_chunk]
-    if kills_loss == 'losses':
-        coros = [_get_loss_data(p, db) for p in pilot_chunk]
-    return await asyncio.gather(*coros)
+    if pilot_data['pilot_id'] in visible:
+        return 0
+    if highlighted.intersection([pilot_data['pilot_id'], pilot_data['corp_id'], pilot_data['alliance_id']]):
+        return 1
+    pages = pagecache.get_cache()
+    if resultcache.get_cache().has(pilot_data['pilot_id']) and all(
+            pages.is_fresh_url(_get_zkill_url(page, pilot_data['pilot_id'])) for page in ['kills', 'losses']):
+        return 2
+    return 3
+
+
+async def _get_pilot_data(pilot_data, db, resolver, settings):
+    """
+    Fetch the zkill kills and losses lists of a pilot at the same time, up to the maxKillmails budget and the
+    maxKillmailAge horizon. If resultcache holds a row computed from the same newest kill and loss, return it right
+    away. Otherwise run both lists through _get_kill_data() and _get_loss_data() at the same time, merge the loss stats
+    into the kill stats and cache the result. resultcache is read and written in the loop's executor.
+    :param pilot_data: Dictionary of pilot data
+    :param db: EveDB object to use
+    :param resolver: killmails.KillmailResolver shared by every pilot of the paste
+    :param settings: optstore.Settings snapshot of the analysis
+    :return: Dictionary of expanded pilot data
+    """
+    start_time = time.time()
+    max_killmails = settings.max_killmails
+    max_age = settings.max_killmail_age or None
+    with metrics.span('zkill_lists'):
+        kills, losses = await asyncio.gather(_get_zkill_list('kills', pilot_data, max_killmails, max_age, resolver),
+                                             _get_zkill_list('losses', pilot_data, max_killmails, max_age, resolver))
+
+    loop = asyncio.get_event_loop()
+    cache = resultcache.get_cache()
+    key = resultcache.make_key(pilot_data, max_killmails, kills, losses, max_age)
+    stats = await loop.run_in_executor(None, cache.get, pilot_data['pilot_id'], key)
+    if stats is not None:
+        Logger.info("Using cached result for {}.".format(pilot_data['pilot_name']))
+        statusmsg.count('cache_hits')
+        metrics.count('result_cache_hits')
+        for k in ['corp_name', 'alliance_name']:
+            stats[k] = pilot_data[k]
+        stats['process_time'] = time.time() - start_time
+        return stats
+
+    metrics.count('result_cache_misses')
+    stats, loss_stats = await asyncio.gather(_get_kill_data(pilot_data, kills, db, resolver, max_killmails),
+                                             _get_loss_data(pilot_data, losses, db, resolver, max_killmails))
+    stats.update(loss_stats)
+    stats['process_time'] = time.time() - start_time
+    await loop.run_in_executor(None, cache.put, pilot_data['pilot_id'], key, stats)
+    return stats
 
 
-async def _get_kill_data(pilot_data, db):
+async def _get_kill_data(pilot_data, zkill_data, db, resolver, max_killmails):
     """
-    Return zkill data for pilot using _get_zkill_data(). Merge with kill data from CCP fetched with
-    _merge_zkill_ccp_kills(). Finally, pass to _prepare_stats() for final processing and then return
+    Bring the pilot's kill accumulator up to date with zkill_data through _update_accumulator(), then finalize it
+    with _finalize_kills() and _format_stats() and resolve the associates names.
     :param pilot_data: Dictionary of pilot data
+    :param zkill_data: zkill kills list of the pilot, already cut to maxKillmails, or None
     :param db: EveDB object to use
+    :param resolver: killmails.KillmailResolver shared by every pilot of the paste
+    :param max_killmails: maxKillmails setting of the analysis
     :return: Dictionary of expanded pilot data
     """
     start_time = time.time()
-    zkill_data = await _get_zkill_data('kills', pilot_data['pilot_id'], pilot_data['pilot_name'])
-
     if not zkill_data:
-        stats = _get_stats_dictionary(pilot_data, ret_blank=True)
-        stats['process_time'] = time.time() - start_time
-        return stats
+        return _get_stats_dictionary(pilot_data, ret_blank=True)
 
-    zkill_data = zkill_data[:config.OPTIONS_OBJECT.Get("maxKillmails", default=50)]
-    merged_kills = await _merge_zkill_ccp_kills(zkill_data)
+    acc = await _update_accumulator('kills', pilot_data, zkill_data, db, resolver, max_killmails)
+    if not acc['processed_killmails']:
+        # None of the killmails could be resolved, which leaves nothing to make stats of
+        return _get_stats_dictionary(pilot_data, ret_blank=True)
 
     Logger.info("Retrieved kills data for {} in {} seconds.".format(pilot_data['pilot_name'], round(time.time() - start_time, 2)))
-    stats = _prepare_stats(pilot_data, merged_kills, db)
-    stats['process_time'] = time.time() - start_time
+    with metrics.span('stats'):
+        stats = _format_stats(_finalize_kills(acc, pilot_data), db)
+    stats['associates'] = await _get_associates(stats['associates'], db)
     return stats
 
 
-async def _get_zkill_data(page, pilot_id, pilot_name):
+async def _update_accumulator(kind, pilot_data, zkill_data, db, resolver, max_killmails):
+    """
+    Load the pilot's stored accumulator of kind from resultcache and bring it up to date with zkill_data. If
+    _plan_update() finds the stored window is a slid version of zkill_data, only the new killmails are merged and
+    added, and the killmails that fell out of the maxKillmails window are subtracted again. Otherwise every killmail
+    is merged and accumulated from scratch. The accumulating itself is done by _run_accumulate(). Counters come out
+    exactly as a full pass would, float sums like average_kill_value don't: adding and subtracting ISK values in a
+    different order drifts them by a few ULP from a full recompute, far below anything the grid shows. The stored
+    accumulator is read and written in the loop's executor.
+    :param kind: 'kills' or 'losses'
+    :param pilot_data: Dictionary of pilot data
+    :param zkill_data: zkill list of the pilot, already cut to maxKillmails
+    :param db: EveDB object to use
+    :param resolver: killmails.KillmailResolver shared by every pilot of the paste
+    :param max_killmails: maxKillmails setting of the analysis
+    :return: Up to date accumulator
+    """
+    new_accumulator = _get_kill_accumulator if kind == 'kills' else _get_loss_accumulator
+    loop = asyncio.get_event_loop()
+    cache = resultcache.get_cache()
+    acc = await loop.run_in_executor(None, cache.get_accumulator, pilot_data['pilot_id'], kind)
+    plan = _plan_update(acc, pilot_data, zkill_data, max_killmails)
+    if plan is not None:
+        added, dropped = plan
+        merged_added, merged_dropped = await asyncio.gather(resolver.merge(added), resolver.merge(dropped))
+        if len(merged_dropped) == len(dropped):
+            Logger.info('Updating {} accumulator of {}: {} added, {} dropped'.format(
+                kind, pilot_data['pilot_name'], len(merged_added), len(merged_dropped)))
+            acc = await _run_accumulate(kind, acc, pilot_data, [(merged_dropped, -1), (merged_added, 1)], db)
+            dropped_ids = set(z['killmail_id'] for z in dropped)
+            in_window = set(w['killmail_id'] for w in acc['window'] if w['killmail_id'] not in dropped_ids)
+            in_window.update(k.killmail_id for k in merged_added)
+            acc['window'] = [_window_entry(z) for z in zkill_data if z['killmail_id'] in in_window]
+        else:
+            # A killmail we have to subtract can't be resolved anymore, it's impossible to take it back out
+            plan = None
+    if plan is None:
+        merged = await resolver.merge(zkill_data)
+        acc = await _run_accumulate(kind, new_accumulator(pilot_data, max_killmails), pilot_data, [(merged, 1)], db)
+        resolved = set(k.killmail_id for k in merged)
+        acc['window'] = [_window_entry(z) for z in zkill_data if z['killmail_id'] in resolved]
+    await loop.run_in_executor(None, cache.put_accumulator, pilot_data['pilot_id'], kind, acc)
+    return acc
+
+
+async def _run_accumulate(kind, acc, pilot_data, batches, db):
+    """
+    Apply batches of killmails to an accumulator with _accumulate_batches(). Updates of at least
+    config.STATS_POOL_THRESHOLD killmails run in the statspool worker processes, so this event loop keeps fetching
+    while they are crunched, smaller ones run right here.
+    :param kind: 'kills' or 'losses'
+    :param acc: Accumulator to update
+    :param pilot_data: Dictionary of pilot data
+    :param batches: List of (killmails, sign) tuples, applied in order
+    :param db: EveDB object to use
+    :return: The updated accumulator, which is a new object if it came back from the pool
+    """
+    with metrics.span('stats'):
+        if statspool.use_pool(sum(len(batch) for batch, sign in batches)):
+            result = await statspool.accumulate(asyncio.get_event_loop(), kind, acc, pilot_data, batches)
+            if result is not None:
+                return result
+        return _accumulate_batches(kind, acc, pilot_data, batches, db)
+
+
+def _accumulate_batches(kind, acc, pilot_data, batches, db):
+    """
+    Apply batches of killmails to an accumulator, with the npstats engine when config.STATS_ENGINE asks for it and
+    numpy is installed, with _accumulate_kills() / _accumulate_losses() otherwise. Runs in statspool workers as well.
+    :param kind: 'kills' or 'losses'
+    :param acc: Accumulator to update
+    :param pilot_data: Dictionary of pilot data
+    :param batches: List of (killmails, sign) tuples, applied in order
+    :param db: EveDB object to use
+    :return: The updated accumulator
+    """
+    use_numpy = config.STATS_ENGINE == 'numpy' and npstats.AVAILABLE
+    if kind == 'kills':
+        accumulate = npstats.accumulate_kills if use_numpy else _accumulate_kills
+    else:
+        accumulate = npstats.accumulate_losses if use_numpy else _accumulate_losses
+    for batch, sign in batches:
+        accumulate(acc, pilot_data, batch, db, sign=sign)
+    return acc
+
+
+def _plan_update(acc, pilot_data, zkill_data, max_killmails):
+    """
+    Work out how a stored accumulator turns into one for zkill_data. That's only possible if it was built with the
+    same settings and affiliations, every killmail new to the window is newer than the ones kept, and every killmail
+    that left the window is older than the ones kept and isn't one of the recent killmails the accumulator remembers.
+    :param acc: Stored accumulator, or None
+    :param pilot_data: Dictionary of pilot data
+    :param zkill_data: zkill list of the pilot, already cut to maxKillmails
+    :param max_killmails: maxKillmails setting
+    :return: Tuple of (zkill entries to add, window entries to subtract), or None if a full pass is needed
     """
-    Request zkillboard page 1 from zkill for pilot_id, retry up to config.ZKILL_RETRY times with a brief delay between
-    requests of asyncio.sleep() * config.ZKILL_MULTIPLIER. If the pilot has no zkill, zkill returns an empty list []
-    and we return None for data. If data is still None after config.ZKILL_RETRY retries, return None
+    if acc is None or acc.get('version') != ACCUMULATOR_VERSION or acc['max_killmails'] != max_killmails or \
+            acc['corp_id'] != pilot_data['corp_id'] or acc['alliance_id'] != pilot_data['alliance_id']:
+        return None
+    window_ids = set(w['killmail_id'] for w in acc['window'])
+    zkill_ids = set(z['killmail_id'] for z in zkill_data)
+    kept = window_ids & zkill_ids
+    if not kept:
+        return None
+    added = [z for z in zkill_data if z['killmail_id'] not in window_ids]
+    dropped = [w for w in acc['window'] if w['killmail_id'] not in zkill_ids]
+    if any(z['killmail_id'] < max(kept) for z in added) or any(w['killmail_id'] > min(kept) for w in dropped):
+        return None
+    remembered = set(r[0] for r in acc['recent'])
+    if acc['last_used'] is not None:
+        remembered.add(acc['last_used'][0])
+    if any(w['killmail_id'] in remembered for w in dropped):
+        return None
+    return added, dropped
+
+
+def _window_entry(zkill):
+    """
+    :param zkill: zkill entry
+    :return: The part of a zkill entry an accumulator keeps to resolve the killmail again when it's subtracted
+    """
+    return {'killmail_id': zkill['killmail_id'],
+            'zkb': {'hash': zkill['zkb']['hash'], 'totalValue': zkill['zkb']['totalValue']}}
+
+
+def _count(counter, key, rank, sign):
+    """
+    Add or subtract one occurrence of key in an accumulator counter. Counters map key to [count, rank], rank being the
+    (killmail_id, -attacker index) of the newest occurrence, so _ranked() can restore the order the keys were first
+    seen in while walking killmails newest first. Keys are removed once their count reaches zero.
+    :param counter: Accumulator counter dictionary
+    :param key: Key to count
+    :param rank: Rank of this occurrence
+    :param sign: 1 to add, -1 to subtract
+    """
+    entry = counter.get(key)
+    if entry is None:
+        if sign > 0:
+            counter[key] = [1, rank]
+        return
+    entry[0] += sign
+    if entry[0] <= 0:
+        del counter[key]
+    elif rank > entry[1]:
+        entry[1] = rank
+
+
+def _ranked(counter):
+    """
+    :param counter: Accumulator counter dictionary
+    :return: Dictionary of key: count in the order the keys were first seen in
+    """
+    return {k: v[0] for k, v in sorted(counter.items(), key=lambda i: i[1][1], reverse=True)}
+
+
+async def _get_zkill_list(page, pilot_data, max_killmails, max_age, resolver):
+    """
+    Fetch as many zkill list pages as it takes to fill max_killmails. Page 1 is requested first, if it's full and the
+    budget needs more, the remaining pages are requested concurrently (every request still waits for ZKILL_LIMITER)
+    and paging stops at the first short page. With max_age set no further pages are requested once page 1 reaches
+    past the horizon, and the list is cut at the first killmail older than max_age days by _cut_to_horizon().
+    :param page: 'kills' or 'losses'
+    :param pilot_data: Dictionary of pilot data
+    :param max_killmails: maxKillmails setting
+    :param max_age: maxKillmailAge setting in days, or None for no horizon
+    :param resolver: killmails.KillmailResolver shared by every pilot of the paste
+    :return: zkill list of up to max_killmails entries newest first, or None
+    """
+    zkill_data = await _get_zkill_data(page, pilot_data['pilot_id'], pilot_data['pilot_name'])
+    if not zkill_data:
+        return None
+    zkill_data = list(zkill_data)
+    pages = min(-(-max_killmails // config.ZKILL_PAGE_SIZE), config.ZKILL_MAX_PAGES)
+    if pages > 1 and len(zkill_data) >= config.ZKILL_PAGE_SIZE and not (
+            max_age is not None and await _is_past_horizon(zkill_data[-1:], max_age, resolver)):
+        more = await asyncio.gather(*[_get_zkill_data(page, pilot_data['pilot_id'], pilot_data['pilot_name'], n)
+                                      for n in range(2, pages + 1)])
+        for p in more:
+            if not p:
+                break
+            zkill_data.extend(p)
+            if len(p) < config.ZKILL_PAGE_SIZE:
+                break
+    zkill_data = zkill_data[:max_killmails]
+    if max_age is not None:
+        zkill_data = await _cut_to_horizon(zkill_data, max_age, resolver)
+    return zkill_data if zkill_data else None
+
+
+def _get_horizon(max_age):
+    """
+    :param max_age: Age in days
+    :return: CCP formatted killmail_time max_age days ago, killmail_time strings compare in time order
+    """
+    return (datetime.datetime.utcnow() - datetime.timedelta(days=max_age)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+async def _is_past_horizon(zkill_data, max_age, resolver):
+    """
+    :param zkill_data: zkill entries to check
+    :param max_age: Age in days
+    :param resolver: killmails.KillmailResolver shared by every pilot of the paste
+    :return: Boolean, True if any of the killmails is older than max_age days
+    """
+    horizon = _get_horizon(max_age)
+    return any(k.killmail_time < horizon for k in await resolver.merge(zkill_data))
+
+
+async def _cut_to_horizon(zkill_data, max_age, resolver):
+    """
+    Drop every killmail older than max_age days from a zkill list. zkill lists are newest first, so if the oldest
+    entry is recent enough nothing is cut, otherwise the list is resolved in slices of config.HORIZON_SLICE from the
+    top until the first killmail past the horizon is found.
+    :param zkill_data: zkill list, newest first
+    :param max_age: Age in days
+    :param resolver: killmails.KillmailResolver shared by every pilot of the paste
+    :return: The part of zkill_data within the horizon
+    """
+    if not await _is_past_horizon(zkill_data[-1:], max_age, resolver):
+        return zkill_data
+    horizon = _get_horizon(max_age)
+    for start in range(0, len(zkill_data), config.HORIZON_SLICE):
+        part = zkill_data[start:start + config.HORIZON_SLICE]
+        ids = [z['killmail_id'] for z in part]
+        for killmail in await resolver.merge(part):
+            if killmail.killmail_time < horizon:
+                return zkill_data[:start + ids.index(killmail.killmail_id)]
+    return zkill_data
+
+
+def _get_zkill_url(page, pilot_id, page_number=1):
+    return "{}/api/{}/characterID/{}/page/{}/".format(config.ZKILL_URL, page, pilot_id, page_number)
+
+
+async def _get_zkill_data(page, pilot_id, pilot_name, page_number=1):
+    """
+    Request one zkillboard list page from zkill for pilot_id. Pages are served from pagecache while younger than
+    config.ZKILL_PAGE_TTL, older cached pages are revalidated with If-None-Match / If-Modified-Since. pagecache reads
+    and writes are SQLite queries, they run in the loop's executor so they never stall other pilots. Every request
+    waits for a slot from the shared ZKILL_LIMITER token bucket. If zkill answers 429/503 or sends Retry-After, the
+    whole bucket is pushed back accordingly. Other client errors (4xx) are final. Server and network errors and bodies
+    that aren't a list are never cached and are retried up to config.ZKILL_RETRY times with an increasing delay. If the pilot has no zkill, zkill returns an empty list [] and we return None for data. If data is
+    still None after config.ZKILL_RETRY retries, return the stale cached page if we have one, otherwise None
+    :param page: 'kills' or 'losses'
     :param pilot_id: Pilot ID
     :param pilot_name: Pilot name
+    :param page_number: Page of the list to request
     :return: Data if retrieved, otherwise None
     """
-    url = "https://zkillboard.com/api/{}/characterID/{}/page/{}/".format(page, pilot_id, 1)
-    headers = {'Accept-Encoding': 'gzip', 'User-Agent': 'HawkEye, Author: Kain Tarr'}
-    statusmsg.push_status('Requesting {}'.format(url))
+    url = _get_zkill_url(page, pilot_id, page_number)
+    loop = asyncio.get_event_loop()
+    cache = pagecache.get_cache()
+    cached = await loop.run_in_executor(None, cache.get, url)
+    if cache.is_fresh(cached):
+        Logger.info('Using cached {}'.format(url))
+        statusmsg.count('cache_hits')
+        metrics.count('zkill_page_hits')
+        return cached.data
+    metrics.count('zkill_page_misses')
+
+    headers = {}
+    if cached is not None and cached.etag:
+        headers['If-None-Match'] = cached.etag
+    if cached is not None and cached.last_modified:
+        headers['If-Modified-Since'] = cached.last_modified
     Logger.info('Requesting {}'.format(url))
     start_time = time.time()
-    data = None
-    async with ClientSession() as session:
-        retry = 0
-        while True and not config.OPTIONS_OBJECT.Get("stop", False):
-            if retry == config.ZKILL_RETRY:
-                break
-            try:
+    data = cached.data if cached is not None else None
+    session = httpclient.get_session()
+    retry = 0
+    while True:
+        if retry == config.ZKILL_RETRY:
+            break
+        await ZKILL_LIMITER.acquire()
+        metrics.count('zkill_requests')
+        try:
+            with statusmsg.request():
                 async with session.get(url, headers=headers) as resp:
-                    await asyncio.sleep(random.random() * config.ZKILL_MULTIPLIER)
+                    if resp.status == 304 and cached is not None:
+                        Logger.info('{} not modified'.format(url))
+                        statusmsg.count('cache_hits')
+                        metrics.count('zkill_page_revalidated')
+                        await loop.run_in_executor(None, cache.touch, cached)
+                        break
+                    if resp.status in (429, 503) or (resp.status != 200 and 'Retry-After' in resp.headers):
+                        wait = ratelimit.retry_after(resp.headers, config.ZKILL_BACKOFF)
+                        Logger.warning('zKillboard returned {}, backing off {} seconds'.format(resp.status, wait))
+                        ZKILL_LIMITER.penalize(wait)
+                        metrics.count('zkill_retries')
+                        retry += 1
+                        continue
+                    if 400 <= resp.status < 500:
+                        # Client errors fail the same way again, settle for the stale page or nothing right away
+                        Logger.warning('zKillboard returned {} for {}, not retrying'.format(resp.status, url))
+                        break
+                    if resp.status != 200:
+                        # Never parse or cache an error page, it would be served as the pilot's killboard
+                        raise ValueError('zKillboard returned {}'.format(resp.status))
                     text = await resp.text()
-                    if text == "[]":
-                        Logger.info('Returning empty killboard for {}'.format(pilot_name))
-                        return data
-                    data = await resp.json()
-                break
-            except Exception as e:
-                Logger.warning('Failed to get kills page for {} : {}'.format(pilot_name, url))
-                retry += 1
-                await asyncio.sleep(random.random() * config.ZKILL_MULTIPLIER)
-    statusmsg.push_status('Requested {} and got it in {} seconds'.format(url, round(time.time() - start_time, 2)))
+                    metrics.count('zkill_bytes', len(text))
+                    etag = resp.headers.get('ETag')
+                    last_modified = resp.headers.get('Last-Modified')
+            data = json.loads(text) if text != "[]" else None
+            if data is not None and not isinstance(data, list):
+                raise ValueError('zKillboard returned {} instead of a list'.format(type(data).__name__))
+            await loop.run_in_executor(None, cache.put, url, etag, last_modified, data)
+            if data is None:
+                Logger.info('Returning empty killboard for {}'.format(pilot_name))
+                return data
+            break
+        except Exception as e:
+            Logger.warning('Failed to get kills page for {} : {} ({})'.format(pilot_name, url, e))
+            metrics.count('zkill_retries')
+            retry += 1
+            await asyncio.sleep(min(config.ZKILL_BACKOFF * retry, 10))
     Logger.info('Requested {} and got it in {} seconds'.format(url, round(time.time() - start_time, 2)))
     return data
 
@@ -259,214 +734,163 @@ def _get_stats_dictionary(pilot_data, ret_blank=False):
     return stats
 
 
-async def _merge_zkill_ccp_kills(data):
-    """
-    Try to fetch kills locally using _fetch_local() if available and store them in result_killmails. Rehash data to
-    remove the killmails that were found locally. Pass the remaining killmails as data to CCP via _fetch(). Finally,
-    merge the zkill data with the CCP kill data, matching on killmail_id and merging into a list of dictionaries
-    :param data: zkill data
-    :return: The merged killmail data from zkill and CCP as result_killmails
-    """
-    result_killmails = []
-
-    for zkill in data:
-        r = _fetch_local(zkill['killmail_id'])
-        if r:
-            new_dict = {}
-            for k in zkill:
-                new_dict[k] = zkill[k]
-            for k in r:
-                new_dict[k] = r[k]
-            result_killmails.append(new_dict)
-    data[:] = [z for z in data if z['killmail_id'] not in [d['killmail_id'] for d in result_killmails]]
-    Logger.info('Got {} killmails from local cache.'.format(len(result_killmails)))
-
-    ccp_kills = []
-    if len(data) > 0:
-        statusmsg.push_status('Gathering {} killmails from CCP servers.'.format(len(data)))
-        Logger.info('Gathering {} killmails from CCP servers.'.format(len(data)))
-        start_time = time.time()
-        async with ClientSession() as session:
-            for d in data:
-                att = asyncio.ensure_future(_fetch(d['killmail_id'], d['zkb']['hash'], session))
-                ccp_kills.append(att)
-
-            results = await asyncio.gather(*ccp_kills)
-        statusmsg.push_status('Gathered {} killmails from CCP servers in {} seconds'.format(
-            len(data), round(time.time() - start_time, 2)))
-        Logger.info('Gathered {} killmails from CCP servers in {} seconds'.format(
-            len(data), round(time.time() - start_time, 2)))
-
-        for zkill in data:
-            for ccpkill in results:
-                try:
-                    if zkill['killmail_id'] == ccpkill['killmail_id']:
-                        new_dict = {}
-                        for k in zkill:
-                            new_dict[k] = zkill[k]
-                        for k in ccpkill:
-                            new_dict[k] = ccpkill[k]
-                        result_killmails.append(new_dict)
-                except Exception as e:
-                    Logger.error(zkill)
-                    Logger.error(ccpkill)
-                    raise e
-    return result_killmails
-
-
-def _fetch_local(killmail_id):
-    """
-    Try to fetch a killmail locally (stored as json)
-    :param killmail_id: Killmail ID
-    :return: json file if found, otherwise None
+def _get_kill_accumulator(pilot_data, max_killmails):
     """
-    try:
-        with open(os.path.join(config.PREF_PATH, 'kills/{}.json'.format(killmail_id)), 'r') as json_file:
-            return json.load(json_file)
-    except FileNotFoundError:
-        return None
+    Fresh kill accumulator: the additive part of _get_stats_dictionary() plus what's needed to update it later.
+    :param pilot_data: Pilot data to use
+    :param max_killmails: maxKillmails setting the accumulator is built for
+    :return: Accumulator dictionary
+    """
+    return {
+        'version': ACCUMULATOR_VERSION,
+        'max_killmails': max_killmails,
+        'corp_id': pilot_data['corp_id'],
+        'alliance_id': pilot_data['alliance_id'],
+        'window': [],
+        'recent': [],
+        'last_used': None,
+        'associates': {},
+        'autz': {'kills': 0.01, 'attackers': 0},
+        'average_kill_value': 0,
+        'average_pilots': 0,
+        'avg_10': 0,
+        'avg_gang': 0,
+        'blops_use': 0,
+        'boy_scout': 0,
+        'buttbuddies': {},
+        'capital_use': 0,
+        'cyno': 0,
+        'eutz': {'kills': 0.01, 'attackers': 0},
+        'pro_10': 0,
+        'pro_gang': 0,
+        'processed_killmails': 0,
+        'smartbomb': 0,
+        'super': 0,
+        'titan': 0,
+        'top_10_ships': {},
+        'top_gang_ships': {},
+        'top_regions': {},
+        'top_ships': {},
+        'top_space': {},
+        'ustz': {'kills': 0.01, 'attackers': 0}
+    }
 
 
-async def _fetch(killmail_id, killhash, session):
-    """
-    Fetch killmail from CCP servers.
-    :param killmail_id: Killmail ID
-    :param killhash: Killmail hash
-    :param session: Session to use
-    :return: json response parsed into dictionary
+def _accumulate_kills(acc, pilot_data, killmails, db, sign=1):
     """
-
-    url = "https://esi.evetech.net/v1/killmails/{}/{}/?datasource=tranquility".format(killmail_id, killhash)
-    while True and not config.OPTIONS_OBJECT.Get("stop", False):
-        async with session.get(url) as response:
-            r = await response.read()
-            try:
-                j = json.loads(r)
-            except json.decoder.JSONDecodeError:
-                await asyncio.sleep(0.25)
-                continue
-            if j.get('error'):
-                await asyncio.sleep(0.25)
-                continue
-            with open(os.path.join(config.PREF_PATH, 'kills/{}.json'.format(killmail_id)), 'w') as file:
-                json.dump(j, file)
-            return j
-    return None
-
-
-def _prepare_stats(pilot_data, killmails, db):
-    """
-    Process a list of killmails stored as dictionaries, assign a lot of attributes to stats, then pass to
-    _format_stats() for final calculations.
+    Add (or with sign=-1 subtract) a list of killmails.KillRecords to a kill accumulator. Killmails have to be passed
+    newest first, as zkill lists them.
+    :param acc: Accumulator from _get_kill_accumulator()
     :param pilot_data: Pilot data to use
-    :param killmails: List of dictionaries containing killmails
+    :param killmails: List of KillRecords
     :param db: EveDB to use
-    :return: Enriched stats
+    :param sign: 1 to add the killmails, -1 to subtract them
     """
-
-    stats = _get_stats_dictionary(pilot_data)
+    recent = []
+    last_used = None
     for killmail in killmails:
-        stats['processed_killmails'] += 1
+        killmail_id = killmail.killmail_id
+        attackers = killmail.attackers
+        acc['processed_killmails'] += sign
         # Valuations, fleet sizes, and ship types in small or large fleets
-        stats['average_kill_value'] += float(killmail['zkb']['totalValue'])
-        stats['average_pilots'] += len(killmail['attackers'])
-        if len(killmail['attackers']) > 9:
-            stats['avg_10'] += len(killmail['attackers'])
-            stats['pro_10'] += 1
+        acc['average_kill_value'] += sign * killmail.value
+        acc['average_pilots'] += sign * len(attackers)
+        if len(attackers) > 9:
+            acc['avg_10'] += sign * len(attackers)
+            acc['pro_10'] += sign
         else:
-            stats['avg_gang'] += len(killmail['attackers'])
-            stats['pro_gang'] += 1
-        for attacker in killmail['attackers']:
-            if attacker.get('character_id') == pilot_data['pilot_id']:
-                if stats['last_used_ship'] is None:
-                    stats['last_used_ship'] = db.get_ship_name(attacker.get('ship_type_id'))
-                    stats['last_kill_attackers'] = len(killmail['attackers'])
-                stats['top_ships'] = _add_to_dict(stats['top_ships'], attacker.get('ship_type_id'))
-                if len(killmail['attackers']) > 9:
-                    stats['top_10_ships'] = _add_to_dict(stats['top_10_ships'], attacker.get('ship_type_id'))
+            acc['avg_gang'] += sign * len(attackers)
+            acc['pro_gang'] += sign
+        mine = []
+        for index, attacker in enumerate(attackers):
+            rank = (killmail_id, -index)
+            if attacker.character_id == pilot_data['pilot_id']:
+                mine.append(attacker)
+                if sign > 0 and (last_used is None or last_used[1] is None):
+                    last_used = (killmail_id, db.get_ship_name(attacker.ship_type_id), len(attackers))
+                _count(acc['top_ships'], attacker.ship_type_id, rank, sign)
+                if len(attackers) > 9:
+                    _count(acc['top_10_ships'], attacker.ship_type_id, rank, sign)
                 else:
-                    stats['top_gang_ships'] = _add_to_dict(stats['top_gang_ships'], attacker.get('ship_type_id'))
+                    _count(acc['top_gang_ships'], attacker.ship_type_id, rank, sign)
             else:
-                stats['buttbuddies'] = _add_to_dict(stats['buttbuddies'], attacker.get('character_id'))  # Not used, but maybe someday
+                _count(acc['buttbuddies'], attacker.character_id, rank, sign)  # Not used, but maybe someday
 
         # Location and timezone
-        stats['top_regions'] = _add_to_dict(stats['top_regions'], db.get_region(killmail['solar_system_id']))
-        stats['top_space'] = _add_to_dict(stats['top_space'], db.get_location(killmail['solar_system_id']))
-        stats[_get_timezone(killmail['killmail_time'])]['kills'] += 1
-        stats[_get_timezone(killmail['killmail_time'])]['attackers'] += len(killmail['attackers'])
-
-        # Add to our list of recent kills
-        if len(stats['last_five_kills']) < 5:
-            stats['last_five_kills'].append({
-                # 'victim': db.get_pilot_name(killmail['victim'].get('character_id')),
-                'victim_ship': db.get_ship_name(killmail['victim']['ship_type_id']),
-                'attackers': len(killmail['attackers']),
-                'killed_when': (datetime.date.today() - datetime.datetime.strptime(
-                    killmail['killmail_time'].split('T')[0], '%Y-%m-%d').date()).days,
-                'killmail_time': datetime.datetime.strptime(killmail['killmail_time'].split('T')[0], '%Y-%m-%d')
-            })
+        _count(acc['top_regions'], killmail.region, (killmail_id, 0), sign)
+        _count(acc['top_space'], killmail.space, (killmail_id, 0), sign)
+        acc[killmail.tz]['kills'] += sign
+        acc[killmail.tz]['attackers'] += sign * len(attackers)
+
+        # Remember the newest kills, killed_when is filled in by _finalize_kills()
+        if sign > 0 and len(recent) < 5:
+            recent.append((killmail_id, {
+                'victim_ship': db.get_ship_name(killmail.victim_ship_type_id),
+                'attackers': len(attackers),
+                'killmail_time': datetime.datetime.strptime(killmail.killmail_time.split('T')[0], '%Y-%m-%d')
+            }))
 
         # Kill attributes (using certain ships etc.)
-        if db.killed_on_gate(killmail) and not(db.used_capital(killmail['attackers'], pilot_data['pilot_id'])) and not(
-                db.used_blops(killmail['attackers'], pilot_data['pilot_id'])):
-            stats['boy_scout'] += 1  # Gatecamping
-        if db.used_cyno(killmail['attackers'], pilot_data['pilot_id']):
-            stats['cyno'] += 1
-        if db.used_capital(killmail['attackers'], pilot_data['pilot_id']):
-            stats['capital_use'] += 1
-        if db.used_blops(killmail['attackers'], pilot_data['pilot_id']):
-            stats['blops_use'] += 1
-        if db.used_smartbomb(killmail['attackers'], pilot_data['pilot_id']):
-            stats['smartbomb'] += 1
-        if db.used_super(killmail['attackers'], pilot_data['pilot_id']):
-            stats['super'] += 1
-        if db.used_titan(killmail['attackers'], pilot_data['pilot_id']):
-            stats['titan'] += 1
+        capital = any(db.is_capital(a.ship_type_id) for a in mine)
+        blops = any(a.ship_type_id in db.blops for a in mine)
+        if killmail.on_gate and not capital and not blops:
+            acc['boy_scout'] += sign  # Gatecamping
+        if any(db.is_recon(a.ship_type_id) for a in mine):
+            acc['cyno'] += sign
+        if capital:
+            acc['capital_use'] += sign
+        if blops:
+            acc['blops_use'] += sign
+        if any(a.weapon_type_id in db.smartbomb_ids for a in mine):
+            acc['smartbomb'] += sign
+        if any(db.is_super(a.ship_type_id) for a in mine):
+            acc['super'] += sign
+        if any(db.is_titan(a.ship_type_id) for a in mine):
+            acc['titan'] += sign
 
         # Associates
-        for attacker in killmail['attackers']:
-            if attacker.get('character_id') is not None and attacker.get(
-                    'character_id') != pilot_data['pilot_id'] and attacker.get(
-                        'corp_id') != pilot_data['corp_id'] and attacker.get('alliance_id') != pilot_data['alliance_id']:
-                _add_to_dict(stats['associates'], attacker.get('alliance_id') if attacker.get(
-                    'alliance_id') else attacker['corporation_id'])
+        for index, attacker in enumerate(attackers):
+            if attacker.character_id is not None and attacker.character_id != pilot_data['pilot_id'] and \
+                    attacker.corp_id != pilot_data['corp_id'] and attacker.alliance_id != pilot_data['alliance_id']:
+                _count(acc['associates'], attacker.alliance_id if attacker.alliance_id else attacker.corporation_id,
+                       (killmail_id, -index), sign)
 
-    return _format_stats(stats, db)
+    if sign > 0:
+        acc['recent'] = (recent + acc['recent'])[:5]
+        if last_used is not None and (last_used[1] is not None or acc['last_used'] is None):
+            acc['last_used'] = last_used
 
 
-def _add_to_dict(my_dict, key):
+def _finalize_kills(acc, pilot_data):
     """
-    Add 1 to a key if it exists in a dictionary, otherwise add it as a new key with value 1 to the dictionary, and
-    return the dictionary.
-    :param my_dict: Original dictionary
-    :param key: Key to update/add
-    :return: Return the updated dictionary
+    Turn a kill accumulator into the stats dictionary _format_stats() expects.
+    :param acc: Accumulator from _get_kill_accumulator()
+    :param pilot_data: Pilot data to use
+    :return: Stats dictionary
     """
-    try:
-        if my_dict.get(key):
-            my_dict[key] += 1
-        else:
-            my_dict[key] = 1
-    except AttributeError:
-        return {key: 1}
-    return my_dict
+    stats = _get_stats_dictionary(pilot_data)
+    for k in ['average_kill_value', 'average_pilots', 'avg_10', 'avg_gang', 'blops_use', 'boy_scout', 'capital_use',
+              'cyno', 'pro_10', 'pro_gang', 'processed_killmails', 'smartbomb', 'super', 'titan']:
+        stats[k] = acc[k]
+    for tz in ['autz', 'eutz', 'ustz']:
+        stats[tz] = dict(acc[tz])
+    for k in ['top_10_ships', 'top_gang_ships', 'top_regions', 'top_ships']:
+        stats[k] = _ranked(acc[k]) if acc[k] else None
+    for k in ['associates', 'buttbuddies', 'top_space']:
+        stats[k] = _ranked(acc[k])
+    if acc['last_used'] is not None:
+        stats['last_used_ship'], stats['last_kill_attackers'] = acc['last_used'][1:]
+    stats['last_five_kills'] = _finalize_recent(acc['recent'])
+    return stats
 
 
-def _get_timezone(my_time):
+def _finalize_recent(recent):
     """
-    Take a string timezone with CCP's weird formatting, determine timezone by the hour of the kill:
-    00:00 - 06:00 USTZ
-    06:00 - 14:00 AUTZ
-    14:00 - 00:00 EUTZ
-    :param my_time: Input time string
-    :return: Timezone
+    :param recent: Recent kills or losses kept by an accumulator
+    :return: List of kill dictionaries with killed_when counted from today
     """
-    my_time = my_time.split('T')[1].split(':')
-    if int(my_time[0]) < 6:
-        return 'ustz'
-    if int(my_time[0]) < 14:
-        return 'autz'
-    return 'eutz'
+    today = datetime.date.today()
+    return [dict(kill, killed_when=(today - kill['killmail_time'].date()).days) for killmail_id, kill in recent]
 
 
 def _format_stats(stats, db):
@@ -483,13 +907,13 @@ def _format_stats(stats, db):
     stats['avg_gang'] = round(stats['avg_gang'] / (stats['pro_gang'] + 0.01))
     if stats['top_ships'] is not None:
         stats['top_ships'] = ', '.join(
-            s for s in [db.get_ship_name(i) for i in _get_top_three(stats['top_ships'])] if s is not None)
+            s for s in db.get_ship_names(_get_top_three(stats['top_ships']) or []) if s is not None)
     if stats['top_10_ships'] is not None:
         stats['top_10_ships'] = ', '.join(
-            s for s in [db.get_ship_name(i) for i in _get_top_three(stats['top_10_ships'])] if s is not None)
+            s for s in db.get_ship_names(_get_top_three(stats['top_10_ships']) or []) if s is not None)
     if stats['top_gang_ships'] is not None:
         stats['top_gang_ships'] = ', '.join(
-            s for s in [db.get_ship_name(i) for i in _get_top_three(stats['top_gang_ships'])] if s is not None)
+            s for s in db.get_ship_names(_get_top_three(stats['top_gang_ships']) or []) if s is not None)
 
     # Location and timezone
     if stats['top_regions'] is not None:
@@ -502,15 +926,18 @@ def _format_stats(stats, db):
         stats[timezone]['kills'] / (stats['processed_killmails'] + 0.01) * 100), stats['average_pilots'])
 
     space_types = [t for t in ['highsec', 'lowsec', 'nullsec', 'wormhole'] if t in stats['top_space'].keys()]
-    activity = space_types[0]
-    for space in space_types:
-        if stats['top_space'].get(space) > stats['top_space'].get(activity):
-            activity = space
-    stats['top_space'] = '{}{} ({}%)'.format(activity[0].upper(), activity[1:], round(
-        stats['top_space'][activity] / (stats['processed_killmails'] + 0.01) * 100))
+    if space_types:
+        activity = space_types[0]
+        for space in space_types:
+            if stats['top_space'].get(space) > stats['top_space'].get(activity):
+                activity = space
+        stats['top_space'] = '{}{} ({}%)'.format(activity[0].upper(), activity[1:], round(
+            stats['top_space'][activity] / (stats['processed_killmails'] + 0.01) * 100))
+    else:
+        stats['top_space'] = None
 
     # Recent kill details
-    stats['last_kill'] = stats['last_five_kills'][0]['killed_when']
+    stats['last_kill'] = stats['last_five_kills'][0]['killed_when'] if stats['last_five_kills'] else None
 
     # Kill attributes (using certain ships etc.)
     stats['cyno'] = stats['cyno'] / (stats['processed_killmails'] + 0.01)
@@ -535,9 +962,8 @@ def _format_stats(stats, db):
     if stats['boy_scout'] > config.GATECAMP_HL_PERCENTAGE:
         stats['warning'] = _add_string(stats['warning'], 'GATECAMPER')
 
-    # Associates
-    stats['associates'] = _get_associates(stats['associates'], db)
-    stats['associates'] = ', '.join(n for n in stats['associates']) if stats['associates'] else None
+    # Associates, top three entity IDs only, names are resolved by _get_associates()
+    stats['associates'] = _get_top_three(stats['associates'])
     return stats
 
 
@@ -568,11 +994,16 @@ def _add_string(o, n):
     return '{} + {}'.format(o, n)
 
 
-def _get_associates(associates, db):
-    associates = _get_top_three(associates)
+async def _get_associates(associates, db):
+    """
+    Resolve the top three associate entity IDs picked by _format_stats() to a comma separated string of names.
+    :param associates: List of up to three corporation/alliance IDs
+    :param db: EveDB to use
+    :return: String of associate names, or None
+    """
     if associates is None:
         return None
-    affil_names = db.get_affil_names(associates)
+    affil_names = await db.get_affil_names(associates)
 
     assoc_ret = []
 
@@ -584,26 +1015,29 @@ def _get_associates(associates, db):
     for x in assoc_ret:
         if x not in unique_list:
             unique_list.append(x)
-    return unique_list
+    return ', '.join(n for n in unique_list) if unique_list else None
 
 
-async def _get_loss_data(pilot_data, db):
+async def _get_loss_data(pilot_data, zkill_data, db, resolver, max_killmails):
     """
-    Return zkill data for pilot using _get_zkill_data(). Merge with kill data from CCP fetched with
-    _merge_zkill_ccp_kills(). Finally, pass to _prepare_stats() for final processing and then return
+    Bring the pilot's loss accumulator up to date with zkill_data through _update_accumulator(), then finalize it with
+    _finalize_losses() and _format_loss_stats()
     :param pilot_data: Dictionary of pilot data
+    :param zkill_data: zkill losses list of the pilot, already cut to maxKillmails, or None
     :param db: EveDB object to use
+    :param resolver: killmails.KillmailResolver shared by every pilot of the paste
+    :param max_killmails: maxKillmails setting of the analysis
     :return: Dictionary of expanded pilot data
     """
-    zkill_data = await _get_zkill_data('losses', pilot_data['pilot_id'], pilot_data['pilot_name'])
-
     if not zkill_data:
         return _get_loss_stats(pilot_data, ret_blank=True)
 
-    zkill_data = zkill_data[:config.OPTIONS_OBJECT.Get("maxKillmails", default=50)]
-    merged_losses = await _merge_zkill_ccp_kills(zkill_data)
+    acc = await _update_accumulator('losses', pilot_data, zkill_data, db, resolver, max_killmails)
+    if not acc['processed_lossmails']:
+        return _get_loss_stats(pilot_data, ret_blank=True)
 
-    stats = _prepare_loss_stats(pilot_data, merged_losses, db)
+    with metrics.span('stats'):
+        stats = _format_loss_stats(_finalize_losses(acc, pilot_data))
     return stats
 
 
@@ -622,33 +1056,59 @@ def _get_loss_stats(pilot_data, ret_blank=False):
     return stats
 
 
-def _prepare_loss_stats(pilot_data, merged_losses, db):
-    stats = _get_loss_stats(pilot_data)
+def _get_loss_accumulator(pilot_data, max_killmails):
+    return {
+        'version': ACCUMULATOR_VERSION,
+        'max_killmails': max_killmails,
+        'corp_id': pilot_data['corp_id'],
+        'alliance_id': pilot_data['alliance_id'],
+        'window': [],
+        'recent': [],
+        'last_used': None,
+        'average_loss_value': 0,
+        'processed_lossmails': 0,
+        'top_lost_ships': {}
+    }
 
+
+def _accumulate_losses(acc, pilot_data, merged_losses, db, sign=1):
+    recent = []
+    last_used = None
     for loss in merged_losses:
-        stats['processed_lossmails'] += 1
-        stats['average_loss_value'] += float(loss['zkb']['totalValue'])
+        acc['processed_lossmails'] += sign
+        acc['average_loss_value'] += sign * loss.value
+
+        ship = db.get_ship_name(loss.victim_ship_type_id)
+        if sign > 0 and (last_used is None or last_used[1] is None):
+            last_used = (loss.killmail_id, ship, len(loss.attackers))
+        _count(acc['top_lost_ships'], ship, (loss.killmail_id, 0), sign)
+
+        if sign > 0 and len(recent) < 5:
+            recent.append((loss.killmail_id, {
+                'victim_ship': ship,
+                'attackers': len(loss.attackers),
+                'killmail_time': datetime.datetime.strptime(loss.killmail_time.split('T')[0], '%Y-%m-%d')
+            }))
 
-        if stats['last_lost_ship'] is None:
-            stats['last_lost_ship'] = db.get_ship_name(loss['victim'].get('ship_type_id'))
-            stats['last_loss_attackers'] = len(loss['attackers'])
-        stats['top_lost_ships'] = _add_to_dict(stats['top_lost_ships'], db.get_ship_name(loss['victim'].get('ship_type_id')))
+    if sign > 0:
+        acc['recent'] = (recent + acc['recent'])[:5]
+        if last_used is not None and (last_used[1] is not None or acc['last_used'] is None):
+            acc['last_used'] = last_used
 
-        if len(stats['last_five_losses']) < 5:
-            stats['last_five_losses'].append({
-                # 'victim': db.get_pilot_name(loss['victim'].get('character_id')),
-                'victim_ship': db.get_ship_name(loss['victim']['ship_type_id']),
-                'attackers': len(loss['attackers']),
-                'killed_when': (datetime.date.today() - datetime.datetime.strptime(
-                    loss['killmail_time'].split('T')[0], '%Y-%m-%d').date()).days,
-                'killmail_time': datetime.datetime.strptime(loss['killmail_time'].split('T')[0], '%Y-%m-%d')
-            })
 
-    return _format_loss_stats(stats)
+def _finalize_losses(acc, pilot_data):
+    stats = _get_loss_stats(pilot_data)
+    stats['processed_lossmails'] = acc['processed_lossmails']
+    stats['average_loss_value'] = acc['average_loss_value']
+    stats['top_lost_ships'] = _ranked(acc['top_lost_ships'])
+    if acc['last_used'] is not None:
+        stats['last_lost_ship'], stats['last_loss_attackers'] = acc['last_used'][1:]
+    stats['last_five_losses'] = _finalize_recent(acc['recent'])
+    return stats
 
 
 def _format_loss_stats(stats):
     stats['top_lost_ships'] = ', '.join(s for s in _get_top_three(stats['top_lost_ships']))
     stats['average_loss_value'] = stats['average_loss_value'] / (stats['processed_lossmails'] + 0.01)
-    stats['last_loss'] = stats['last_five_losses'][0]['killed_when']
+    stats['last_loss'] = stats['last_five_losses'][0]['killed_when'] if stats['last_five_losses'] else None
     return stats
@@ -0,0 +1,501 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Offline benchmark suite. Starts a local aiohttp server that plays zKillboard, ESI and Fuzzwork for a deterministic
+synthetic universe (pilots, corporations, alliances, killmails and the static data CSVs), with configurable latency,
+error rate and zKillboard rate limit. Recorded responses can be replayed instead of the synthetic ones by dropping them
+into a --replay directory. Every local size is then analyzed through headless.run() in a child process pointed at the
+mock server with HAWKEYE_PREF_PATH and the HAWKEYE_*_URL overrides, and pilots per second, requests per pilot,
+p50/p95 per pilot latency and peak RSS are reported. Needs no network.
+
+    python benchmark.py --sizes 10 100 500 2000 --latency 50 --error-rate 0.01 --runs 2
+"""
+import argparse
+import asyncio
+import collections
+import config
+import csv
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from aiohttp import web
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not on Windows, peak RSS is not reported there
+
+Logger = logging.getLogger(__name__)
+
+SHIP_GROUPS = {25: 'Frigate', 26: 'Cruiser', 419: 'Battlecruiser', 27: 'Battleship', 237: 'Corvette',
+               833: 'Force Recon Ship', 898: 'Black Ops', 485: 'Dreadnought', 547: 'Carrier', 659: 'Supercarrier',
+               30: 'Titan'}
+SHIP_WEIGHTS = {25: 30, 26: 25, 419: 15, 27: 10, 237: 3, 833: 5, 898: 3, 485: 3, 547: 3, 659: 2, 30: 1}
+WEAPON_GROUPS = {55: 'Projectile Weapon', 53: 'Energy Weapon', 72: 'Smart Bomb'}
+SECURITY = [0.9, 0.7, 0.5, 0.3, 0.1, -0.2, -0.6, -0.99]  # -0.99 is wormhole space
+STATIC_FILES = ['invTypes.csv', 'invGroups.csv', 'mapSolarSystems.csv', 'mapRegions.csv', 'mapDenormalize.csv']
+
+
+class Universe:
+    def __init__(self, pilots, seed=1, killmails_per_pilot=20):
+        """
+        Deterministic synthetic universe. Pilots fly in corporations of 10, five corporations to an alliance (every
+        fourth corporation is unaligned). Killmails are generated per corporation, attackers are mostly corporation
+        mates so pilots share killmails the way a real local does, victims are random pilots.
+        :param pilots: Number of pilots
+        :param seed: Random seed
+        :param killmails_per_pilot: Killmails generated per pilot of a corporation
+        """
+        r = random.Random(seed)
+        self.pilot_ids = [90000000 + i for i in range(pilots)]
+        self.names = {p: 'Bench Pilot {}'.format(i) for i, p in enumerate(self.pilot_ids)}
+        self.ids = {n: p for p, n in self.names.items()}
+        self.corp = {p: 98000000 + i // 10 for i, p in enumerate(self.pilot_ids)}
+        self.alliance = {}
+        for p, c in self.corp.items():
+            self.alliance[p] = None if (c - 98000000) % 4 == 3 else 99000000 + (c - 98000000) // 5
+        self.entity_names = {c: 'Bench Corporation {}'.format(c - 98000000) for c in self.corp.values()}
+        self.entity_names.update({a: 'Bench Alliance {}'.format(a - 99000000)
+                                  for a in self.alliance.values() if a is not None})
+
+        self.ships = {g: [g * 100 + j for j in range(3)] for g in SHIP_GROUPS}
+        self.weapons = {g: [g * 100 + j for j in range(3)] for g in WEAPON_GROUPS}
+        self.systems = {30000001 + i: (10000001 + i // 20, SECURITY[i % len(SECURITY)]) for i in range(60)}
+        self.gates = {s: [(r.uniform(-1e12, 1e12), r.uniform(-1e10, 1e10), r.uniform(-1e12, 1e12)) for g in range(2)]
+                      for s in self.systems}
+
+        members = collections.defaultdict(list)
+        for p in self.pilot_ids:
+            members[self.corp[p]].append(p)
+        ship_groups = list(SHIP_WEIGHTS)
+        weights = [SHIP_WEIGHTS[g] for g in ship_groups]
+        plan = []
+        for corp, mates in sorted(members.items()):
+            for i in range(killmails_per_pilot * len(mates)):
+                size = min(len(mates), max(1, int(r.expovariate(1 / 6.0))))
+                attackers = r.sample(mates, size)
+                extra = [r.choice(self.pilot_ids) for n in range(r.randint(0, 3))]
+                victim = r.choice(self.pilot_ids)
+                while self.corp[victim] == corp and len(members) > 1:
+                    victim = r.choice(self.pilot_ids)
+                plan.append((attackers + [a for a in extra if a not in attackers and a != victim], victim))
+        r.shuffle(plan)
+
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        self.killmails = {}
+        self.kills = collections.defaultdict(list)
+        self.losses = collections.defaultdict(list)
+        for index, (attackers, victim) in enumerate(plan):
+            killmail_id = 80000000 + index
+            system = r.choice(list(self.systems))
+            if r.random() < 0.3:
+                gate = r.choice(self.gates[system])
+                position = (gate[0] + r.uniform(-10000, 10000), gate[1], gate[2] + r.uniform(-10000, 10000))
+            else:
+                position = (r.uniform(-1e12, 1e12), r.uniform(-1e10, 1e10), r.uniform(-1e12, 1e12))
+            self.killmails[killmail_id] = {
+                'time': now - datetime.timedelta(minutes=10 * (len(plan) - index)),
+                'system': system,
+                'position': position,
+                'victim': victim,
+                'victim_ship': r.choice(self.ships[r.choices(ship_groups, weights)[0]]),
+                'attackers': [(a, r.choice(self.ships[r.choices(ship_groups, weights)[0]]),
+                               r.choice(self.weapons[r.choice(list(WEAPON_GROUPS))])) for a in attackers],
+                'value': round(r.lognormvariate(17, 1.5), 2),
+                'hash': hashlib.sha1(str(killmail_id).encode()).hexdigest()}
+            for a in attackers:
+                self.kills[a].append(killmail_id)
+            self.losses[victim].append(killmail_id)
+        for lists in (self.kills, self.losses):
+            for killmail_ids in lists.values():
+                killmail_ids.reverse()  # zKillboard lists are newest first
+
+    def zkill_page(self, page, pilot_id, page_number):
+        """
+        :return: zKillboard list page of a pilot
+        """
+        killmail_ids = (self.kills if page == 'kills' else self.losses).get(pilot_id, [])
+        size = config.ZKILL_PAGE_SIZE
+        return [{'killmail_id': k,
+                 'zkb': {'locationID': self.killmails[k]['system'],
+                         'hash': self.killmails[k]['hash'],
+                         'fittedValue': self.killmails[k]['value'] / 2,
+                         'totalValue': self.killmails[k]['value'],
+                         'points': 1,
+                         'npc': False,
+                         'solo': len(self.killmails[k]['attackers']) == 1,
+                         'awox': False}}
+                for k in killmail_ids[(page_number - 1) * size:page_number * size]]
+
+    def esi_killmail(self, killmail_id):
+        """
+        :return: ESI killmail
+        """
+        k = self.killmails[killmail_id]
+        victim = k['victim']
+        return {'killmail_id': killmail_id,
+                'killmail_time': k['time'].strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'solar_system_id': k['system'],
+                'victim': {'character_id': victim,
+                           'corporation_id': self.corp[victim],
+                           'alliance_id': self.alliance[victim],
+                           'ship_type_id': k['victim_ship'],
+                           'damage_taken': 1000,
+                           'position': dict(zip('xyz', k['position']))},
+                'attackers': [{'character_id': a,
+                               'corporation_id': self.corp[a],
+                               'alliance_id': self.alliance[a],
+                               'ship_type_id': ship,
+                               'weapon_type_id': weapon,
+                               'damage_done': 100,
+                               'final_blow': i == 0,
+                               'security_status': 0.0} for i, (a, ship, weapon) in enumerate(k['attackers'])]}
+
+    def write_static(self, directory):
+        """
+        Write the five Fuzzwork CSVs EveDB loads, with their header rows and column counts
+        :param directory: Directory to write to
+        """
+        rows = {
+            'invTypes.csv': [['typeID', 'groupID', 'typeName', 'description', 'mass', 'volume', 'capacity',
+                              'portionSize', 'raceID', 'basePrice', 'published', 'marketGroupID', 'iconID', 'soundID',
+                              'graphicID']],
+            'invGroups.csv': [['groupID', 'categoryID', 'groupName', 'iconID', 'useBasePrice', 'anchored',
+                               'anchorable', 'fittableNonSingleton', 'published']],
+            'mapSolarSystems.csv': [['regionID', 'constellationID', 'solarSystemID', 'solarSystemName', 'x', 'y', 'z',
+                                     'xMin', 'xMax', 'yMin', 'yMax', 'zMin', 'zMax', 'luminosity', 'border', 'fringe',
+                                     'corridor', 'hub', 'international', 'regional', 'constellation', 'security',
+                                     'factionID', 'radius', 'sunTypeID', 'securityClass']],
+            'mapRegions.csv': [['regionID', 'regionName', 'x', 'y', 'z', 'xMin', 'xMax', 'yMin', 'yMax', 'zMin', 'zMax',
+                                'factionID', 'nebula', 'radius']],
+            'mapDenormalize.csv': [['itemID', 'typeID', 'groupID', 'solarSystemID', 'constellationID', 'regionID',
+                                    'orbitID', 'x', 'y', 'z', 'radius', 'itemName', 'security', 'celestialIndex',
+                                    'orbitIndex']]}
+        for groups, category in [(SHIP_GROUPS, 6), (WEAPON_GROUPS, 7)]:
+            types = self.ships if category == 6 else self.weapons
+            for group_id, name in groups.items():
+                rows['invGroups.csv'].append([group_id, category, name, '', 0, 0, 0, 0, 1])
+                for j, type_id in enumerate(types[group_id]):
+                    rows['invTypes.csv'].append([type_id, group_id, '{} {}'.format(name, j + 1), '', 1, 1, 0, 1, 1,
+                                                 0, 1, '', '', '', ''])
+        for region_id in sorted(set(r for r, s in self.systems.values())):
+            rows['mapRegions.csv'].append([region_id, 'Bench Region {}'.format(region_id - 10000000)] + [0] * 9 +
+                                          ['', '', 0])
+        item_id = 50000001
+        for system_id, (region_id, security) in sorted(self.systems.items()):
+            rows['mapSolarSystems.csv'].append([region_id, 20000001, system_id, 'BENCH-{}'.format(system_id % 1000)] +
+                                               [0] * 9 + [0.5, 0, 0, 0, 0, 0, 0, '', security, '', 0, '', ''])
+            for x, y, z in self.gates[system_id]:
+                rows['mapDenormalize.csv'].append([item_id, 16, 10, system_id, 20000001, region_id, '', x, y, z, '',
+                                                   'Stargate', security, '', ''])
+                item_id += 1
+        for file, lines in rows.items():
+            with open(os.path.join(directory, file), 'w', encoding='utf8', newline='') as f:
+                csv.writer(f).writerows(lines)
+
+
+class MockServer:
+    def __init__(self, universe, static_dir, latency=0.0, error_rate=0.0, zkill_rate=0, replay=None, seed=1):
+        """
+        :param universe: Universe to serve
+        :param static_dir: Directory holding the static CSVs served as the Fuzzwork dump
+        :param latency: Mean added latency per request in seconds, jittered by +-50%
+        :param error_rate: Fraction of API requests answered with a 502
+        :param zkill_rate: zKillboard requests per second served before answering 429, 0 for no limit
+        :param replay: Optional directory of recorded responses, see _replayed()
+        :param seed: Random seed for latency and errors
+        """
+        self.universe = universe
+        self.static_dir = static_dir
+        self.latency = latency
+        self.error_rate = error_rate
+        self.zkill_rate = zkill_rate
+        self.replay = replay
+        self.counts = collections.Counter()
+        self.url = None
+        self._random = random.Random(seed)
+        self._zkill_window = collections.deque()
+        self._loop = None
+        self._runner = None
+
+    def start(self):
+        """
+        Start serving on a free localhost port from a background thread
+        :return: Base URL of the server
+        """
+        ready = threading.Event()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        self.url = 'http://127.0.0.1:{}'.format(sock.getsockname()[1])
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self._make_app())
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.SockSite(self._runner, sock).start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        ready.wait()
+        return self.url
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def reset_counts(self):
+        self.counts.clear()
+
+    def _make_app(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get('/dump/latest/{file}', self._static)
+        app.router.add_get('/api/{page}/{entity}/{id}/page/{number}/', self._zkill)
+        app.router.add_get('/v1/killmails/{id}/{hash}/', self._killmail)
+        app.router.add_get('/latest/search/', self._search)
+        app.router.add_get('/latest/characters/{id}/', self._character)
+        app.router.add_post('/latest/characters/affiliation/', self._affiliation)
+        app.router.add_post('/latest/universe/names/', self._names)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        kind = request.path.split('/')[1] if request.path.startswith('/dump') else request.path.split('/')[2]
+        self.counts[kind] += 1
+        self.counts['total'] += 1
+        if kind == 'dump':
+            return await handler(request)
+        if self.latency:
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+        if kind in ('kills', 'losses') and self.zkill_rate:
+            now = time.monotonic()
+            while self._zkill_window and self._zkill_window[0] < now - 1:
+                self._zkill_window.popleft()
+            if len(self._zkill_window) >= self.zkill_rate:
+                self.counts['throttled'] += 1
+                return web.Response(status=429, headers={'Retry-After': '1'}, text='Too Many Requests')
+            self._zkill_window.append(now)
+        if self._random.random() < self.error_rate:
+            self.counts['errors'] += 1
+            return web.Response(status=502, text='Bad Gateway')
+        replayed = self._replayed(request)
+        if replayed is not None:
+            return replayed
+        return await handler(request)
+
+    def _replayed(self, request):
+        """
+        A recorded response is a file in the replay directory named after the request path with every '/' replaced
+        by '_', e.g. _api_kills_characterID_90000000_page_1_ or _v1_killmails_80000000_<hash>_
+        :return: web.Response with the recorded body, or None
+        """
+        if self.replay is None:
+            return None
+        path = os.path.join(self.replay, request.path.replace('/', '_'))
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return web.Response(body=f.read(), content_type='application/json')
+
+    async def _static(self, request):
+        file = request.match_info['file']
+        if file not in STATIC_FILES:
+            raise web.HTTPNotFound()
+        return web.FileResponse(os.path.join(self.static_dir, file))
+
+    async def _zkill(self, request):
+        if request.match_info['entity'] != 'characterID':
+            return web.json_response([])
+        data = self.universe.zkill_page(request.match_info['page'], int(request.match_info['id']),
+                                        int(request.match_info['number']))
+        body = json.dumps(data)
+        etag = '"{}"'.format(hashlib.sha1(body.encode()).hexdigest())
+        if request.headers.get('If-None-Match') == etag:
+            self.counts['not_modified'] += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=body, content_type='application/json', headers={'ETag': etag})
+
+    async def _killmail(self, request):
+        killmail_id = int(request.match_info['id'])
+        if killmail_id not in self.universe.killmails:
+            return web.json_response({'error': 'Invalid killmail_id and/or killmail_hash'}, status=422)
+        return web.json_response(self.universe.esi_killmail(killmail_id))
+
+    async def _search(self, request):
+        pilot_id = self.universe.ids.get(request.query.get('search', '').strip('"'))
+        return web.json_response({'character': [pilot_id]} if pilot_id else {})
+
+    async def _character(self, request):
+        pilot_id = int(request.match_info['id'])
+        if pilot_id not in self.universe.names:
+            return web.json_response({'error': 'Character not found'}, status=404)
+        return web.json_response({'name': self.universe.names[pilot_id]})
+
+    async def _affiliation(self, request):
+        ids = await request.json()
+        return web.json_response([dict({'character_id': i, 'corporation_id': self.universe.corp[i]},
+                                        **({'alliance_id': self.universe.alliance[i]}
+                                           if self.universe.alliance[i] else {}))
+                                  for i in ids if i in self.universe.corp])
+
+    async def _names(self, request):
+        ids = await request.json()
+        names = []
+        for i in ids:
+            if i in self.universe.names:
+                names.append({'id': i, 'name': self.universe.names[i], 'category': 'character'})
+            elif i in self.universe.entity_names:
+                category = 'corporation' if i < 99000000 else 'alliance'
+                names.append({'id': i, 'name': self.universe.entity_names[i], 'category': category})
+        return web.json_response(names)
+
+
+def percentile(values, p):
+    """
+    :param values: Sorted list of numbers
+    :param p: Percentile, 0-100
+    :return: Nearest rank percentile, or None for no values
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))]
+
+
+def run_child(args):
+    """
+    Child process side of a benchmark run: analyze the names on stdin through headless.run() and print the measurements
+    as one line of json. config was imported with the HAWKEYE_* environment set by the parent.
+    """
+    if args.client_zkill_rate:
+        config.ZKILL_RATE = args.client_zkill_rate
+        config.ZKILL_BURST = max(config.ZKILL_BURST, int(args.client_zkill_rate))
+    import eveDB
+    import headless
+    import statspool
+    names = headless.read_names(sys.stdin)
+    # Build the static tables before the clock starts, they are a one time cost per install
+    eveDB.fuzzwork_download()
+    with eveDB.EveDB(static_only=True):
+        pass
+    try:
+        rows, filtered, timings = headless.run(names, args.workers, args.max_killmails, 0)
+    finally:
+        statspool.shutdown()
+    latencies = sorted(r['process_time'] for r in rows if r.get('process_time') is not None)
+    peak = None
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux, the stats pool workers count as children
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.0
+    print(json.dumps({'pilots': timings['pilots'],
+                      'seconds': timings['seconds'],
+                      'p50': percentile(latencies, 50),
+                      'p95': percentile(latencies, 95),
+                      'peak_rss_mb': peak}))
+
+
+def run_benchmark(args):
+    """
+    :return: List of result dictionaries, one per size and run
+    """
+    work = tempfile.mkdtemp(prefix='hawkeye-bench-')
+    try:
+        static_dir = os.path.join(work, 'static')
+        os.makedirs(static_dir)
+        universe = Universe(max(args.sizes), seed=args.seed, killmails_per_pilot=args.killmails_per_pilot)
+        universe.write_static(static_dir)
+        server = MockServer(universe, static_dir, args.latency / 1000.0, args.error_rate, args.zkill_rate,
+                            args.replay, args.seed)
+        url = server.start()
+        results = []
+        for size in args.sizes:
+            env = dict(os.environ,
+                       HAWKEYE_PREF_PATH=os.path.join(work, 'pref-{}'.format(size)),
+                       HAWKEYE_ZKILL_URL=url,
+                       HAWKEYE_ESI_URL=url,
+                       HAWKEYE_FUZZWORK_URL=url)
+            names = '\n'.join(universe.names[p] for p in universe.pilot_ids[:size])
+            command = [sys.executable, os.path.abspath(__file__), '--child', '--workers', str(args.workers),
+                       '--max-killmails', str(args.max_killmails),
+                       '--client-zkill-rate', str(args.client_zkill_rate)]
+            for run in range(args.runs):
+                server.reset_counts()
+                proc = subprocess.run(command, input=names, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                      universal_newlines=True)
+                if proc.returncode != 0 or not proc.stdout.strip():
+                    sys.stderr.write(proc.stderr)
+                    raise RuntimeError('Benchmark run for {} pilots failed'.format(size))
+                result = json.loads(proc.stdout.strip().splitlines()[-1])
+                requests = server.counts['total'] - server.counts['dump']
+                result.update({'size': size,
+                               'run': 'cold' if run == 0 else 'warm {}'.format(run),
+                               'pilots_per_second': round(result['pilots'] / result['seconds'], 2)
+                               if result['seconds'] else None,
+                               'requests': requests,
+                               'requests_per_pilot': round(requests / float(size), 2),
+                               'requests_by_kind': dict(server.counts)})
+                results.append(result)
+                print_result(result)
+        server.stop()
+        return results
+    finally:
+        if args.keep:
+            sys.stderr.write('Kept benchmark files in {}\n'.format(work))
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def print_result(result):
+    def fmt(value, digits=2):
+        return '-' if value is None else '{:.{}f}'.format(value, digits)
+    print('{:>6} {:<7} {:>9} {:>10} {:>10} {:>8} {:>8} {:>9}'.format(
+        result['size'], result['run'], fmt(result['seconds']), fmt(result['pilots_per_second']),
+        fmt(result['requests_per_pilot']), fmt(result['p50'], 3), fmt(result['p95'], 3),
+        fmt(result['peak_rss_mb'], 1)))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark HawkEye against a local mock zKillboard and ESI.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 2000], help='Local sizes to analyze')
+    parser.add_argument('--runs', type=int, default=1, help='Runs per size, the first is cold, the rest warm')
+    parser.add_argument('--latency', type=float, default=50, help='Mean server latency in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 502')
+    parser.add_argument('--zkill-rate', type=int, default=0, help='zKillboard requests per second before 429, 0 off')
+    parser.add_argument('--client-zkill-rate', type=float, default=0,
+                        help='Override config.ZKILL_RATE in the analyzed process, 0 keeps it')
+    parser.add_argument('--workers', type=int, default=config.PILOT_WORKERS, help='config.PILOT_WORKERS to use')
+    parser.add_argument('--max-killmails', type=int, default=50, help='maxKillmails setting')
+    parser.add_argument('--killmails-per-pilot', type=int, default=20, help='Synthetic killmails per pilot')
+    parser.add_argument('--replay', help='Directory of recorded responses served instead of synthetic ones')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the synthetic universe')
+    parser.add_argument('--json', help='Also write the results to this json file')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary caches and static data')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args)
+        return 0
+    print('{:>6} {:<7} {:>9} {:>10} {:>10} {:>8} {:>8} {:>9}'.format(
+        'pilots', 'run', 'seconds', 'pilots/s', 'req/pilot', 'p50 s', 'p95 s', 'RSS MB'))
+    results = run_benchmark(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
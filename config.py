@@ -4,11 +4,16 @@
 Handles version control, static constants, resource paths, config file storage, color schema, and logging.
 """
 import logging.config
+import multiprocessing
 import optstore
 import os
 import platform
 import sys
-import wx  # required for colour codes in DARK_MODE
+
+try:
+    import wx  # required for colour codes in DARK_MODE
+except ImportError:
+    wx = None  # Headless, see headless.py
 
 
 Logger = logging.getLogger(__name__)
@@ -18,9 +23,37 @@ __version__ = 1.0
 # Various constants
 MAX_NAMES = 500  # The max number of char names to be processed
 MAX_KM = 100  # Max number of killmails to process per character
-ZKILL_MULTIPLIER = 1.5
+ZKILL_RATE = 5  # Sustained zKillboard requests per second
+ZKILL_BURST = 10  # zKillboard requests allowed back to back after an idle period
+ZKILL_BACKOFF = 2  # Seconds to back off after a zKillboard error that does not say how long to wait
 ZKILL_RETRY = 50
-MAX_CHUNK = 50
+ZKILL_PAGE_TTL = 300  # Seconds a cached zKillboard page is used before it is revalidated
+ZKILL_PAGE_SIZE = 200  # Killmails on a full zKillboard list page
+ZKILL_MAX_PAGES = 5  # Most zKillboard list pages requested per pilot and list
+KILLSTORE_BATCH = 50  # Fetched killmails written to the killstore per transaction
+HORIZON_SLICE = 50  # Killmails resolved at a time while looking for the maxKillmailAge horizon
+PILOT_WORKERS = 50  # Pilots analyzed at the same time
+STATS_ENGINE = 'numpy'  # 'numpy' or 'python', numpy falls back to python if numpy isn't installed
+STATS_POOL_THRESHOLD = 100  # Killmails in one stats update before it runs in the process pool, 0 disables the pool
+STATS_POOL_WORKERS = 0  # Stats worker processes, 0 for one less than the number of CPUs
+WARMER_INTERVAL = 900  # Seconds between background cache warming rounds
+WARMER_BUDGET = 300  # Most zKillboard and ESI requests the cache warmer sends per round
+WARMER_IDLE = 5  # Seconds the cache warmer waits before checking again whether an analysis is still running
+WARMER_SLICE = 10  # Killmails the cache warmer resolves at a time, it checks for a running analysis in between
+STATUS_FPS = 10  # Most status bar and progress updates per second
+PROFILE_TOP = 40  # Functions and allocations listed in the summary of a profiled paste
+PROFILE_FRAMES = 5  # Stack frames tracemalloc keeps per allocation while a paste is profiled
+HISTORY_SIZE = 50  # Pastes kept in the Previous / Next history, unless the historySize option says otherwise
+HISTORY_LOADED = 5  # History entries kept in memory, older ones are loaded from disk when navigated to
+OPTIONS_SAVE_DELAY = 2  # Seconds after the last change of an option before the options are saved
+HTTP_MAX_CONNECTIONS = 100  # Total pooled connections per event loop
+HTTP_MAX_PER_HOST = 50  # Pooled connections per host (zkillboard.com, esi.evetech.net, ...)
+HTTP_DNS_TTL = 300  # Seconds to cache DNS lookups
+HTTP_KEEPALIVE = 30  # Seconds to keep idle connections open
+HTTP_TIMEOUT = 60  # Total seconds allowed per request
+HTTP_DOWNLOAD_TIMEOUT = 60  # Seconds a static data download may stall between reads, downloads have no total limit
+ESI_RETRIES = 5  # Attempts per ESI lookup before giving up, client errors (4xx) are not retried
+ESI_BACKOFF = 0.25  # Seconds before the first ESI retry, doubled on every further retry
 GUI_TITLE = "HawkEye v{}".format(__version__)
 CYNO_HL_PERCENTAGE = 0.01
 BLOPS_HL_PERCENTAGE = 0.01
@@ -65,44 +98,62 @@ elif __file__:
         os.makedirs(PREF_PATH)
     LOG_PATH = PREF_PATH
 
+# Benchmarks and tests keep their caches and options away from the user's
+if os.environ.get("HAWKEYE_PREF_PATH"):
+    PREF_PATH = LOG_PATH = os.environ["HAWKEYE_PREF_PATH"]
+    if not os.path.exists(PREF_PATH):
+        os.makedirs(PREF_PATH)
+
+# Base URLs of the services HawkEye talks to, benchmark.py points them at its local mock server
+ZKILL_URL = os.environ.get("HAWKEYE_ZKILL_URL", "https://zkillboard.com")
+ESI_URL = os.environ.get("HAWKEYE_ESI_URL", "https://esi.evetech.net")
+FUZZWORK_URL = os.environ.get("HAWKEYE_FUZZWORK_URL", "https://www.fuzzwork.co.uk")
+
+# Per paste timings and counters are written to PREF_PATH after every paste: 'json' for metrics.json, 'prometheus' for
+# metrics.prom, 'both', or unset for no export, see metrics.py
+METRICS_EXPORT = os.environ.get("HAWKEYE_METRICS")
+
+# Number of pastes to run under cProfile and tracemalloc from startup, see profiling.py
+PROFILE_RUNS = int(os.environ.get("HAWKEYE_PROFILE", 0))
+
 GUI_CFG_FILE = os.path.join(PREF_PATH, "hawkeye.cfg")
 LOG_FILE = os.path.join(LOG_PATH, "hawkeye.log")
 OPTIONS_FILE = os.path.join(PREF_PATH, "hawkeye.pickle")
 
-# Creates /kills folder in PREF_PATH if it doesn't exist
-if not os.path.exists(os.path.join(PREF_PATH, 'kills/')):
-    os.makedirs(os.path.join(PREF_PATH, 'kills/'))
-
 # Persistent options object
 OPTIONS_OBJECT = optstore.PersistentOptions(OPTIONS_FILE)
 
-# Store version information
-OPTIONS_OBJECT.Set("version", __version__)
-
-# Colour Scheme
-DARK_MODE = {
-    "BG": wx.Colour(0, 0, 0),
-    "TXT": wx.Colour(247, 160, 55),  # Yellow
-    "LNE": wx.Colour(15, 15, 15),
-    "LBL": wx.Colour(160, 160, 160),
-    "HL1": wx.Colour(62, 157, 250),  # Blue
-    "HL2": wx.Colour(237, 72, 59),  # Red
-    "HL3": wx.Colour(237, 47, 218),  # Pink
-    "HL4": wx.Colour(255, 255, 0),  # Bright yellow
-    "HL5": wx.Colour(179, 240, 255)  # Light blue
-    }
-
-NORMAL_MODE = {
-    "BG": wx.Colour(-1, -1, -1),
-    "TXT": wx.Colour(45, 45, 45),
-    "LNE": wx.Colour(240, 240, 240),
-    "LBL": wx.Colour(32, 32, 32),
-    "HL1": wx.Colour(187, 55, 46),
-    "HL2": wx.Colour(38, 104, 166),
-    "HL3": wx.Colour(237, 47, 218),
-    "HL4": wx.Colour(0, 153, 51),  # Green,
-    "HL5": wx.Colour(0, 0, 153)  # Dark blue
-    }
+# Store version information, not from stats worker processes which import config as well
+if multiprocessing.parent_process() is None:
+    OPTIONS_OBJECT.Set("version", __version__)
+
+# Colour Scheme, only needed by the GUI
+if wx is not None:
+    DARK_MODE = {
+        "BG": wx.Colour(0, 0, 0),
+        "TXT": wx.Colour(247, 160, 55),  # Yellow
+        "LNE": wx.Colour(15, 15, 15),
+        "LBL": wx.Colour(160, 160, 160),
+        "HL1": wx.Colour(62, 157, 250),  # Blue
+        "HL2": wx.Colour(237, 72, 59),  # Red
+        "HL3": wx.Colour(237, 47, 218),  # Pink
+        "HL4": wx.Colour(255, 255, 0),  # Bright yellow
+        "HL5": wx.Colour(179, 240, 255)  # Light blue
+        }
+
+    NORMAL_MODE = {
+        "BG": wx.Colour(-1, -1, -1),
+        "TXT": wx.Colour(45, 45, 45),
+        "LNE": wx.Colour(240, 240, 240),
+        "LBL": wx.Colour(32, 32, 32),
+        "HL1": wx.Colour(187, 55, 46),
+        "HL2": wx.Colour(38, 104, 166),
+        "HL3": wx.Colour(237, 47, 218),
+        "HL4": wx.Colour(0, 153, 51),  # Green,
+        "HL5": wx.Colour(0, 0, 153)  # Dark blue
+        }
+else:
+    DARK_MODE = NORMAL_MODE = {}
 
 # Logging setup
 """
@@ -3,15 +3,17 @@
 """
 This is the EveDB class, which handles most of the management of the local files and database.
 """
-from aiohttp import ClientSession
+import aiohttp
+import asyncio
 import config
 import csv
 import datetime
+import httpclient
 import logging
 import json
+import metrics
 from math import sqrt
 import os
-import requests
 import statusmsg
 import sqlite3
 import time
@@ -20,8 +22,13 @@ Logger = logging.getLogger(__name__)
 
 
 class EveDB:
-    def __init__(self):
-        fuzzwork_download()
+    def __init__(self, static_only=False):
+        """
+        :param static_only: Only load the static tables (ship types, map, gates), for statspool worker processes which
+        never look up characters and must not download anything
+        """
+        if not static_only:
+            fuzzwork_download()
         Logger.info('Creating eveDB object...')
         self.__connection = None
         self.__cursor = None
@@ -39,18 +46,23 @@ class EveDB:
         self._region_map = None
         self._rookie_ships = None
         self._seals = None
-        self._smartbomb_ids = None
+        self.smartbomb_ids = None
         self._super = None
         self._titan = None
+        self._type_names = {}  # typeID: typeName
+        self._type_groups = {}  # typeID: groupID
+        self._group_types = {}  # groupID: list of typeIDs
         self.__load_tables()
-        self.__prepare_local_db()
+        if not static_only:
+            self.__prepare_local_db()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.__connection.close()
-        self.__local_db.close()
+        if self.__local_db is not None:
+            self.__local_db.close()
 
     def __load_tables(self):
         db_exists = os.path.exists(os.path.join(config.PREF_PATH, 'staticdata.db'))
@@ -187,51 +199,36 @@ class EveDB:
             else:
                 self._gate_positions[tup[0]] = [{'x': tup[1], 'y': tup[2], 'z': tup[3]}]
 
-        self.__cursor.execute("select typeID from invTypes where groupID = 72")
-        self._smartbomb_ids = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("""select typeID from invTypes where typeName in (
-                            'Garmur',
-                            'Orthrus',
-                            'Barghest',
-                            'Succubus',
-                            'Phantasm',
-                            'Nightmare',
-                            'Keres',
-                            'Hyena',
-                            'Retribution',
-                            'Omen Navy Issue',
-                            'Osprey Navy Issue',
-                            'Kikimora')""")
-
-        self._nano_bullshit = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID in (485, 547, 1538, 883, 1013, 30)")
-        self.capital_ships = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID = 237")
-        self.rookie_ships = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID = 833")
-        self.recon_ships = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID in (1250, 1246)")
-        self.mtu = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID = 898")
-        self.blops = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID in (28, 463, 543, 941, 513, 380, 1202)")
-        self.seals = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID = 1308")
-        self.higgs = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID = 659")
-        self.super = [row[0] for row in self.__cursor.fetchall()]
-
-        self.__cursor.execute("select typeID from invTypes where groupID = 30")
-        self.titan = [row[0] for row in self.__cursor.fetchall()]
+        # Ship and module lookups are dictionary lookups from here on, invTypes is read once
+        self.__cursor.execute("select typeID, groupID, typeName from invTypes")
+        for type_id, group_id, type_name in self.__cursor.fetchall():
+            self._type_names[type_id] = type_name
+            self._type_groups[type_id] = group_id
+            self._group_types.setdefault(group_id, []).append(type_id)
+
+        self.smartbomb_ids = self._types_in_groups(72)
+        self._nano_bullshit = frozenset(t for t, name in self._type_names.items() if name in (
+                                        'Garmur',
+                                        'Orthrus',
+                                        'Barghest',
+                                        'Succubus',
+                                        'Phantasm',
+                                        'Nightmare',
+                                        'Keres',
+                                        'Hyena',
+                                        'Retribution',
+                                        'Omen Navy Issue',
+                                        'Osprey Navy Issue',
+                                        'Kikimora'))
+        self.capital_ships = self._types_in_groups(485, 547, 1538, 883, 1013, 30)
+        self.rookie_ships = self._types_in_groups(237)
+        self.recon_ships = self._types_in_groups(833)
+        self.mtu = self._types_in_groups(1250, 1246)
+        self.blops = self._types_in_groups(898)
+        self.seals = self._types_in_groups(28, 463, 543, 941, 513, 380, 1202)
+        self.higgs = self._types_in_groups(1308)
+        self.super = self._types_in_groups(659)
+        self.titan = self._types_in_groups(30)
 
         return None
 
@@ -282,22 +279,34 @@ class EveDB:
             if datetime.datetime.now() > (r[1] + datetime.timedelta(days=7)):
                 self.__local_c.execute("delete from characters where char_name = ?", (pilot_name, ))
             else:
+                metrics.count('character_cache_hits')
                 return {'pilot_id': r[0], 'pilot_name': pilot_name}
+        metrics.count('character_cache_misses')
 
-        url = 'https://esi.evetech.net/latest/search/?categories=character&strict=true&search="{}"'.format(
-            pilot_name.replace(' ', '%20'))
-        headers = {'User-Agent': 'HawkEye, Author: Kain Tarr'}
+        url = '{}/latest/search/?categories=character&strict=true&search="{}"'.format(
+            config.ESI_URL, pilot_name.replace(' ', '%20'))
         start_time = time.time()
-        async with ClientSession() as session:
-            while True:
-                async with session.get(url, headers=headers) as resp:
-                    try:
-                        r = await resp.json()
+        for attempt in range(config.ESI_RETRIES):
+            if attempt:
+                metrics.count('esi_retries')
+                await asyncio.sleep(httpclient.retry_delay(attempt))
+            metrics.count('esi_requests')
+            try:
+                async with httpclient.get_session().get(url) as resp:
+                    if resp.status != 200 and not httpclient.is_retryable(resp.status):
+                        Logger.warning('{} returned {}, not retrying'.format(url, resp.status))
+                        return None
+                    r = await resp.json()
+                    metrics.count('esi_bytes', resp.content_length or 0)
+                    if resp.status == 200:
                         break
-                    except Exception as e:
-                        Logger.warning(resp)
-                        Logger.warning(e)
-                        time.sleep(0.25)
+                    Logger.warning('{} returned {}'.format(url, resp.status))
+            except (aiohttp.ClientError, asyncio.TimeoutError, json.decoder.JSONDecodeError) as e:
+                Logger.warning(url)
+                Logger.warning(e)
+        else:
+            Logger.error('Gave up on {} after {} attempts'.format(url, config.ESI_RETRIES))
+            return None
         Logger.info('Requested {} and got it in {} seconds'.format(url, round(time.time() - start_time, 2)))
         try:
             sql = "insert into characters (char_id, char_name, last_update) values (?, ?, ?)"
@@ -307,7 +316,7 @@ class EveDB:
         except KeyError:
             return None
 
-    def get_pilot_affiliations(self, pilot_map):
+    async def get_pilot_affiliations(self, pilot_map):
         for pilot in pilot_map:
             for key in ['corp_id', 'corp_name', 'alliance_id', 'alliance_name']:
                 pilot[key] = None
@@ -325,21 +334,18 @@ class EveDB:
         # If none of our pilots is missing corp_id, they were all up-to-date in the database, and we can return results
         # after adding corporation names and alliance names from _add_corpall_names
         if None not in [r['corp_id'] for r in pilot_map]:
-            return self.__add_corpall_names(pilot_map)
+            return await self.__add_corpall_names(pilot_map)
 
         # Determine which characters were not up-to-date in the database by checking where corp_id is missing
         pilots_not_in_db = [p for p in pilot_map if p.get('corp_id') is None]
         # Reset our pilot_map to exclude characters with missing corp_id
         pilot_map = [p for p in pilot_map if p.get('corp_id') is not None]
 
-        while True:
-            try:
-                affiliations = post_req_ccp("characters/affiliation/", json.dumps(
-                    tuple(p['pilot_id'] for p in pilots_not_in_db)))
-                break
-            except Exception as e:
-                Logger.warning(e)
-                time.sleep(0.25)
+        affiliations = await post_req_retry("characters/affiliation/", json.dumps(
+            tuple(p['pilot_id'] for p in pilots_not_in_db)))
+        if not isinstance(affiliations, list):
+            # Keep the pilots without corporation and alliance rather than failing the paste
+            affiliations = []
 
         for pilot in pilots_not_in_db:
             for mapping in affiliations:
@@ -356,15 +362,15 @@ class EveDB:
                     self.__local_db.commit()
             # Pilot data is enriched with corp_id and alliance_id, add it back to pilot_map
             pilot_map.append(pilot)
-        return self.__add_corpall_names(pilot_map)
+        return await self.__add_corpall_names(pilot_map)
 
-    def __add_corpall_names(self, pilot_map):
+    async def __add_corpall_names(self, pilot_map):
         corpall_ids = []
         for pilot in pilot_map:
             for key in ['corp_id', 'alliance_id']:
                 if pilot[key] is not None:
                     corpall_ids.append(pilot[key])
-        affiliation_names = self.get_affil_names(corpall_ids)
+        affiliation_names = await self.get_affil_names(corpall_ids)
 
         # Add corp and alliance names to affiliations using _get_affil_names mapping results
         for pilot in pilot_map:
@@ -376,7 +382,7 @@ class EveDB:
 
         return pilot_map
 
-    def get_affil_names(self, allcorp_ids):
+    async def get_affil_names(self, allcorp_ids):
         if allcorp_ids is None:
             return None
         allcorp_ids = [i for i in allcorp_ids if i]
@@ -388,16 +394,15 @@ class EveDB:
             for r in records:
                 return_values.append({'id': r[0], 'name': r[1]})
             allcorp_ids = list(set(allcorp_ids).difference([d['id'] for d in return_values]))
+            metrics.count('entity_cache_hits', len(return_values))
+            metrics.count('entity_cache_misses', len(allcorp_ids))
             if len(allcorp_ids) == 0:
                 return return_values
 
-        while True:
-            try:
-                names = post_req_ccp("universe/names/", json.dumps(tuple(allcorp_ids)))
-                break
-            except Exception as e:
-                Logger.warning(e)
-                time.sleep(0.25)
+        with metrics.span('names'):
+            names = await post_req_retry("universe/names/", json.dumps(tuple(allcorp_ids)))
+            if not isinstance(names, list):
+                names = []
 
         for r in names:
             return_values.append({'id': r['id'], 'name': r['name']})
@@ -406,25 +411,47 @@ class EveDB:
             self.__local_db.commit()
         return return_values
 
-    def get_pilot_name(self, pilot_id):
+    async def get_pilot_name(self, pilot_id):
         self.__local_c.execute("select char_name from characters where char_id = ?", (pilot_id,))
         r = self.__local_c.fetchone()
         if r is not None:
             return r[0]
 
-        url = 'https://esi.evetech.net/latest/characters/{}/'.format(pilot_id)
-        headers = {'User-Agent': 'HawkEye, Author: Kain Tarr'}
-        resp = requests.get(url, headers=headers)
+        url = '{}/latest/characters/{}/'.format(config.ESI_URL, pilot_id)
+        status, body = await httpclient.get_bytes(url)
         try:
-            return resp.json()['name']
-        except json.decoder.JSONDecodeError:
+            return json.loads(body)['name']
+        except (json.decoder.JSONDecodeError, KeyError):
             return None
 
+    def _types_in_groups(self, *group_ids):
+        """
+        :param group_ids: invGroups groupIDs
+        :return: frozenset of the typeIDs in any of the groups
+        """
+        return frozenset(t for g in group_ids for t in self._group_types.get(g, []))
+
     def get_ship_name(self, i):
-        if i in [None, '']:
-            return None
-        self.__cursor.execute("""select typeName from invTypes where typeID = {}""".format(i))
-        return self.__cursor.fetchone()[0]
+        """
+        :param i: ship_type_id
+        :return: Ship name, or None for None or an unknown type
+        """
+        return self._type_names.get(i)
+
+    def get_ship_names(self, ids):
+        """
+        :param ids: Iterable of ship_type_ids
+        :return: List of ship names in the same order, None for None or unknown types
+        """
+        names = self._type_names
+        return [names.get(i) for i in ids]
+
+    def get_ship_group(self, i):
+        """
+        :param i: ship_type_id
+        :return: invGroups groupID, or None for None or an unknown type
+        """
+        return self._type_groups.get(i)
 
     def is_capital(self, i):
         """
@@ -548,7 +575,7 @@ class EveDB:
         """
 
         for d in a:
-            if d.get('character_id') == p and d.get('weapon_type_id') in self._smartbomb_ids:
+            if d.get('character_id') == p and d.get('weapon_type_id') in self.smartbomb_ids:
                 return True
         return False
 
@@ -609,35 +636,54 @@ def fuzzwork_download():
 
 
 def get_file(file):
-    Logger.info('Need to download file {}'.format("https://www.fuzzwork.co.uk/dump/latest/{}".format(file)))
-    statusmsg.push_status('Need to download file {}'.format("https://www.fuzzwork.co.uk/dump/latest/{}".format(file
-                                                                                                               )))
-    url = "https://www.fuzzwork.co.uk/dump/latest/{}".format(file)
-    headers = {'Accept-Encoding': 'gzip', 'User-Agent': 'HawkEye, Author: Kain Tarr'}
-    resp = requests.get(url, headers=headers)
-    open(os.path.join(config.PREF_PATH, file), 'wb').write(resp.content)
-
-
-def post_req_ccp(esi_path, json_data):
-    url = "https://esi.evetech.net/latest/" + esi_path + "?datasource=tranquility"
+    url = "{}/dump/latest/{}".format(config.FUZZWORK_URL, file)
+    Logger.info('Need to download file {}'.format(url))
+    statusmsg.push_status('Need to download file {}'.format(url))
+    status = httpclient.run(httpclient.download(url, os.path.join(config.PREF_PATH, file)))
+    if status != 200:
+        Logger.error('Failed to download {}, Fuzzwork returned {}'.format(url, status))
+        statusmsg.push_status('Failed to download {}, error code: {}'.format(file, status))
+
+
+async def post_req_retry(esi_path, json_data):
+    """
+    post_req_ccp() with up to config.ESI_RETRIES attempts and exponential backoff, client errors are not retried
+    :param esi_path: ESI path after /latest/
+    :param json_data: json string to send
+    :return: Parsed json response, or the error string of the last attempt
+    """
+    for attempt in range(config.ESI_RETRIES):
+        if attempt:
+            metrics.count('esi_retries')
+            await asyncio.sleep(httpclient.retry_delay(attempt))
+        result = await post_req_ccp(esi_path, json_data)
+        if not isinstance(result, str) or result == "client_error":
+            return result
+    Logger.error('Gave up on {} after {} attempts'.format(esi_path, config.ESI_RETRIES))
+    return result
+
+
+async def post_req_ccp(esi_path, json_data):
+    url = config.ESI_URL + "/latest/" + esi_path + "?datasource=tranquility"
+    metrics.count('esi_requests')
     try:
         start_time = time.time()
-        headers = {'User-Agent': 'HawkEye, Author: Kain Tarr'}
-        r = requests.post(url, json_data, headers=headers)
+        status, text = await httpclient.post_json(url, json_data)
+        metrics.count('esi_bytes', len(text or ''))
         Logger.info('Requested {} and got it in {} seconds'.format(url, round(time.time() - start_time, 3)))
-    except requests.exceptions.ConnectionError:
+    except (aiohttp.ClientError, asyncio.TimeoutError):
         Logger.info("No network connection.", exc_info=True)
         statusmsg.push_status("NETWORK ERROR: Check your internet connection and firewall settings.")
-        time.sleep(5)
+        await asyncio.sleep(5)
         return "network_error"
-    if r.status_code != 200:
+    if status != 200:
         try:
-            statusmsg.push_status(json.loads(r.text)["error"])
-            Logger.warning(json.loads(r.text)["error"])
-        except json.decoder.JSONDecodeError:
+            statusmsg.push_status(json.loads(text)["error"])
+            Logger.warning(json.loads(text)["error"])
+        except (json.decoder.JSONDecodeError, KeyError, TypeError):
             Logger.error('Failed to return {}'.format(url))
-        Logger.info("CCP Servers at (" + esi_path + ") returned error code: " + str(r.status_code) + ", saying: ",
+        Logger.info("CCP Servers at (" + esi_path + ") returned error code: " + str(status) + ", saying: ",
                     exc_info=True)
-        statusmsg.push_status("CCP SERVER ERROR: " + str(r.status_code))
-        return "server_error"
-    return r.json()
+        statusmsg.push_status("CCP SERVER ERROR: " + str(status))
+        return "server_error" if httpclient.is_retryable(status) else "client_error"
+    return json.loads(text)
@@ -18,13 +18,19 @@ import analyze
 import config
 import datetime
 import eveDB
+import history
+import killstore
 import logging
+import metrics
 import os
-import shutil
+import pagecache
+import profiling
+import resultcache
 import sortarray
 import statusmsg
 import time
 import updatedialog
+import warmer
 import webbrowser
 import wx
 import wx.grid as WXG
@@ -156,6 +162,10 @@ class Frame(wx.Frame):
         self.opt_menu.Bind(wx.EVT_MENU, self._setPopulate, self.pop)
         self.pop.Check(self.options.Get("pop", True))
 
+        self.warm_cache = self.opt_menu.AppendCheckItem(wx.ID_ANY, "&Warm Cache in Background")
+        self.opt_menu.Bind(wx.EVT_MENU, self._toggleWarmCache, self.warm_cache)
+        self.warm_cache.Check(self.options.Get("warmCache", False))
+
         self.km_sub = wx.Menu()
         self.opt_menu.Append(wx.ID_ANY, "Killmail Depth", self.km_sub)
 
@@ -171,6 +181,25 @@ class Frame(wx.Frame):
         self.km_sub.Bind(wx.EVT_MENU, self._setKillmailsSlow, self.hl_km200)
         self.hl_km200.Check(self.options.Get("KM200", False))
 
+        self.hl_km500 = self.km_sub.AppendCheckItem(wx.ID_ANY, "&500 Killmails (Slowest)")
+        self.km_sub.Bind(wx.EVT_MENU, self._setKillmailsSlowest, self.hl_km500)
+        self.hl_km500.Check(self.options.Get("KM500", False))
+
+        self.age_sub = wx.Menu()
+        self.opt_menu.Append(wx.ID_ANY, "Killmail Age", self.age_sub)
+
+        self.hl_age_all = self.age_sub.AppendCheckItem(wx.ID_ANY, "&Any Age")
+        self.age_sub.Bind(wx.EVT_MENU, self._setKillmailAgeAll, self.hl_age_all)
+        self.hl_age_all.Check(not self.options.Get("maxKillmailAge", 0))
+
+        self.hl_age_30 = self.age_sub.AppendCheckItem(wx.ID_ANY, "&Last 30 Days")
+        self.age_sub.Bind(wx.EVT_MENU, self._setKillmailAge30, self.hl_age_30)
+        self.hl_age_30.Check(self.options.Get("maxKillmailAge", 0) == 30)
+
+        self.hl_age_90 = self.age_sub.AppendCheckItem(wx.ID_ANY, "&Last 90 Days")
+        self.age_sub.Bind(wx.EVT_MENU, self._setKillmailAge90, self.hl_age_90)
+        self.hl_age_90.Check(self.options.Get("maxKillmailAge", 0) == 90)
+
         self.opt_menu.AppendSeparator()
 
         self.review_ignore = self.opt_menu.Append(wx.ID_ANY, "&Clear Ignored Entities\tCTRL+R")
@@ -190,6 +219,11 @@ class Frame(wx.Frame):
         self.clear_static = self.opt_menu.Append(wx.ID_ANY, "&Clear Static Data")
         self.opt_menu.Bind(wx.EVT_MENU, self._clear_static_data, self.clear_static)
 
+        self.opt_menu.AppendSeparator()
+
+        self.profile_next = self.opt_menu.Append(wx.ID_ANY, "&Profile Next Paste")
+        self.opt_menu.Bind(wx.EVT_MENU, self._profileNextPaste, self.profile_next)
+
         self.menubar.Append(self.opt_menu, 'Options')
 
         # Toolbar ######################################################################################################
@@ -270,28 +304,43 @@ class Frame(wx.Frame):
 
         self.grid.SetFocus()
         self.current_index = 0
-        self.options.Set("outlist", [])
+        self.streaming_outlist = []
+        self.streaming_id = None  # History entry of the paste being streamed, until sortOutlist() gets its result
+        self._render_pending = False
+        self.options.Subscribe(self._onGridOptionChanged,
+                               ["HlBlops", "HlCyno", "HlList", "HlSuper", "HlTitan", "highlightedList", "ignoredList"])
+
+    def _onGridOptionChanged(self, key):
+        """
+        Called by the options whenever highlighting or the ignored / highlighted entities change. However many change
+        at once, the grid is rendered again only once.
+        :param key: Option key
+        """
+        if not self._render_pending:
+            self._render_pending = True
+            wx.CallAfter(self._renderCurrent)
+
+    def _renderCurrent(self):
+        self._render_pending = False
+        self.updateList(history.get_store().current())
 
     def _ShowUpdate(self):
         updatedialog.showUpdateBox(self)
 
     def _StopClick(self, e):
-        self.options.Set("stop", True)
+        analyze.cancel_all()
 
     def _PreviousClick(self, e):
-        index = self.options.Get("index")
-        if index > 0:
-            self.options.Set("index", index - 1)
-            self.updateList(self.options.Get("outlist")[index - 1])
+        outlist = history.get_store().step(-1)
+        if outlist is not None:
+            self.updateList(outlist)
         else:
             statusmsg.push_status("Already on oldest local scan...")
 
     def _NextClick(self, e):
-        index = self.options.Get("index")
-        outlist = self.options.Get("outlist", [])
-        if index < len(outlist) - 1:
-            self.options.Set("index", index + 1)
-            self.updateList(outlist[index + 1])
+        outlist = history.get_store().step(1)
+        if outlist is not None:
+            self.updateList(outlist)
         else:
             statusmsg.push_status("Already on newest local scan...")
 
@@ -397,7 +446,7 @@ class Frame(wx.Frame):
             if (mx, my) != wx.GetMousePosition():
                 return
             self.tip = PilotFrame(self, -1,
-                                  self.options.Get("outlist")[self.options.Get("index")][row]['pilot_name'],
+                                  history.get_store().current()[row]['pilot_name'],
                                   size=(360, 505),
                                   style=wx.TRANSPARENT_WINDOW | wx.FRAME_NO_TASKBAR,
                                   pos=(mx + 10, my + 10)
@@ -409,7 +458,8 @@ class Frame(wx.Frame):
         self.prev_row = row
 
     def _populate_popup(self, row):
-        outlist = self.options.Get("outlist")[self.options.Get("index")]
+        store = history.get_store()
+        outlist = store.current()
         self.tip.write_top_header(outlist[row]['pilot_name'],
                                   outlist[row]['alliance_name'] if
                                   outlist[row]['alliance_name'] else
@@ -420,15 +470,18 @@ class Frame(wx.Frame):
         # Get data and add to row if needed
         if outlist[row]['query'] is False:
             outlist[row] = analyze.main([outlist[row]['pilot_name']], True)[0][0]
-            orig = self.options.Get("outlist", [])
-            orig[self.options.Get("index")] = outlist
-            self.options.Set("outlist", orig)
+            store.put(store.current_id, outlist)
             self.updateList(outlist)
-        self.tip.write_popup(self.options.Get("outlist")[self.options.Get("index")][row])
+        self.tip.write_popup(outlist[row])
 
     def _setPopulate(self, e):
         self.options.Set("pop", self.pop.IsChecked())
 
+    def _toggleWarmCache(self, e):
+        self.options.Set("warmCache", self.warm_cache.IsChecked())
+        if self.warm_cache.IsChecked():
+            warmer.wake()
+
     def _setKillmailsFast(self, e):
         """
         Set killmail option
@@ -437,9 +490,11 @@ class Frame(wx.Frame):
         self.options.Set("KM50", True)
         self.options.Set("KM100", False)
         self.options.Set("KM200", False)
+        self.options.Set("KM500", False)
         self.hl_km50.Check(True)
         self.hl_km100.Check(False)
         self.hl_km200.Check(False)
+        self.hl_km500.Check(False)
         self.options.Set("maxKillmails", 50)
 
     def _setKillmailsMid(self, e):
@@ -450,9 +505,11 @@ class Frame(wx.Frame):
         self.options.Set("KM50", False)
         self.options.Set("KM100", True)
         self.options.Set("KM200", False)
+        self.options.Set("KM500", False)
         self.hl_km50.Check(False)
         self.hl_km100.Check(True)
         self.hl_km200.Check(False)
+        self.hl_km500.Check(False)
         self.options.Set("maxKillmails", 100)
 
     def _setKillmailsSlow(self, e):
@@ -463,11 +520,59 @@ class Frame(wx.Frame):
         self.options.Set("KM50", False)
         self.options.Set("KM100", False)
         self.options.Set("KM200", True)
+        self.options.Set("KM500", False)
         self.hl_km50.Check(False)
         self.hl_km100.Check(False)
         self.hl_km200.Check(True)
+        self.hl_km500.Check(False)
         self.options.Set("maxKillmails", 200)
 
+    def _setKillmailsSlowest(self, e):
+        """
+        Set killmail option
+        :param e: Required
+        """
+        self.options.Set("KM50", False)
+        self.options.Set("KM100", False)
+        self.options.Set("KM200", False)
+        self.options.Set("KM500", True)
+        self.hl_km50.Check(False)
+        self.hl_km100.Check(False)
+        self.hl_km200.Check(False)
+        self.hl_km500.Check(True)
+        self.options.Set("maxKillmails", 500)
+
+    def _setKillmailAgeAll(self, e):
+        """
+        Set killmail age option
+        :param e: Required
+        """
+        self.__setKillmailAge(0)
+
+    def _setKillmailAge30(self, e):
+        """
+        Set killmail age option
+        :param e: Required
+        """
+        self.__setKillmailAge(30)
+
+    def _setKillmailAge90(self, e):
+        """
+        Set killmail age option
+        :param e: Required
+        """
+        self.__setKillmailAge(90)
+
+    def __setKillmailAge(self, days):
+        """
+        Only killmails younger than days are analyzed, 0 for no limit
+        :param days: Age in days or 0
+        """
+        self.options.Set("maxKillmailAge", days)
+        self.hl_age_all.Check(not days)
+        self.hl_age_30.Check(days == 30)
+        self.hl_age_90.Check(days == 90)
+
     def __set_properties(self, dark_toggle=None):
         """
         Set the initial properties for the various widgets.
@@ -641,87 +746,150 @@ class Frame(wx.Frame):
         # If updateList() gets called before outlist has been provided, do nothing
         if outlist is None:
             return
-        highlighted_list = self.options.Get("highlightedList", default=[])
+        settings = self.options.Snapshot()
         # Clean up grid
         if self.grid.GetNumberRows() > 0:
             self.grid.DeleteRows(numRows=self.grid.GetNumberRows())
         self.grid.AppendRows(len(outlist))
-        # Add any NPSI fleet related characters to ignored_list
-        ignored_list = self.options.Get("ignoredList", default=[])
-        ignore_count = 0
         rowidx = 0
-        for r in outlist:
-            ignore = False
-            for rec in ignored_list:
-                if r['pilot_id'] == rec[0] or r['corp_id'] == rec[0] or r['alliance_id'] == rec[0]:
-                    ignore = True
-            if ignore:
-                self.grid.HideRow(rowidx)
-                ignore_count += 1
-
-            # Schema depending on output_list() in analyze.py
-            out = [
-                r['pilot_id'],
-                r['warning'],
-                r['pilot_name'],
-                r['corp_name'],
-                r['alliance_name'],
-                r['associates'],
-                '{:.0%}'.format(r['cyno']),
-                '{}{}'.format(r['last_kill'], 'd' if r['last_kill'] is not None else ''),
-                r['avg_gang'],
-                r['avg_10'],
-                r['timezone'],
-                r['top_space'],
-                r['top_ships'],
-                r['top_gang_ships'],
-                r['top_10_ships'],
-                '{:.0%}'.format(r['boy_scout']),
-                r['super'],
-                r['titan'],
-                '{:.0%}'.format(r['capital_use']),
-                '{:.0%}'.format(r['blops_use']),
-                r['top_regions']
-                ]
-            colidx = 0
-
-            # Cell text formatting
-            for value in out:
-                color = False
-                self.grid.SetCellValue(rowidx, colidx, str(value))
-                self.grid.SetCellAlignment(self.columns[colidx][2], rowidx, colidx, 0)
-                if self.options.Get("HlBlops", True) and r['blops_use'] > config.BLOPS_HL_PERCENTAGE:
-                    self.grid.SetCellTextColour(rowidx, colidx, self.hl1_colour)
-                    color = True
-                if self.options.Get("HlCyno", True) and r['cyno'] > config.CYNO_HL_PERCENTAGE:
-                    self.grid.SetCellTextColour(rowidx, colidx, self.hl2_colour)
-                    color = True
-
-                if self.options.Get("HlSuper", True) and r['super'] > 0:
-                    self.grid.SetCellTextColour(rowidx, colidx, self.hl4_colour)
-                    color = True
-
-                if self.options.Get("HlTitan", True) and r['titan'] > 0:
-                    self.grid.SetCellTextColour(rowidx, colidx, self.hl5_colour)
-                    color = True
-
-                for entry in highlighted_list:  # Highlight chars from highlight list
-                    if self.options.Get("HlList", True) and (entry[0] == r['pilot_id'] or entry[0] == r['corp_id'] or entry[0] == r['alliance_id']):
-                        self.grid.SetCellTextColour(rowidx, colidx, self.hl3_colour)
-                        color = True
-
-                if not color:
-                    self.grid.SetCellTextColour(rowidx, colidx, self.txt_colour)
-                colidx += 1
-            rowidx += 1
+        with metrics.span('grid_render', metrics.latest()):
+            for r in outlist:
+                self._writeRow(rowidx, r, settings)
+                rowidx += 1
 
         Logger.info("{} characters analyzed, in {} seconds ({} filtered).".format(len(outlist), duration, filtered))
         statusmsg.push_status("{} characters analyzed, in {} seconds ({} filtered). Double click character to go to "
                               "zKillboard.".format(len(outlist), duration, filtered))
 
+    def _writeRow(self, rowidx, r, settings):
+        """
+        Populate a single grid row with the data of one pilot, hide it if the pilot is ignored and apply highlighting.
+        :param rowidx: Index of the grid row to write
+        :param r: Dictionary of pilot data
+        :param settings: optstore.Settings snapshot taken for the render
+        """
+        entity_ids = (r['pilot_id'], r['corp_id'], r['alliance_id'])
+        if settings.ignored_ids.intersection(entity_ids):
+            self.grid.HideRow(rowidx)
+
+        # Highlighting applies to the whole row, a later match wins
+        colour = self.txt_colour
+        if settings.hl_blops and r['blops_use'] > config.BLOPS_HL_PERCENTAGE:
+            colour = self.hl1_colour
+        if settings.hl_cyno and r['cyno'] > config.CYNO_HL_PERCENTAGE:
+            colour = self.hl2_colour
+        if settings.hl_super and r['super'] > 0:
+            colour = self.hl4_colour
+        if settings.hl_titan and r['titan'] > 0:
+            colour = self.hl5_colour
+        if settings.hl_list and settings.highlighted_ids.intersection(entity_ids):
+            colour = self.hl3_colour
+
+        # Schema depending on output_list() in analyze.py
+        out = [
+            r['pilot_id'],
+            r['warning'],
+            r['pilot_name'],
+            r['corp_name'],
+            r['alliance_name'],
+            r['associates'],
+            '{:.0%}'.format(r['cyno']),
+            '{}{}'.format(r['last_kill'], 'd' if r['last_kill'] is not None else ''),
+            r['avg_gang'],
+            r['avg_10'],
+            r['timezone'],
+            r['top_space'],
+            r['top_ships'],
+            r['top_gang_ships'],
+            r['top_10_ships'],
+            '{:.0%}'.format(r['boy_scout']),
+            r['super'],
+            r['titan'],
+            '{:.0%}'.format(r['capital_use']),
+            '{:.0%}'.format(r['blops_use']),
+            r['top_regions']
+            ]
+        colidx = 0
+
+        # Cell text formatting
+        for value in out:
+            self.grid.SetCellValue(rowidx, colidx, str(value))
+            self.grid.SetCellAlignment(self.columns[colidx][2], rowidx, colidx, 0)
+            self.grid.SetCellTextColour(rowidx, colidx, colour)
+            colidx += 1
+
+    def startOutlist(self):
+        """
+        Called by __main__ before the first streamed pilot of a new paste arrives. Adds a new, empty outlist to the
+        history, makes it the current one and clears the grid so upsertPilot() can fill it row by row.
+        """
+        self.finishOutlist()
+        self.streaming_outlist = []
+        self.streaming_id = history.get_store().append(self.streaming_outlist)
+        if self.grid.GetNumberRows() > 0:
+            self.grid.DeleteRows(numRows=self.grid.GetNumberRows())
+
+    def upsertPilot(self, stats):
+        """
+        Called by __main__ for every pilot analyze.main() finishes. Inserts the pilot into the outlist started by
+        startOutlist(), or replaces it if already there, at the position given by the current sort column, and writes
+        only that grid row.
+        :param stats: Dictionary of pilot data
+        """
+        outlist = self.streaming_outlist
+        displayed = self.streaming_id is not None and history.get_store().current_id == self.streaming_id
+        for i, r in enumerate(outlist):
+            if r['pilot_id'] == stats['pilot_id']:
+                del outlist[i]
+                if displayed:
+                    self.grid.DeleteRows(i)
+                break
+        outlist.append(stats)
+        outlist[:] = sortarray.sort_array(
+            outlist,
+            self.columns[self.options.Get("SortColumn", self.columns[3][0])][7],
+            sec_col='pilot_name',
+            prim_desc=self.options.Get("SortDesc", False),
+            sec_desc=False,
+            case_sensitive=False
+            )
+        if not displayed:
+            return
+        rowidx = next(i for i, r in enumerate(outlist) if r is stats)
+        with metrics.span('grid_render', metrics.latest(), stats['pilot_id']):
+            self.grid.InsertRows(rowidx)
+            self._writeRow(rowidx, stats, self.options.Snapshot())
+
+    def finishOutlist(self):
+        """
+        Called by __main__ when a streamed paste was cancelled before sortOutlist() got its result, stores the pilots
+        streamed so far in the history.
+        """
+        if self.streaming_id is not None:
+            history.get_store().put(self.streaming_id, self.streaming_outlist)
+            self.streaming_id = None
+
+    def getVisiblePilots(self):
+        """
+        Called by __main__ before a new paste is analyzed, so the pilots the user is looking at are refreshed first.
+        :return: Set of pilot IDs of the rows of the displayed outlist that are scrolled into view
+        """
+        outlist = history.get_store().current()
+        if not outlist or self.grid.GetNumberRows() == 0:
+            return set()
+        top = self.grid.CalcUnscrolledPosition(0, 0)[1]
+        bottom = self.grid.CalcUnscrolledPosition(0, self.grid.GetGridWindow().GetClientSize().GetHeight())[1]
+        first = self.grid.YToRow(top)
+        last = self.grid.YToRow(bottom)
+        if first == wx.NOT_FOUND:
+            return set()
+        if last == wx.NOT_FOUND:
+            last = self.grid.GetNumberRows() - 1
+        return set(r['pilot_id'] for r in outlist[first:last + 1])
+
     def updateStatusbar(self, msg):
         """
-        Gets called by push_status() in statusmsg.py.
+        Gets called by statusmsg.GuiSink, at most config.STATUS_FPS times per second.
         :param msg: Message to be pushed to the statusbar
         """
         if isinstance(msg, str):
@@ -734,7 +902,7 @@ class Frame(wx.Frame):
         :param event: Required
         """
         rowidx = event.GetRow()
-        character_id = self.options.Get("outlist")[self.options.Get("index")][rowidx]['pilot_id']
+        character_id = history.get_store().current()[rowidx]['pilot_id']
         url = "https://zkillboard.com/character/{}/".format(str(character_id))
 
         webbrowser.open_new_tab(url)
@@ -751,27 +919,24 @@ class Frame(wx.Frame):
             ignored_list = self.options.Get("ignoredList", default=[])
             ignored_list.append([id, name, type])
             self.options.Set("ignoredList", ignored_list)
-            self.updateList(self.options.Get("outlist", [])[self.options.Get("index")])
 
         def OnHighlight(id, name, type, e=None):
             highlighted_list = self.options.Get("highlightedList", default=[])
             if [id, name, type] not in highlighted_list:
                 highlighted_list.append([id, name, type])
             self.options.Set("highlightedList", highlighted_list)
-            self.updateList(self.options.Get("outlist", [])[self.options.Get("index")])
 
         def OnDeHighlight(id, name, type, e=None):
             highlighted_list = self.options.Get("highlightedList", default=[])
             highlighted_list.remove([id, name, type])
             self.options.Set("highlightedList", highlighted_list)
-            self.updateList(self.options.Get("outlist", [])[self.options.Get("index")])
 
         highlighted_list = self.options.Get("highlightedList", default=[])
         rowidx = event.GetRow()
-        character_id = str(self.options.Get("outlist")[self.options.Get("index")][rowidx]['pilot_id'])
+        outlist = history.get_store().current()
+        character_id = str(outlist[rowidx]['pilot_id'])
         # Only open context menu character item right clicked, not empty line.
         if len(character_id) > 0:
-            outlist = self.options.Get("outlist")[self.options.Get("index")]
             for r in outlist:
                 if str(r['pilot_id']) == character_id:
                     character_id = r['pilot_id']
@@ -815,12 +980,12 @@ class Frame(wx.Frame):
             hl_alliance = False
 
             for entry in highlighted_list:
-                if entry[0] == self.options.Get("outlist")[self.options.Get("index")][rowidx]['pilot_id']:
+                if entry[0] == outlist[rowidx]['pilot_id']:
                     hl_char = True
-                if entry[0] == self.options.Get("outlist")[self.options.Get("index")][rowidx]['corp_id']:
+                if entry[0] == outlist[rowidx]['corp_id']:
                     hl_corp = True
                 if alliance_name != 'None':
-                    if entry[0] == self.options.Get("outlist")[self.options.Get("index")][rowidx]['alliance_id']:
+                    if entry[0] == outlist[rowidx]['alliance_id']:
                         hl_alliance = True
 
             # Context menu to highlight characters, corporations and alliances
@@ -875,14 +1040,17 @@ class Frame(wx.Frame):
             self.PopupMenu(self.menu, event.GetPosition())
             self.menu.Destroy()
 
-    def sortOutlist(self, event=None, outlist=None, duration=None, filtered=None):
+    def sortOutlist(self, event=None, outlist=None, duration=None, filtered=None, streamed=False):
         """
-        Pass the outlist to sortarray.sort_array() and pass back to updateList to refresh gui view.
+        Pass the outlist to sortarray.sort_array(), store it in the history and pass back to updateList to refresh gui
+        view. Without an outlist the current history entry is sorted.
         :param event: Required
         :param outlist: outlist to process
         :param duration: How long outlist took to generate (typically given when called by __main__)
         :param filtered: How many pilots were filtered out before processing the clipboard (typically given when called
         by __main__)
+        :param streamed: True if outlist is the final result of a paste streamed into the history with upsertPilot(),
+        otherwise a new outlist is added to the history
         """
         if event is None:
             # Default sort by character name ascending.
@@ -908,8 +1076,16 @@ class Frame(wx.Frame):
         self.options.Set("SortDesc", sort_desc)
         event = None
         # Sort outlist. Note: outlist columns are not the same as self.grid columns!!!
+        store = history.get_store()
+        resort = outlist is None
         if outlist is None:
-            outlist = self.options.Get("outlist", False)[self.options.Get("index")]
+            entry_id = store.current_id
+            outlist = store.current()
+        elif streamed and self.streaming_id is not None:
+            entry_id = self.streaming_id
+            self.streaming_id = None
+        else:
+            entry_id = store.append(outlist)
         if outlist:
             outlist = sortarray.sort_array(
                 outlist,
@@ -919,17 +1095,16 @@ class Frame(wx.Frame):
                 sec_desc=False,  # Secondary sort by name always ascending
                 case_sensitive=False
                 )
-        orig = self.options.Get("outlist", [])
-        if orig is not None:
-            orig[self.options.Get("index")] = outlist
-            self.options.Set("outlist", orig)
-        else:
-            self.options.Set("outlist", [outlist])
-        self.updateList(outlist, duration=duration, filtered=filtered)
+        if entry_id is None:
+            return
+        # Re-sorting the current entry only changes the order, the history writes it later
+        store.put(entry_id, outlist, defer=resort)
+        if entry_id == store.current_id:
+            self.updateList(outlist, duration=duration, filtered=filtered)
 
     def _toggleHighlighting(self, e):
         """
-        Check and set highlight options, pass to updateList to refresh grid view
+        Check and set highlight options, _onGridOptionChanged() refreshes the grid view
         :param e: Required
         """
         self.options.Set("HlBlops", self.hl_blops.IsChecked())
@@ -937,7 +1112,6 @@ class Frame(wx.Frame):
         self.options.Set("HlList", self.hl_list.IsChecked())
         self.options.Set("HlSuper", self.hl_super.IsChecked())
         self.options.Set("HlTitan", self.hl_titan.IsChecked())
-        self.updateList(self.options.Get("outlist", [])[self.options.Get("index")])
 
     def _toggleStayOnTop(self, evt=None):
         """
@@ -958,7 +1132,7 @@ class Frame(wx.Frame):
         self.__set_properties(dark_toggle=True)
         self.Refresh()
         self.Update()
-        self.updateList(self.options.Get("outlist")[self.options.Get("index")])
+        self.updateList(history.get_store().current())
 
     def _openAboutDialog(self, evt=None):
         """
@@ -978,7 +1152,6 @@ class Frame(wx.Frame):
         :param evt: Required
         """
         self.options.Set("ignoredList", [])
-        self.updateList(self.options.Get("outlist", [])[self.options.Get("index")])
         statusmsg.push_status("Cleared ignored entities")
 
     def _clearHighlightedEntities(self, evt=None):
@@ -987,7 +1160,6 @@ class Frame(wx.Frame):
         :param evt: Required
         """
         self.options.Set("highlightedList", [])
-        self.updateList(self.options.Get("outlist", [])[self.options.Get("index")])
         statusmsg.push_status("Cleared highlighted entities")
 
     def _restoreColWidth(self):
@@ -1037,13 +1209,21 @@ class Frame(wx.Frame):
 
     def _clear_kill_cache(self, e):
         """
-        Use shutil.rmtree() to remove the entire kills folder and stored kills
+        Remove every stored killmail from the killstore, every cached zKillboard page from the pagecache and every
+        finished pilot row from the resultcache
         :param e:
         """
-        if os.path.exists(os.path.join(config.PREF_PATH, 'kills/')):
-            shutil.rmtree(os.path.join(config.PREF_PATH, 'kills/'))
-            os.makedirs(os.path.join(config.PREF_PATH, 'kills/'))
-        statusmsg.push_status("Cleared killmail cache")
+        store = killstore.get_store()
+        stats = store.stats()
+        store.clear()
+        pagecache.get_cache().clear()
+        resultcache.get_cache().clear()
+        statusmsg.push_status("Cleared killmail cache ({} killmails, {} MB)".format(
+            stats['killmails'], round(stats['file_bytes'] / 1048576, 1)))
+
+    def _profileNextPaste(self, e):
+        profiling.request()
+        statusmsg.push_status("The next paste will be profiled, see the profile files in {}".format(config.PREF_PATH))
 
     def _clear_static_data(self, e):
         for file in ['invTypes.csv', 'invGroups.csv', 'mapSolarSystems.csv', 'mapRegions.csv', 'mapDenormalize.csv']:
@@ -1066,6 +1246,7 @@ class Frame(wx.Frame):
         # Delete last outlist and NPSIList
         # Write pickle container to disk
         self.options.Save()
+        history.get_store().flush()
         event.Skip() if event else False
 
     def OnQuit(self, e):
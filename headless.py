@@ -0,0 +1,136 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Headless batch mode. Reads pilot names, one per line, from a file or stdin, runs them through the same analyze.main()
+pipeline the GUI uses and writes one row per pilot as JSON Lines or CSV, so HawkEye can score pilots on a server or be
+benchmarked without a display. wx is not needed. Progress is drawn on stderr while it runs, or logged if stderr is not
+a terminal, and a timing summary is printed when the run is done.
+
+    python headless.py names.txt --format csv --output rows.csv --workers 20
+    type local.txt | python headless.py
+"""
+import analyze
+import argparse
+import config
+import csv
+import json
+import logging
+import multiprocessing
+import statspool
+import statusmsg
+import sys
+import time
+
+Logger = logging.getLogger(__name__)
+
+
+def read_names(source):
+    """
+    :param source: File object to read
+    :return: List of unique, stripped pilot names in input order
+    """
+    names = []
+    for line in source:
+        name = line.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def write_jsonl(rows, out):
+    """
+    :param rows: List of pilot rows as returned by analyze.main()
+    :param out: File object to write to
+    """
+    for row in rows:
+        out.write(json.dumps(row, default=str) + '\n')
+
+
+def write_csv(rows, out):
+    """
+    Columns are the keys of the first row, nested values (recent kills and losses) are written as JSON.
+    :param rows: List of pilot rows as returned by analyze.main()
+    :param out: File object to write to
+    """
+    if not rows:
+        return
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]), extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({k: json.dumps(v, default=str) if isinstance(v, (list, dict)) else v for k, v in row.items()})
+
+
+def run(names, workers=None, max_killmails=None, max_age=None):
+    """
+    Analyze names without a GUI. Settings given here only apply to this process, the options file is not saved.
+    :param names: List of pilot names
+    :param workers: Pilots analyzed at the same time, defaults to config.PILOT_WORKERS
+    :param max_killmails: maxKillmails setting, defaults to the stored option
+    :param max_age: maxKillmailAge setting in days, 0 for no limit, defaults to the stored option
+    :return: Tuple of (rows, number of pilots filtered out, dictionary of timings)
+    """
+    if workers:
+        config.PILOT_WORKERS = workers
+    if max_killmails is not None:
+        config.OPTIONS_OBJECT.Set("maxKillmails", max_killmails)
+    if max_age is not None:
+        config.OPTIONS_OBJECT.Set("maxKillmailAge", max_age)
+    start_time = time.time()
+    rows, filtered = analyze.main(names, True)
+    duration = time.time() - start_time
+    rows = rows or []
+    timings = {'pilots': len(rows),
+               'filtered': filtered or 0,
+               'seconds': round(duration, 2),
+               'pilots_per_second': round(len(rows) / duration, 2) if duration > 0 else None,
+               'zkill_requests': analyze.ZKILL_LIMITER.stats()['requests']}
+    return rows, filtered, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze EVE Online pilots without the GUI.')
+    parser.add_argument('input', nargs='?', help='File with one pilot name per line, stdin if omitted')
+    parser.add_argument('-o', '--output', help='File to write the rows to, stdout if omitted')
+    parser.add_argument('-f', '--format', choices=['jsonl', 'csv'], default='jsonl', help='Output format')
+    parser.add_argument('-w', '--workers', type=int, help='Pilots analyzed at the same time')
+    parser.add_argument('-k', '--max-killmails', type=int, help='Killmails analyzed per pilot and list')
+    parser.add_argument('-a', '--max-age', type=int, help='Only analyze killmails younger than this many days, 0 for any')
+    parser.add_argument('-m', '--metrics', choices=['json', 'prometheus', 'both'],
+                        help='Write stage timings and counters to metrics.json / metrics.prom in the preferences folder')
+    args = parser.parse_args(argv)
+    if args.metrics:
+        config.METRICS_EXPORT = args.metrics
+
+    if args.input:
+        with open(args.input, encoding='utf-8') as f:
+            names = read_names(f)
+    else:
+        names = read_names(sys.stdin)
+    if not names:
+        sys.stderr.write('No pilot names given\n')
+        return 1
+
+    sink = statusmsg.CliSink() if sys.stderr.isatty() else statusmsg.log_sink
+    statusmsg.add_sink(sink)
+    try:
+        rows, filtered, timings = run(names, args.workers, args.max_killmails, args.max_age)
+    finally:
+        statusmsg.remove_sink(sink)
+        statspool.shutdown()
+    if sink is not statusmsg.log_sink:
+        sys.stderr.write('\n')
+    write = write_csv if args.format == 'csv' else write_jsonl
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as out:
+            write(rows, out)
+    else:
+        write(rows, sys.stdout)
+    sys.stderr.write('Analyzed {pilots} pilots ({filtered} filtered out) in {seconds} seconds, {pilots_per_second} '
+                     'pilots per second, {zkill_requests} zKillboard requests\n'.format(**timings))
+    return 0
+
+
+if __name__ == "__main__":
+    # Stats worker processes are spawned, they must not run the batch again when they import this module
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+History of analyzed pastes in PREF_PATH/history.db, paged through with the Previous and Next buttons. Every entry is an
+outlist, the list of pilot rows of one paste, stored once when the paste finishes as a compressed pickle instead of
+being pickled with the options on every save. Only the config.HISTORY_LOADED most recently used outlists are kept in
+memory, others are loaded when the user navigates to them. The history holds at most "historySize" entries (default
+config.HISTORY_SIZE), when it is full the entry added or navigated to longest ago is evicted. Re-sorting an outlist only
+changes the copy in memory, it is written when it leaves memory, with the next write or on flush().
+"""
+import collections
+import config
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+Logger = logging.getLogger(__name__)
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+class History:
+    def __init__(self, path):
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.execute("""create table if not exists history(
+                            entry_id integer primary key autoincrement,
+                            accessed real,
+                            pilots int,
+                            data blob)""")
+        self._db.commit()
+        self._ids = [r[0] for r in self._db.execute("select entry_id from history order by entry_id")]
+        self._loaded = collections.OrderedDict()  # entry_id: outlist, least recently used first
+        self._dirty = set()  # Loaded entries whose outlist was re-sorted but not written yet
+        self.current_id = None  # Entry shown in the grid, None before the first paste of a session
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+    def append(self, outlist):
+        """
+        Add the outlist of a new paste as the newest entry and make it the current one. The list object is kept, a
+        streamed outlist can keep growing in memory until put() stores its final state.
+        :param outlist: List of pilot rows
+        :return: Entry ID
+        """
+        with self._lock:
+            entry_id = self._db.execute("insert into history (accessed, pilots, data) values (?, ?, ?)",
+                                        (time.time(), len(outlist), _dump(outlist))).lastrowid
+            self._ids.append(entry_id)
+            self.current_id = entry_id
+            self._remember(entry_id, outlist)
+            self._evict()
+            self._flush()
+            self._db.commit()
+        return entry_id
+
+    def put(self, entry_id, outlist, defer=False):
+        """
+        Replace the stored outlist of an entry, for instance once a streamed paste is complete
+        :param entry_id: Entry ID
+        :param outlist: List of pilot rows
+        :param defer: True if outlist is only a re-sort of the entry, then only the copy in memory is replaced and
+        writing it is left to flush(), so clicking through the column headers doesn't store the outlist every time
+        """
+        with self._lock:
+            if entry_id not in self._ids:
+                return
+            if defer:
+                self._dirty.add(entry_id)
+                self._remember(entry_id, outlist)
+                return
+            self._dirty.discard(entry_id)
+            self._write(entry_id, outlist)
+            self._flush()
+            self._db.commit()
+            self._remember(entry_id, outlist)
+
+    def flush(self):
+        """
+        Write the re-sorted outlists put() deferred, called on exit
+        """
+        with self._lock:
+            if self._dirty:
+                self._flush()
+                self._db.commit()
+
+    def get(self, entry_id):
+        """
+        :param entry_id: Entry ID
+        :return: Outlist of the entry, loaded from disk if it isn't in memory, or None if there is no such entry
+        """
+        with self._lock:
+            if entry_id not in self._ids:
+                return None
+            if entry_id in self._loaded:
+                self._loaded.move_to_end(entry_id)
+                return self._loaded[entry_id]
+            row = self._db.execute("select data from history where entry_id = ?", (entry_id,)).fetchone()
+            try:
+                outlist = pickle.loads(zlib.decompress(row[0]))
+            except Exception:
+                Logger.warning('Discarding unreadable history entry {}'.format(entry_id), exc_info=True)
+                outlist = []
+            self._remember(entry_id, outlist)
+            return outlist
+
+    def current(self):
+        """
+        :return: Outlist shown in the grid, or None
+        """
+        with self._lock:
+            return self.get(self.current_id) if self.current_id is not None else None
+
+    def step(self, offset):
+        """
+        Move the current entry offset entries back (negative) or forward. Going back from no current entry goes to the
+        newest entry.
+        :param offset: Number of entries to move
+        :return: Outlist of the new current entry, or None if there is no entry that far, the current one is kept
+        """
+        with self._lock:
+            if self.current_id in self._ids:
+                index = self._ids.index(self.current_id) + offset
+            else:
+                index = len(self._ids) + offset if offset < 0 else len(self._ids)
+            if not 0 <= index < len(self._ids):
+                return None
+            self.current_id = self._ids[index]
+            self._db.execute("update history set accessed = ? where entry_id = ?", (time.time(), self.current_id))
+            self._db.commit()
+            return self.get(self.current_id)
+
+    def latest(self):
+        """
+        :return: Newest outlist that is not empty, or an empty list
+        """
+        with self._lock:
+            for entry_id in reversed(self._ids):
+                outlist = self.get(entry_id)
+                if outlist:
+                    return outlist
+        return []
+
+    def _remember(self, entry_id, outlist):
+        self._loaded[entry_id] = outlist
+        self._loaded.move_to_end(entry_id)
+        # The current outlist stays in memory, a streamed paste keeps growing there until it is put()
+        for old in [i for i in self._loaded if i != self.current_id][:max(len(self._loaded) - config.HISTORY_LOADED, 0)]:
+            if old in self._dirty:
+                self._dirty.discard(old)
+                self._write(old, self._loaded[old])
+                self._db.commit()
+            del self._loaded[old]
+
+    def _write(self, entry_id, outlist):
+        self._db.execute("update history set pilots = ?, data = ? where entry_id = ?",
+                         (len(outlist), _dump(outlist), entry_id))
+
+    def _flush(self):
+        for entry_id in self._dirty:
+            self._write(entry_id, self._loaded[entry_id])
+        self._dirty.clear()
+
+    def _evict(self):
+        """
+        Delete the least recently viewed entries beyond the historySize option, never the current one
+        """
+        size = max(config.OPTIONS_OBJECT.Get("historySize", default=config.HISTORY_SIZE), 1)
+        excess = len(self._ids) - size
+        if excess <= 0:
+            return
+        evicted = [r[0] for r in self._db.execute(
+            "select entry_id from history where entry_id != ? order by accessed limit ?", (self.current_id, excess))]
+        self._db.executemany("delete from history where entry_id = ?", [(i,) for i in evicted])
+        for entry_id in evicted:
+            self._ids.remove(entry_id)
+            self._loaded.pop(entry_id, None)
+            self._dirty.discard(entry_id)
+
+
+def _dump(outlist):
+    return zlib.compress(pickle.dumps(outlist, pickle.HIGHEST_PROTOCOL))
+
+
+def get_store():
+    """
+    :return: The process wide History, opened on first use. Outlists saved in the options by older versions are moved
+    into it.
+    """
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = History(os.path.join(config.PREF_PATH, 'history.db'))
+            _migrate(_STORE)
+    return _STORE
+
+
+def _migrate(store):
+    options = config.OPTIONS_OBJECT
+    if "outlist" not in options.ListKeys():
+        return
+    for outlist in options.Get("outlist", default=[]) or []:
+        if outlist:
+            store.append(outlist)
+    store.current_id = None
+    options.Del("outlist")
+    if "index" in options.ListKeys():
+        options.Del("index")
+    Logger.info('Moved {} outlists from the options into the history'.format(len(store)))
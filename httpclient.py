@@ -0,0 +1,139 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+The shared HTTP client layer, every request to zKillboard, ESI and Fuzzwork made by analyze.py and eveDB.py goes through
+here. Each thread owns one persistent event loop, and each loop owns one aiohttp ClientSession whose connector keeps
+per-host connection pools alive, caches DNS lookups and accepts gzip, so TCP and TLS handshakes are only paid once per
+host instead of once per request.
+"""
+import aiohttp
+import asyncio
+import config
+import logging
+import os
+import threading
+
+Logger = logging.getLogger(__name__)
+
+HEADERS = {'Accept-Encoding': 'gzip', 'User-Agent': 'HawkEye, Author: Kain Tarr'}
+
+_THREAD_STATE = threading.local()
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def get_event_loop():
+    """
+    Return the event loop owned by the calling thread, creating it on first use. The loop is never closed, so every
+    paste analyzed by a thread (ID resolution, kills, losses) runs on the same long-lived loop and reuses its session.
+    :return: asyncio event loop for this thread
+    """
+    loop = getattr(_THREAD_STATE, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        _THREAD_STATE.loop = loop
+    return loop
+
+
+def run(coro):
+    """
+    Run a coroutine to completion on the calling thread's persistent event loop.
+    :param coro: Coroutine to run
+    :return: Result of the coroutine
+    """
+    return get_event_loop().run_until_complete(coro)
+
+
+def get_session():
+    """
+    Return the pooled ClientSession of the running event loop, creating it on first use. Must be called from a
+    coroutine.
+    :return: aiohttp.ClientSession
+    """
+    loop = asyncio.get_event_loop()
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=config.HTTP_MAX_CONNECTIONS,
+                                             limit_per_host=config.HTTP_MAX_PER_HOST,
+                                             ttl_dns_cache=config.HTTP_DNS_TTL,
+                                             keepalive_timeout=config.HTTP_KEEPALIVE)
+            session = aiohttp.ClientSession(connector=connector,
+                                            headers=HEADERS,
+                                            timeout=aiohttp.ClientTimeout(total=config.HTTP_TIMEOUT))
+            _SESSIONS[loop] = session
+    return session
+
+
+async def get_bytes(url):
+    """
+    GET a url and return the raw body.
+    :param url: Url to request
+    :return: Tuple of (status code, body as bytes)
+    """
+    async with get_session().get(url) as resp:
+        return resp.status, await resp.read()
+
+
+async def download(url, path):
+    """
+    Stream a large file, like a Fuzzwork dump, to path. The session's total timeout does not apply, only a stall of
+    config.HTTP_DOWNLOAD_TIMEOUT seconds aborts it. The body goes to path.tmp first and replaces path once complete, so
+    an aborted download never leaves a truncated file behind.
+    :param url: Url to request
+    :param path: File to write
+    :return: Status code, path is only written if it is 200
+    """
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=config.HTTP_DOWNLOAD_TIMEOUT)
+    async with get_session().get(url, timeout=timeout) as resp:
+        if resp.status != 200:
+            return resp.status
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                async for chunk in resp.content.iter_chunked(1 << 16):
+                    f.write(chunk)
+            os.replace(path + '.tmp', path)
+        finally:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+        return resp.status
+
+
+async def post_json(url, data):
+    """
+    POST an already serialised json body to a url.
+    :param url: Url to request
+    :param data: json string to send
+    :return: Tuple of (status code, body as text)
+    """
+    async with get_session().post(url, data=data, headers={'Content-Type': 'application/json'}) as resp:
+        return resp.status, await resp.text()
+
+
+def is_retryable(status):
+    """
+    The retry policy of every ESI lookup: server errors are retried, client errors (4xx) fail the same way again, except
+    ESI's error limit (420) and rate limit (429)
+    :param status: HTTP status code of a failed request
+    :return: Boolean, True if the request should be retried
+    """
+    return not 400 <= status < 500 or status in (420, 429)
+
+
+def retry_delay(attempt):
+    """
+    :param attempt: Number of the attempt about to be made, counting from 0
+    :return: Seconds to back off before it, config.ESI_BACKOFF doubled on every retry
+    """
+    return config.ESI_BACKOFF * 2 ** (attempt - 1) if attempt else 0
+
+
+async def close():
+    """
+    Close the session of the running event loop, if any.
+    """
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.pop(asyncio.get_event_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
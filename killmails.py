@@ -0,0 +1,300 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Run-wide killmail resolver. Pilots in the same gang share most of their killmails, so instead of every pilot checking
+the local cache and asking ESI for the same killmail_id, analyze.py creates one KillmailResolver per paste and every
+pilot's kills and losses are merged through it. Each unique killmail is loaded or fetched exactly once, concurrent
+callers await the same in-flight future.
+What the resolver hands out is not the ESI json but a KillRecord: the handful of fields the stats read, with the
+pilot independent work (attacker tuples, killed on gate, region, space and timezone of the kill) done once per killmail
+instead of once per pilot on it. Records are stored next to the raw killmail in the killstore.
+"""
+import aiohttp
+import asyncio
+import collections
+import config
+import httpclient
+import json
+import killstore
+import logging
+import metrics
+import statusmsg
+import time
+
+Logger = logging.getLogger(__name__)
+
+RECORD_VERSION = 1  # Bump when KillRecord or build_record() changes, stored records are rebuilt from the raw killmail
+
+Attacker = collections.namedtuple('Attacker', ['character_id', 'corp_id', 'corporation_id', 'alliance_id',
+                                               'ship_type_id', 'weapon_type_id'])
+KillRecord = collections.namedtuple('KillRecord', ['killmail_id', 'killmail_time', 'solar_system_id', 'region', 'space',
+                                                   'tz', 'on_gate', 'victim_ship_type_id', 'attackers', 'value'])
+
+
+class KillmailResolver:
+    def __init__(self, db, store=None):
+        """
+        :param db: EveDB used to build KillRecords
+        :param store: KillmailStore, defaults to the process wide one
+        """
+        self._db = db
+        self._killmails = {}
+        self._loads = set()  # Running _load() tasks, referenced so they can't be garbage collected mid-flight
+        self._store = store if store is not None else killstore.get_store()
+        self.requested = 0
+        self.from_cache = 0
+        self.from_ccp = 0
+
+    async def merge(self, zkill_data):
+        """
+        Resolve every killmail in zkill_data, through the local killstore or CCP, then complete their KillRecords with
+        the zkill value, in zkill order. Killmails that could not be resolved, because CCP didn't return them or
+        building their record failed, are skipped, the error is logged once by _load().
+        :param zkill_data: zkill data, list of dictionaries containing killmail_id and zkb
+        :return: List of KillRecords
+        """
+        self.requested += len(zkill_data)
+        missing = []
+        for z in zkill_data:
+            if z['killmail_id'] not in self._killmails:
+                # Register the future before anything is awaited, so no other pilot can start the same lookup
+                self._killmails[z['killmail_id']] = asyncio.get_event_loop().create_future()
+                missing.append((z['killmail_id'], z['zkb']['hash']))
+        if missing:
+            task = asyncio.ensure_future(self._load(missing))
+            self._loads.add(task)
+            task.add_done_callback(self._loads.discard)
+        start_time = time.time()
+        # Shield the shared futures, a cancelled caller must not cancel the fetch other pilots are awaiting
+        results = await asyncio.gather(*[asyncio.shield(self._killmails[z['killmail_id']]) for z in zkill_data],
+                                       return_exceptions=True)
+        for r in results:
+            if isinstance(r, asyncio.CancelledError):
+                # The load was cancelled with the analysis, don't hand out a partial list as if it was complete
+                raise r
+        Logger.info('Resolved {} killmails ({} new) in {} seconds'.format(
+            len(zkill_data), len(missing), round(time.time() - start_time, 2)))
+
+        return [record._replace(value=float(zkill['zkb']['totalValue']))
+                for zkill, record in zip(zkill_data, results) if isinstance(record, KillRecord)]
+
+    async def _load(self, missing):
+        """
+        Resolve the futures of killmails requested for the first time during this run. All of them are looked up in
+        the killstore with one batched query, the rest is fetched from CCP. Every fetched killmail is turned into a
+        record and handed out as soon as it arrives, and stored config.KILLSTORE_BATCH at a time.
+        :param missing: List of (killmail_id, hash) tuples
+        """
+        try:
+            await self.__load(missing)
+        except Exception as e:
+            # Pass the real error on instead of a cancel, an analysis must not look stopped by the user
+            Logger.error('Failed to resolve {} killmails'.format(len(missing)), exc_info=True)
+            self._fail(missing, e)
+        finally:
+            # Cancelled, never leave a pilot waiting on a killmail that will not be resolved anymore
+            self._fail(missing, None)
+
+    def _fail(self, missing, error):
+        """
+        Complete the futures of missing that are still pending
+        :param missing: List of (killmail_id, hash) tuples
+        :param error: Exception to set on them, None to cancel them
+        """
+        for killmail_id, killhash in missing:
+            future = self._killmails[killmail_id]
+            if future.done():
+                continue
+            if error is None:
+                future.cancel()
+            else:
+                future.set_exception(error)
+
+    async def __load(self, missing):
+        loop = asyncio.get_event_loop()
+        try:
+            with metrics.span('killmail_cache'):
+                cached = await loop.run_in_executor(None, self._read, [m[0] for m in missing])
+        except Exception:
+            Logger.error('Failed to read the killmail cache', exc_info=True)
+            cached = {}
+        fetch = []
+        for killmail_id, killhash in missing:
+            if killmail_id in cached:
+                self.from_cache += 1
+                self._killmails[killmail_id].set_result(cached[killmail_id])
+            else:
+                fetch.append((killmail_id, killhash))
+        statusmsg.count('cache_hits', len(missing) - len(fetch))
+        metrics.count('killmail_cache_hits', len(missing) - len(fetch))
+        metrics.count('killmail_cache_misses', len(fetch))
+        if not fetch:
+            return
+
+        self.from_ccp += len(fetch)
+        statusmsg.push_status('Gathering {} killmails from CCP servers.'.format(len(fetch)))
+        start_time = time.time()
+        tasks = {asyncio.ensure_future(_fetch(i, h)): i for i, h in fetch}
+        pending = set(tasks)
+        unsaved, records = [], {}  # Fetched killmails not written to the killstore yet, and their records
+        try:
+            with metrics.span('esi_killmails'):
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    arrived = []
+                    for task in done:
+                        future = self._killmails[tasks[task]]
+                        if task.exception() is not None:
+                            future.set_exception(task.exception())
+                        elif task.result() is None:
+                            future.set_result(None)
+                        else:
+                            arrived.append((tasks[task], task.result()))
+                    if arrived:
+                        # Hand out killmails as they arrive, a slow one must not hold up pilots waiting on the others
+                        unsaved.extend(k for i, k in arrived)
+                        built = await loop.run_in_executor(None, self._build_records, [k for i, k in arrived])
+                        records.update(built)
+                        for killmail_id, killmail in arrived:
+                            self._killmails[killmail_id].set_result(built.get(killmail['killmail_id']))
+                    if unsaved and (len(unsaved) >= config.KILLSTORE_BATCH or not pending):
+                        batch, batch_records, unsaved, records = unsaved, records, [], {}
+                        try:
+                            await loop.run_in_executor(None, self._store.put_many, batch, batch_records,
+                                                       RECORD_VERSION)
+                        except Exception:
+                            Logger.error('Failed to write {} killmails to the killmail cache'.format(len(batch)),
+                                         exc_info=True)
+        except asyncio.CancelledError:
+            # Keep what already arrived, the paste that superseded this one most likely needs the same killmails
+            for task in pending:
+                task.cancel()
+            self._save(unsaved + [t.result() for t in pending if t.done() and not t.cancelled() and
+                                  t.exception() is None and t.result() is not None])
+            raise
+        Logger.info('Gathered {} killmails from CCP servers in {} seconds'.format(
+            len(fetch), round(time.time() - start_time, 2)))
+
+    def _read(self, killmail_ids):
+        """
+        Executor side of the killstore lookup, stored killmails without a current record get one built and stored.
+        :param killmail_ids: List of killmail IDs
+        :return: Dictionary of killmail_id: KillRecord for every killmail found
+        """
+        records, raw = self._store.get_records(killmail_ids, RECORD_VERSION)
+        if raw:
+            built = self._build_records(raw.values())
+            self._store.put_records(built, RECORD_VERSION)
+            records.update(built)
+        return records
+
+    def _save(self, fetched):
+        """
+        Store killmails fetched by a cancelled load, right away on the calling thread so it happens before the loop
+        moves on.
+        :param fetched: List of ESI killmails
+        """
+        if not fetched:
+            return
+        try:
+            self._store.put_many(fetched, self._build_records(fetched), RECORD_VERSION)
+            Logger.info('Stored {} killmails fetched before the load was cancelled'.format(len(fetched)))
+        except Exception:
+            Logger.error('Failed to write {} killmails to the killmail cache'.format(len(fetched)), exc_info=True)
+
+    def _build_records(self, killmails):
+        """
+        :param killmails: Iterable of ESI killmails
+        :return: Dictionary of killmail_id: KillRecord
+        """
+        return {k['killmail_id']: build_record(k, self._db) for k in killmails}
+
+    def summary(self):
+        """
+        :return: Human readable summary of the work done by this resolver
+        """
+        return '{} killmails requested, {} unique, {} from local cache, {} from CCP'.format(
+            self.requested, len(self._killmails), self.from_cache, self.from_ccp)
+
+
+def build_record(killmail, db):
+    """
+    :param killmail: ESI killmail
+    :param db: EveDB to use
+    :return: KillRecord without value, merge() fills that in from zkill
+    """
+    return KillRecord(killmail_id=killmail['killmail_id'],
+                      killmail_time=killmail['killmail_time'],
+                      solar_system_id=killmail['solar_system_id'],
+                      region=db.get_region(killmail['solar_system_id']),
+                      space=db.get_location(killmail['solar_system_id']),
+                      tz=get_timezone(killmail['killmail_time']),
+                      on_gate=db.killed_on_gate(killmail),
+                      victim_ship_type_id=killmail['victim'].get('ship_type_id'),
+                      attackers=tuple(Attacker(a.get('character_id'),
+                                               a.get('corp_id'),
+                                               a.get('corporation_id'),
+                                               a.get('alliance_id'),
+                                               a.get('ship_type_id'),
+                                               a.get('weapon_type_id')) for a in killmail['attackers']),
+                      value=None)
+
+
+def get_timezone(my_time):
+    """
+    Take a string timezone with CCP's weird formatting, determine timezone by the hour of the kill:
+    00:00 - 06:00 USTZ
+    06:00 - 14:00 AUTZ
+    14:00 - 00:00 EUTZ
+    :param my_time: Input time string
+    :return: Timezone
+    """
+    my_time = my_time.split('T')[1].split(':')
+    if int(my_time[0]) < 6:
+        return 'ustz'
+    if int(my_time[0]) < 14:
+        return 'autz'
+    return 'eutz'
+
+
+async def _fetch(killmail_id, killhash):
+    """
+    Fetch killmail from CCP servers through the shared httpclient session. Network errors, server errors and broken
+    bodies are retried up to config.ESI_RETRIES times, following httpclient.is_retryable() and retry_delay() like every
+    ESI lookup, client errors (4xx) like 422 for a bad hash are final.
+    :param killmail_id: Killmail ID
+    :param killhash: Killmail hash
+    :return: json response parsed into dictionary, or None if the killmail can't be fetched
+    """
+
+    url = "{}/v1/killmails/{}/{}/?datasource=tranquility".format(config.ESI_URL, killmail_id, killhash)
+    session = httpclient.get_session()
+    for attempt in range(config.ESI_RETRIES):
+        if attempt:
+            metrics.count('esi_retries')
+            await asyncio.sleep(httpclient.retry_delay(attempt))
+        metrics.count('esi_requests')
+        try:
+            with statusmsg.request():
+                async with session.get(url) as response:
+                    status = response.status
+                    r = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            Logger.warning('Failed to get killmail {}'.format(url))
+            continue
+        metrics.count('esi_bytes', len(r))
+        if status != 200:
+            if not httpclient.is_retryable(status):
+                Logger.warning('{} returned {}, the killmail can not be resolved'.format(url, status))
+                return None
+            Logger.warning('{} returned {}'.format(url, status))
+            continue
+        try:
+            j = json.loads(r)
+        except json.decoder.JSONDecodeError:
+            continue
+        if not isinstance(j, dict) or j.get('error'):
+            continue
+        return j
+    Logger.error('Gave up on killmail {} after {} attempts'.format(url, config.ESI_RETRIES))
+    return None
@@ -0,0 +1,194 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+The local killmail cache. Every ESI killmail is stored as a zlib compressed json blob in a single SQLite file
+(PREF_PATH/killmails.db) keyed by killmail_id, instead of one json file per killmail. Next to the raw killmail every
+row can hold the pickled analysis record killmails.py derives from it, which is what the stats actually read. Lookups
+are batched per pilot with get_many() / get_records(), and a lock makes the store safe to share between the analysis
+and GUI threads.
+"""
+import config
+import json
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+import threading
+import zlib
+
+Logger = logging.getLogger(__name__)
+
+_SQLITE_MAX_PARAMS = 900
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+class KillmailStore:
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.execute("""create table if not exists killmails(
+                            killmail_id integer primary key,
+                            killmail_time str,
+                            data blob)""")
+        columns = [row[1] for row in self._db.execute("pragma table_info(killmails)").fetchall()]
+        if 'record' not in columns:
+            self._db.execute("alter table killmails add column record blob")
+            self._db.execute("alter table killmails add column record_version int")
+        self._db.commit()
+        self.__import_json_cache()
+
+    def __import_json_cache(self):
+        """
+        One time import of the old PREF_PATH/kills/<id>.json cache, the folder is removed afterwards.
+        """
+        folder = os.path.join(config.PREF_PATH, 'kills')
+        if not os.path.isdir(folder):
+            return
+        killmails = []
+        for file in os.listdir(folder):
+            try:
+                with open(os.path.join(folder, file), 'r') as json_file:
+                    killmails.append(json.load(json_file))
+            except (ValueError, OSError):
+                continue
+            if len(killmails) >= 1000:
+                self.put_many(killmails)
+                killmails = []
+        self.put_many(killmails)
+        shutil.rmtree(folder, ignore_errors=True)
+        Logger.info('Imported old killmail cache from {}'.format(folder))
+
+    def get_many(self, killmail_ids):
+        """
+        Batched lookup of killmails.
+        :param killmail_ids: Iterable of killmail IDs
+        :return: Dictionary of killmail_id: killmail for every killmail found
+        """
+        killmail_ids = list(killmail_ids)
+        found = {}
+        with self._lock:
+            for i in range(0, len(killmail_ids), _SQLITE_MAX_PARAMS):
+                chunk = killmail_ids[i:i + _SQLITE_MAX_PARAMS]
+                rows = self._db.execute("select killmail_id, data from killmails where killmail_id in ({})".format(
+                    ', '.join(['?'] * len(chunk))), chunk).fetchall()
+                for killmail_id, data in rows:
+                    found[killmail_id] = json.loads(zlib.decompress(data))
+        return found
+
+    def get_records(self, killmail_ids, version):
+        """
+        Batched lookup of analysis records.
+        :param killmail_ids: Iterable of killmail IDs
+        :param version: Current record version, older records are treated as missing
+        :return: Tuple of ({killmail_id: record}, {killmail_id: raw killmail}), the second dictionary holds the stored
+        killmails that have no current record yet
+        """
+        killmail_ids = list(killmail_ids)
+        records = {}
+        raw = {}
+        with self._lock:
+            for i in range(0, len(killmail_ids), _SQLITE_MAX_PARAMS):
+                chunk = killmail_ids[i:i + _SQLITE_MAX_PARAMS]
+                rows = self._db.execute("select killmail_id, case when record_version = ? then record end, "
+                                        "case when record_version = ? then null else data end from killmails "
+                                        "where killmail_id in ({})".format(', '.join(['?'] * len(chunk))),
+                                        [version, version] + chunk).fetchall()
+                for killmail_id, record, data in rows:
+                    if record is not None:
+                        records[killmail_id] = pickle.loads(record)
+                    else:
+                        raw[killmail_id] = json.loads(zlib.decompress(data))
+        return records, raw
+
+    def get(self, killmail_id):
+        """
+        :param killmail_id: Killmail ID
+        :return: Killmail if stored, otherwise None
+        """
+        return self.get_many([killmail_id]).get(killmail_id)
+
+    def put_many(self, killmails, records=None, version=None):
+        """
+        Store a batch of ESI killmails in one transaction.
+        :param killmails: List of killmail dictionaries as returned by ESI
+        :param records: Optional dictionary of killmail_id: analysis record to store with them
+        :param version: Version of the records
+        """
+        records = records or {}
+        rows = [(k['killmail_id'],
+                 k.get('killmail_time'),
+                 zlib.compress(json.dumps(k, separators=(',', ':')).encode()),
+                 _dump(records.get(k['killmail_id'])),
+                 version if k['killmail_id'] in records else None) for k in killmails]
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany("insert or replace into killmails (killmail_id, killmail_time, data, record, "
+                                 "record_version) values (?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def put_records(self, records, version):
+        """
+        Store analysis records for killmails that are stored already.
+        :param records: Dictionary of killmail_id: analysis record
+        :param version: Version of the records
+        """
+        if not records:
+            return
+        with self._lock:
+            self._db.executemany("update killmails set record = ?, record_version = ? where killmail_id = ?",
+                                 [(_dump(r), version, i) for i, r in records.items()])
+            self._db.commit()
+
+    def stats(self):
+        """
+        :return: Dictionary with the number of stored killmails, their compressed size and the size of the file
+        """
+        with self._lock:
+            count, size = self._db.execute("select count(*), coalesce(sum(length(data)), 0) from killmails").fetchone()
+        return {'killmails': count, 'bytes': size, 'file_bytes': os.path.getsize(self._path)}
+
+    def prune(self, max_age_days):
+        """
+        Remove killmails older than max_age_days
+        :param max_age_days: Age in days, by killmail_time
+        :return: Number of killmails removed
+        """
+        with self._lock:
+            removed = self._db.execute("delete from killmails where killmail_time < strftime('%Y-%m-%dT%H:%M:%SZ', "
+                                       "'now', ?)", ('-{} days'.format(int(max_age_days)),)).rowcount
+            self._db.commit()
+        return removed
+
+    def clear(self):
+        """
+        Remove every stored killmail and shrink the file.
+        """
+        with self._lock:
+            self._db.execute("delete from killmails")
+            self._db.commit()
+            self._db.execute("vacuum")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _dump(record):
+    return None if record is None else pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+
+
+def get_store():
+    """
+    :return: The process wide KillmailStore, opened on first use
+    """
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = KillmailStore(os.path.join(config.PREF_PATH, 'killmails.db'))
+    return _STORE
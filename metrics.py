@@ -0,0 +1,239 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Timing spans and counters for the analysis pipeline. analyze.Analysis opens a Recorder per paste, and every stage
+wraps itself in span(): name to ID resolution, affiliation and name lookups, zkill list fetches, local killmail cache
+reads, ESI killmail fetches, stats and grid rendering. Spans are kept per paste and per pilot, the pilot being the one
+the current asyncio task works on, see set_pilot(). Spans may nest, 'affiliations' includes the 'names' lookup of
+corporation and alliance names. Counters track requests, retries, bytes and cache hits and misses, from which hit
+ratios are derived. Everything is also added to session wide totals.
+When a paste finishes, the paste and session figures are written to PREF_PATH as metrics.json and / or as metrics.prom
+in the Prometheus text format, depending on config.METRICS_EXPORT.
+"""
+import collections
+import config
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+Logger = logging.getLogger(__name__)
+
+_RECORDER = contextvars.ContextVar('recorder', default=None)
+_PILOT = contextvars.ContextVar('pilot', default=None)
+_LATEST = None
+
+
+class Recorder:
+    def __init__(self, label, pilots=0):
+        """
+        :param label: What is recorded, 'paste' or 'session'
+        :param pilots: Number of pilots pasted
+        """
+        self.label = label
+        self.pilots_pasted = pilots
+        self.started = time.time()
+        self.finished = None
+        self.stages = {}  # stage: [count, total seconds, max seconds]
+        self.pilots = collections.defaultdict(lambda: collections.defaultdict(float))
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, seconds, pilot_id=None):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            if pilot_id is not None:
+                self.pilots[pilot_id][stage] += seconds
+
+    def add_count(self, counter, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def ratios(self):
+        """
+        :return: Dictionary of cache name: hit ratio, for every pair of <cache>_hits / <cache>_misses counters
+        """
+        caches = set(c.rsplit('_', 1)[0] for c in self.counters if c.endswith(('_hits', '_misses')))
+        ratios = {}
+        for cache in caches:
+            hits = self.counters.get(cache + '_hits', 0)
+            total = hits + self.counters.get(cache + '_misses', 0)
+            ratios[cache] = round(hits / total, 4) if total else None
+        return ratios
+
+    def to_dict(self, pilots=True):
+        """
+        :param pilots: Include the per pilot spans
+        :return: json serializable summary
+        """
+        with self._lock:
+            data = {'label': self.label,
+                    'pilots_pasted': self.pilots_pasted,
+                    'started': self.started,
+                    'seconds': round((self.finished or time.time()) - self.started, 3),
+                    'stages': {s: {'count': e[0], 'seconds': round(e[1], 4), 'max': round(e[2], 4)}
+                               for s, e in sorted(self.stages.items())},
+                    'counters': dict(self.counters)}
+            if pilots:
+                data['pilots'] = {str(p): {s: round(v, 4) for s, v in stages.items()}
+                                  for p, stages in self.pilots.items()}
+        data['cache_hit_ratios'] = self.ratios()
+        return data
+
+
+_SESSION = Recorder('session')
+
+
+def begin_paste(pilots=0):
+    """
+    Start recording a paste in the current context, asyncio tasks created from it record into the same Recorder
+    :param pilots: Number of pilots pasted
+    :return: Tuple of (Recorder, token for finish_paste())
+    """
+    global _LATEST
+    recorder = Recorder('paste', pilots)
+    _LATEST = recorder
+    return recorder, _RECORDER.set(recorder)
+
+
+def finish_paste(recorder, token):
+    """
+    Stop recording the paste and export it
+    :param recorder: Recorder returned by begin_paste()
+    :param token: Token returned by begin_paste()
+    """
+    recorder.finished = time.time()
+    _RECORDER.reset(token)
+    export(recorder)
+
+
+def latest():
+    """
+    :return: Recorder of the most recent paste, or None. For code that runs outside the paste's tasks, like the GUI.
+    """
+    return _LATEST
+
+
+@contextlib.contextmanager
+def recording(label):
+    """
+    Record the block, and the asyncio tasks it creates, into a Recorder of its own that is neither exported nor
+    returned by latest(), for background work like the cache warmer. Everything still adds to the session totals.
+    :param label: What is recorded
+    :return: The Recorder
+    """
+    recorder = Recorder(label)
+    token = _RECORDER.set(recorder)
+    try:
+        yield recorder
+    finally:
+        recorder.finished = time.time()
+        _RECORDER.reset(token)
+
+
+def set_pilot(pilot_id):
+    """
+    Attribute the spans of the current asyncio task, and of the tasks it creates, to pilot_id
+    :param pilot_id: Pilot ID
+    """
+    _PILOT.set(pilot_id)
+
+
+@contextlib.contextmanager
+def span(stage, recorder=None, pilot_id=None):
+    """
+    Time the block as one span of stage
+    :param stage: Stage name
+    :param recorder: Recorder to add the span to, defaults to the paste of the current context
+    :param pilot_id: Pilot the span belongs to, defaults to the pilot of the current context
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        recorder = recorder or _RECORDER.get()
+        pilot_id = pilot_id or _PILOT.get()
+        if recorder is not None:
+            recorder.add_span(stage, seconds, pilot_id)
+        _SESSION.add_span(stage, seconds)
+
+
+def count(counter, n=1):
+    """
+    :param counter: Counter name, cache counters end in _hits and _misses
+    :param n: Amount to add
+    """
+    recorder = _RECORDER.get()
+    if recorder is not None:
+        recorder.add_count(counter, n)
+    _SESSION.add_count(counter, n)
+
+
+def export(recorder):
+    """
+    Write metrics.json (the paste with its per pilot spans, and the session totals) and / or metrics.prom (session
+    totals and the last paste) to PREF_PATH, as set by config.METRICS_EXPORT
+    :param recorder: Recorder of the paste that just finished
+    """
+    formats = config.METRICS_EXPORT
+    if not formats:
+        return
+    try:
+        if formats in ('json', 'both'):
+            _write('metrics.json', json.dumps({'paste': recorder.to_dict(),
+                                               'session': _SESSION.to_dict(pilots=False)}, indent=2))
+        if formats in ('prometheus', 'both'):
+            _write('metrics.prom', to_prometheus(recorder))
+    except OSError:
+        Logger.error('Failed to export metrics', exc_info=True)
+
+
+def to_prometheus(recorder):
+    """
+    :param recorder: Recorder of the last paste
+    :return: Session totals and the last paste in the Prometheus text exposition format
+    """
+    session = _SESSION.to_dict(pilots=False)
+    paste = recorder.to_dict(pilots=False)
+    lines = ['# HELP hawkeye_stage_seconds Seconds spent per pipeline stage this session',
+             '# TYPE hawkeye_stage_seconds summary']
+    for stage, s in session['stages'].items():
+        lines.append('hawkeye_stage_seconds_sum{{stage="{}"}} {}'.format(stage, s['seconds']))
+        lines.append('hawkeye_stage_seconds_count{{stage="{}"}} {}'.format(stage, s['count']))
+    lines += ['# HELP hawkeye_stage_seconds_max Longest single span per pipeline stage this session',
+              '# TYPE hawkeye_stage_seconds_max gauge']
+    lines += ['hawkeye_stage_seconds_max{{stage="{}"}} {}'.format(stage, s['max'])
+              for stage, s in session['stages'].items()]
+    lines += ['# HELP hawkeye_events_total Requests, retries, bytes and cache lookups this session',
+              '# TYPE hawkeye_events_total counter']
+    lines += ['hawkeye_events_total{{event="{}"}} {}'.format(c, v) for c, v in sorted(session['counters'].items())]
+    lines += ['# HELP hawkeye_cache_hit_ratio Cache hit ratio this session',
+              '# TYPE hawkeye_cache_hit_ratio gauge']
+    lines += ['hawkeye_cache_hit_ratio{{cache="{}"}} {}'.format(c, v)
+              for c, v in sorted(session['cache_hit_ratios'].items()) if v is not None]
+    lines += ['# HELP hawkeye_last_paste_seconds Duration of the last paste',
+              '# TYPE hawkeye_last_paste_seconds gauge',
+              'hawkeye_last_paste_seconds {}'.format(paste['seconds']),
+              '# HELP hawkeye_last_paste_pilots Pilots in the last paste',
+              '# TYPE hawkeye_last_paste_pilots gauge',
+              'hawkeye_last_paste_pilots {}'.format(paste['pilots_pasted'])]
+    lines += ['hawkeye_last_paste_stage_seconds{{stage="{}"}} {}'.format(stage, s['seconds'])
+              for stage, s in paste['stages'].items()]
+    return '\n'.join(lines) + '\n'
+
+
+def _write(file, text):
+    """
+    Replace PREF_PATH/file atomically, so a scraper never reads half a file
+    """
+    path = os.path.join(config.PREF_PATH, file)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,224 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+NumPy stats engine. Turns a pilot's KillRecords into columns (one row per killmail and one row per attacker) and
+fills the same accumulators as analyze._accumulate_kills() / analyze._accumulate_losses() with vectorized operations
+instead of walking every attacker of every killmail seven times. Both engines produce identical accumulators, float
+sums are accumulated in killmail order with cumsum so even the rounding matches, and either engine can update an
+accumulator the other one built. numpy is optional, AVAILABLE is False if it can't be imported.
+"""
+import datetime
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+Logger = logging.getLogger(__name__)
+
+AVAILABLE = np is not None
+_NONE = -1  # Stands in for a missing ID in integer columns
+
+
+def accumulate_kills(acc, pilot_data, killmails, db, sign=1):
+    """
+    Drop-in replacement for analyze._accumulate_kills()
+    :param acc: Accumulator from analyze._get_kill_accumulator()
+    :param pilot_data: Pilot data to use
+    :param killmails: List of killmails.KillRecords, newest first
+    :param db: EveDB to use
+    :param sign: 1 to add the killmails, -1 to subtract them
+    """
+    if not killmails:
+        return
+    pilot_id = _id(pilot_data['pilot_id'])
+    corp_id = _id(pilot_data['corp_id'])
+    alliance_id = _id(pilot_data['alliance_id'])
+
+    # Killmail columns
+    km_ids = np.array([k.killmail_id for k in killmails], dtype=np.int64)
+    n_att = np.array([len(k.attackers) for k in killmails], dtype=np.int64)
+    values = np.array([k.value for k in killmails], dtype=np.float64)
+    tz = np.array([k.tz for k in killmails])
+    on_gate = np.array([k.on_gate for k in killmails], dtype=bool)
+
+    # Attacker columns, in killmails.Attacker field order
+    attackers = np.array([[_id(v) for v in a] for k in killmails for a in k.attackers], dtype=np.int64).reshape(-1, 6)
+    att_char, att_corp, att_corporation, att_alliance, att_ship, att_weapon = attackers.T
+    att_km = np.repeat(np.arange(len(killmails)), n_att)
+    att_idx = np.arange(len(attackers)) - np.repeat(np.cumsum(n_att) - n_att, n_att)
+    att_kmid = km_ids[att_km]
+
+    # Valuations, fleet sizes, and ship types in small or large fleets
+    large = n_att > 9
+    acc['processed_killmails'] += sign * len(killmails)
+    acc['average_kill_value'] = _sequential_sum(acc['average_kill_value'], sign * values)
+    acc['average_pilots'] += sign * int(n_att.sum())
+    acc['avg_10'] += sign * int(n_att[large].sum())
+    acc['pro_10'] += sign * int(large.sum())
+    acc['avg_gang'] += sign * int(n_att[~large].sum())
+    acc['pro_gang'] += sign * int((~large).sum())
+
+    mine = att_char == pilot_id
+    _merge_ranked(acc['top_ships'], att_ship[mine], att_kmid[mine], att_idx[mine], sign)
+    mine_large = mine & large[att_km]
+    _merge_ranked(acc['top_10_ships'], att_ship[mine_large], att_kmid[mine_large], att_idx[mine_large], sign)
+    mine_gang = mine & ~large[att_km]
+    _merge_ranked(acc['top_gang_ships'], att_ship[mine_gang], att_kmid[mine_gang], att_idx[mine_gang], sign)
+    _merge_ranked(acc['buttbuddies'], att_char[~mine], att_kmid[~mine], att_idx[~mine], sign)
+
+    # Location and timezone
+    no_idx = np.zeros(len(killmails), dtype=np.int64)
+    _merge_ranked(acc['top_regions'], [k.region for k in killmails], km_ids, no_idx, sign)
+    _merge_ranked(acc['top_space'], [k.space for k in killmails], km_ids, no_idx, sign)
+    for name in ['ustz', 'autz', 'eutz']:
+        in_tz = tz == name
+        acc[name]['kills'] = _sequential_sum(acc[name]['kills'], np.full(int(in_tz.sum()), sign, dtype=np.float64))
+        acc[name]['attackers'] += sign * int(n_att[in_tz].sum())
+
+    if sign > 0:
+        acc['recent'] = (_recent(killmails, db) + acc['recent'])[:5]
+        rows = np.flatnonzero(mine)
+        _merge_last_used(acc, [(int(att_kmid[r]), att_ship[r], int(n_att[att_km[r]])) for r in rows], db)
+
+    # Kill attributes (using certain ships etc.)
+    capital = _used(mine, att_km, att_ship, db.capital_ships, len(killmails))
+    blops = _used(mine, att_km, att_ship, db.blops, len(killmails))
+    acc['boy_scout'] += sign * int((on_gate & ~capital & ~blops).sum())  # Gatecamping
+    acc['cyno'] += sign * int(_used(mine, att_km, att_ship, db.recon_ships, len(killmails)).sum())
+    acc['capital_use'] += sign * int(capital.sum())
+    acc['blops_use'] += sign * int(blops.sum())
+    acc['smartbomb'] += sign * int(_used(mine, att_km, att_weapon, db.smartbomb_ids, len(killmails)).sum())
+    acc['super'] += sign * int(_used(mine, att_km, att_ship, db.super, len(killmails)).sum())
+    acc['titan'] += sign * int(_used(mine, att_km, att_ship, db.titan, len(killmails)).sum())
+
+    # Associates
+    associated = (att_char != _NONE) & ~mine & (att_corp != corp_id) & (att_alliance != alliance_id)
+    entity = np.where(att_alliance > 0, att_alliance, att_corporation)
+    _merge_ranked(acc['associates'], entity[associated], att_kmid[associated], att_idx[associated], sign)
+
+
+def accumulate_losses(acc, pilot_data, merged_losses, db, sign=1):
+    """
+    Drop-in replacement for analyze._accumulate_losses()
+    :param acc: Accumulator from analyze._get_loss_accumulator()
+    :param pilot_data: Pilot data to use
+    :param merged_losses: List of killmails.KillRecords, newest first
+    :param db: EveDB to use
+    :param sign: 1 to add the killmails, -1 to subtract them
+    """
+    if not merged_losses:
+        return
+    km_ids = np.array([k.killmail_id for k in merged_losses], dtype=np.int64)
+    values = np.array([k.value for k in merged_losses], dtype=np.float64)
+    ships = db.get_ship_names(k.victim_ship_type_id for k in merged_losses)
+
+    acc['processed_lossmails'] += sign * len(merged_losses)
+    acc['average_loss_value'] = _sequential_sum(acc['average_loss_value'], sign * values)
+    _merge_ranked(acc['top_lost_ships'], ships, km_ids, np.zeros(len(merged_losses), dtype=np.int64), sign)
+
+    if sign > 0:
+        acc['recent'] = (_recent(merged_losses, db) + acc['recent'])[:5]
+        _merge_last_used(acc, [(k.killmail_id, s, len(k.attackers)) for k, s in zip(merged_losses, ships)])
+
+
+def _id(value):
+    return _NONE if value is None else value
+
+
+def _sequential_sum(start, values):
+    """
+    Add values to start one after another, the way a Python loop would round them
+    :param start: Starting value
+    :param values: float64 array
+    :return: Float
+    """
+    if len(values) == 0:
+        return start
+    return float(np.cumsum(np.concatenate(([start], values)))[-1])
+
+
+def _used(rows, att_km, column, type_ids, n_killmails):
+    """
+    Vectorized EveDB.used_*(): which killmails have a selected attacker row whose column value is in type_ids
+    :param rows: Boolean mask of attacker rows to consider
+    :param att_km: Killmail index of every attacker row
+    :param column: Attacker column to test
+    :param type_ids: Collection of type IDs, like the frozensets of EveDB
+    :param n_killmails: Number of killmails
+    :return: Boolean array, one value per killmail
+    """
+    hit = rows & np.isin(column, np.fromiter(type_ids, dtype=np.int64, count=len(type_ids)))
+    return np.bincount(att_km[hit], minlength=n_killmails) > 0
+
+
+def _merge_ranked(counter, keys, km_ids, indices, sign):
+    """
+    Count a column of keys into an accumulator counter, see analyze._count(). Rows are ordered newest killmail first
+    and by attacker index, so the first row of every key carries its rank.
+    :param counter: Accumulator counter dictionary
+    :param keys: Keys, an int64 column (_NONE is counted as None) or a list of any hashable values
+    :param km_ids: killmail_id of every row
+    :param indices: Attacker index of every row
+    :param sign: 1 to add, -1 to subtract
+    """
+    if isinstance(keys, list):
+        lookup = {}
+        codes = np.array([lookup.setdefault(k, len(lookup)) for k in keys], dtype=np.int64)
+        uniques = list(lookup)
+    else:
+        codes = keys
+        uniques = None
+    if len(codes) == 0:
+        return
+    order = np.lexsort((indices, -km_ids))
+    found, first, counts = np.unique(codes[order], return_index=True, return_counts=True)
+    for code, row, count in zip(found.tolist(), order[first].tolist(), counts.tolist()):
+        if uniques is not None:
+            key = uniques[code]
+        else:
+            key = None if code == _NONE else code
+        rank = (int(km_ids[row]), -int(indices[row]))
+        entry = counter.get(key)
+        if entry is None:
+            if sign > 0:
+                counter[key] = [count, rank]
+            continue
+        entry[0] += sign * count
+        if entry[0] <= 0:
+            del counter[key]
+        elif rank > entry[1]:
+            entry[1] = rank
+
+
+def _merge_last_used(acc, candidates, db=None):
+    """
+    Pick the last used ship from candidates the way the Python engine does: the first one with a known ship name, or
+    the last one if none is known.
+    :param acc: Accumulator
+    :param candidates: List of (killmail_id, ship, attackers) in killmail order, ship is a type ID if db is given
+    :param db: EveDB to resolve ship type IDs with, None if ship is a name already
+    """
+    last_used = None
+    for killmail_id, ship, attackers in candidates:
+        if db is not None:
+            ship = db.get_ship_name(None if ship == _NONE else int(ship))
+        last_used = (killmail_id, ship, attackers)
+        if ship is not None:
+            break
+    if last_used is not None and (last_used[1] is not None or acc['last_used'] is None):
+        acc['last_used'] = last_used
+
+
+def _recent(killmails, db):
+    """
+    :param killmails: List of KillRecords, newest first
+    :param db: EveDB to use
+    :return: Recent entries of the first five killmails, as kept by the accumulators
+    """
+    return [(k.killmail_id, {
+        'victim_ship': db.get_ship_name(k.victim_ship_type_id),
+        'attackers': len(k.attackers),
+        'killmail_time': datetime.datetime.strptime(k.killmail_time.split('T')[0], '%Y-%m-%d')
+    }) for k in killmails[:5]]
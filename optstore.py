@@ -2,15 +2,59 @@
 # Github: https://github.com/Toolage13/HawkEye
 """
 Full credit to White Russsian, most of this was shamelessly stolen from him: https://github.com/Eve-PySpy/PySpy
+Hot code doesn't Get() options one by one but reads an immutable, typed Settings snapshot, see Snapshot().
 """
+import collections
 import logging
 import os
 import pickle
+import threading
+import time
 
 
 Logger = logging.getLogger(__name__)
 
 
+def _entries(value):
+    return tuple(tuple(e) for e in value)
+
+
+# Settings field, option key, default, type
+SETTINGS = [
+    ('max_killmails', 'maxKillmails', 50, int),
+    ('max_killmail_age', 'maxKillmailAge', 0, int),  # Days, 0 for no limit
+    ('populate_all', 'pop', True, bool),
+    ('hl_blops', 'HlBlops', True, bool),
+    ('hl_cyno', 'HlCyno', True, bool),
+    ('hl_super', 'HlSuper', True, bool),
+    ('hl_titan', 'HlTitan', True, bool),
+    ('hl_list', 'HlList', True, bool),
+    ('highlighted_list', 'highlightedList', [], _entries),  # Tuple of (id, name, type) tuples
+    ('ignored_list', 'ignoredList', [], _entries),
+]
+
+Settings = collections.namedtuple('Settings', [s[0] for s in SETTINGS] + [
+    'highlighted_ids',  # frozenset of the IDs in highlighted_list
+    'ignored_ids',  # frozenset of the IDs in ignored_list
+    'ignored_names',  # frozenset of the names in ignored_list
+])
+
+
+def _build_settings(options):
+    values = {}
+    for field, key, default, kind in SETTINGS:
+        value = options.get(key)
+        try:
+            values[field] = kind(value if value is not None else default)
+        except (TypeError, ValueError):
+            Logger.warning('Option {} has an invalid value {!r}, using {!r}'.format(key, value, default))
+            values[field] = kind(default)
+    return Settings(highlighted_ids=frozenset(e[0] for e in values['highlighted_list']),
+                    ignored_ids=frozenset(e[0] for e in values['ignored_list']),
+                    ignored_names=frozenset(e[1] for e in values['ignored_list']),
+                    **values)
+
+
 class PersistentOptions():
     '''
     :class:`PersistentOptions`: Store variables between sessions.
@@ -23,6 +67,14 @@ class PersistentOptions():
         '''
         self._pickle_file = options_file
         self._options = self._restore()
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._subscribers = []
+        self._save_delay = None
+        self._save_due = None  # time.monotonic() the pending automatic save is due at, None if nothing is pending
+        self._save_wake = threading.Condition(self._lock)
+        self._save_thread = None
+        self._store_lock = threading.Lock()
 
     def ListKeys(self):
         '''
@@ -51,9 +103,53 @@ class PersistentOptions():
         '''
         Stores value under the specified key in the dictionary object.
         :param `key`: a new or existing key of the dictionary object;
-        :param `value`: any python object;
+        :param `value`: any python object, lists changed in place have to be Set again;
+        '''
+        with self._lock:
+            self._options[key] = value
+            self._snapshot = None
+            subscribers = [c for c, keys in self._subscribers if keys is None or key in keys]
+            self._scheduleSave()
+        for callback in subscribers:
+            try:
+                callback(key)
+            except Exception:
+                Logger.error('Option subscriber {} failed'.format(callback), exc_info=True)
+
+    def Snapshot(self):
+        '''
+        Returns the current options as an immutable Settings namedtuple with
+        typed values and defaults filled in. The snapshot is built once and
+        reused until the next Set(), take it once per analysis or render.
+        '''
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = _build_settings(self._options)
+            return self._snapshot
+
+    def Subscribe(self, callback, keys=None):
         '''
-        self._options[key] = value
+        Calls callback(key) from the setting thread after every Set() of one
+        of keys.
+        :param `callback`: callable taking the option key;
+        :param `keys`: option keys to watch, None for all;
+        '''
+        with self._lock:
+            self._subscribers.append((callback, frozenset(keys) if keys is not None else None))
+
+    def Unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s[0] != callback]
+
+    def AutoSave(self, delay):
+        '''
+        Save the options delay seconds after the last Set(), so a burst of
+        changes is written once. One background thread does every automatic
+        save, it rewrites the whole (small) pickle file.
+        :param `delay`: seconds to wait, None to stop saving automatically;
+        '''
+        with self._lock:
+            self._save_delay = delay
 
     def Del(self, key):
         '''
@@ -61,7 +157,9 @@ class PersistentOptions():
         :param `key`: existing key of the dictionary object;
         '''
         try:
-            del self._options[key]
+            with self._lock:
+                del self._options[key]
+                self._snapshot = None
         except:
             raise Exception("ERROR: no such key: " + str(key))
 
@@ -70,9 +168,38 @@ class PersistentOptions():
         Saves the dictionary object in a pickle file under the file name
         provided at instantiation.
         '''
-        self._storePickle(self._pickle_file, self._options)
+        # Saves never overlap, so an older copy of the options can't overwrite a newer one
+        with self._store_lock:
+            with self._lock:
+                self._save_due = None
+                data = dict(self._options)
+            self._storePickle(self._pickle_file, data)
         return
 
+    def _scheduleSave(self):
+        '''
+        Push the automatic save back to delay seconds from now, the caller
+        holds the lock.
+        '''
+        if self._save_delay is None:
+            return
+        self._save_due = time.monotonic() + self._save_delay
+        if self._save_thread is None:
+            self._save_thread = threading.Thread(target=self._saveLoop, name='OptionsSave', daemon=True)
+            self._save_thread.start()
+        self._save_wake.notify()
+
+    def _saveLoop(self):
+        '''
+        Body of the automatic save thread, waits until a save is due and
+        runs it.
+        '''
+        while True:
+            with self._lock:
+                while self._save_due is None or self._save_due > time.monotonic():
+                    self._save_wake.wait(None if self._save_due is None else self._save_due - time.monotonic())
+            self.Save()
+
     def _restore(self):
         '''
         Restores the dictionary object from the pickle file saved under
@@ -94,8 +221,10 @@ class PersistentOptions():
         try:
             if not os.path.exists(pickle_dir):
                 os.makedirs(pickle_dir)
-            with open(pickle_file, 'wb') as file:
+            # Write a temporary file and swap it in, a crash mid-write never leaves a truncated pickle behind
+            with open(pickle_file + '.tmp', 'wb') as file:
                 pickle.dump(pickle_data, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(pickle_file + '.tmp', pickle_file)
         except Exception:
             Logger.warn("Failed to create / store pickle file.", exc_info=True)
         finally:
@@ -0,0 +1,143 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Persistent cache of zKillboard list pages (api/kills/..., api/losses/...) in PREF_PATH/zkillpages.db. A page younger
+than config.ZKILL_PAGE_TTL is served without touching the network, an older one is revalidated with
+If-None-Match / If-Modified-Since so an unchanged killboard costs a 304 and no body parse. Parsed pages are also kept
+in a small in-memory LRU so revalidated pages are not decompressed and parsed again.
+"""
+import collections
+import config
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+Logger = logging.getLogger(__name__)
+
+Page = collections.namedtuple('Page', ['url', 'etag', 'last_modified', 'fetched', 'data'])
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+class PageCache:
+    def __init__(self, path, memory_pages=500):
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+        self._memory_pages = memory_pages
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.execute("""create table if not exists pages(
+                            url str primary key,
+                            etag str,
+                            last_modified str,
+                            fetched float,
+                            data blob)""")
+        self._db.commit()
+
+    def get(self, url):
+        """
+        :param url: zKillboard url
+        :return: Page if cached, otherwise None. Page.data is the parsed list, or None for an empty killboard
+        """
+        with self._lock:
+            page = self._memory.get(url)
+            if page is not None:
+                self._memory.move_to_end(url)
+                return page
+            row = self._db.execute("select etag, last_modified, fetched, data from pages where url = ?",
+                                   (url,)).fetchone()
+            if row is None:
+                return None
+            page = Page(url, row[0], row[1], row[2], json.loads(zlib.decompress(row[3])))
+            self._remember(page)
+            return page
+
+    @staticmethod
+    def is_fresh(page, ttl=None):
+        """
+        :param page: Page returned by get()
+        :param ttl: Seconds a page is considered fresh, defaults to config.ZKILL_PAGE_TTL
+        :return: Boolean, True if the page can be used without revalidation
+        """
+        if page is None:
+            return False
+        return time.time() - page.fetched < (config.ZKILL_PAGE_TTL if ttl is None else ttl)
+
+    def is_fresh_url(self, url, ttl=None):
+        """
+        Same as is_fresh(get(url)) without reading and parsing the page.
+        :param url: zKillboard url
+        :param ttl: Seconds a page is considered fresh, defaults to config.ZKILL_PAGE_TTL
+        :return: Boolean, True if the page is cached and can be used without revalidation
+        """
+        with self._lock:
+            page = self._memory.get(url)
+            if page is not None:
+                fetched = page.fetched
+            else:
+                row = self._db.execute("select fetched from pages where url = ?", (url,)).fetchone()
+                if row is None:
+                    return False
+                fetched = row[0]
+        return time.time() - fetched < (config.ZKILL_PAGE_TTL if ttl is None else ttl)
+
+    def put(self, url, etag, last_modified, data):
+        """
+        Store a freshly downloaded page.
+        :param url: zKillboard url
+        :param etag: ETag response header, if any
+        :param last_modified: Last-Modified response header, if any
+        :param data: Parsed page, or None for an empty killboard
+        :return: The stored Page
+        """
+        page = Page(url, etag, last_modified, time.time(), data)
+        blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+        with self._lock:
+            self._db.execute("insert or replace into pages (url, etag, last_modified, fetched, data) "
+                             "values (?, ?, ?, ?, ?)", (url, etag, last_modified, page.fetched, blob))
+            self._db.commit()
+            self._remember(page)
+        return page
+
+    def touch(self, page):
+        """
+        Mark a page as fresh again after the server answered 304 Not Modified.
+        :param page: Page returned by get()
+        :return: The refreshed Page
+        """
+        page = page._replace(fetched=time.time())
+        with self._lock:
+            self._db.execute("update pages set fetched = ? where url = ?", (page.fetched, page.url))
+            self._db.commit()
+            self._remember(page)
+        return page
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("delete from pages")
+            self._db.commit()
+            self._db.execute("vacuum")
+
+    def _remember(self, page):
+        self._memory[page.url] = page
+        self._memory.move_to_end(page.url)
+        while len(self._memory) > self._memory_pages:
+            self._memory.popitem(last=False)
+
+
+def get_cache():
+    """
+    :return: The process wide PageCache, opened on first use
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = PageCache(os.path.join(config.PREF_PATH, 'zkillpages.db'))
+    return _CACHE
@@ -0,0 +1,112 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Opt-in profiling of whole pastes. Set HAWKEYE_PROFILE to a number of pastes, or use Options > Profile Next Paste which
+adds one to the "profileRuns" option, and the next analyses run under cProfile and tracemalloc. Every profiled paste
+leaves two files in PREF_PATH, tagged with the time, the number of pilots and maxKillmails:
+    profile-<time>-<pilots>p-<maxKillmails>k.prof   cProfile stats, open with pstats or snakeviz
+    profile-<time>-<pilots>p-<maxKillmails>k.txt    top functions by cumulative time and top allocations
+cProfile sees the thread the analysis runs on, which runs every coroutine of the paste, so time spent waiting on the
+network shows up under the event loop's select(). Killstore reads in executor threads and stats crunched in the statspool
+processes are not profiled. tracemalloc sees allocations of every thread. Only one paste is profiled at a time.
+"""
+import config
+import contextlib
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import threading
+import tracemalloc
+
+Logger = logging.getLogger(__name__)
+
+_LOCK = threading.Lock()
+_remaining = config.PROFILE_RUNS  # Pastes left to profile from HAWKEYE_PROFILE
+_active = False
+
+
+def request(runs=1):
+    """
+    Profile the next runs pastes
+    :param runs: Number of pastes
+    """
+    with _LOCK:
+        config.OPTIONS_OBJECT.Set("profileRuns", config.OPTIONS_OBJECT.Get("profileRuns", default=0) + runs)
+
+
+def _take():
+    """
+    :return: Boolean, True if the paste starting now is to be profiled, it is counted off the pastes left
+    """
+    global _remaining, _active
+    with _LOCK:
+        if _active:
+            return False
+        runs = config.OPTIONS_OBJECT.Get("profileRuns", default=0)
+        if runs > 0:
+            config.OPTIONS_OBJECT.Set("profileRuns", runs - 1)
+        elif _remaining > 0:
+            _remaining -= 1
+        else:
+            return False
+        _active = True
+        return True
+
+
+@contextlib.contextmanager
+def profile(pilots, max_killmails):
+    """
+    Run the block under cProfile and tracemalloc if a profile was requested, otherwise just run it
+    :param pilots: Number of pilots pasted, used in the file names
+    :param max_killmails: maxKillmails setting, used in the file names
+    """
+    global _active
+    if not _take():
+        yield
+        return
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start(config.PROFILE_FRAMES)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if not tracing:
+            tracemalloc.stop()
+        with _LOCK:
+            _active = False
+        _write(profiler, snapshot, peak, pilots, max_killmails)
+
+
+def _write(profiler, snapshot, peak, pilots, max_killmails):
+    """
+    Write the .prof file and the text summary of one profiled paste to PREF_PATH
+    :param profiler: Disabled cProfile.Profile
+    :param snapshot: tracemalloc.Snapshot taken at the end of the paste
+    :param peak: Peak traced memory in bytes
+    :param pilots: Number of pilots pasted
+    :param max_killmails: maxKillmails setting
+    """
+    name = 'profile-{}-{}p-{}k'.format(datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), pilots, max_killmails)
+    path = os.path.join(config.PREF_PATH, name)
+    try:
+        profiler.dump_stats(path + '.prof')
+        out = io.StringIO()
+        out.write('{} pilots, maxKillmails {}, peak traced memory {:.1f} MB\n\n'.format(
+            pilots, max_killmails, peak / 1024 / 1024))
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(config.PROFILE_TOP)
+        out.write('Top {} allocations by line\n'.format(config.PROFILE_TOP))
+        for stat in snapshot.statistics('lineno')[:config.PROFILE_TOP]:
+            out.write('{}\n'.format(stat))
+        with open(path + '.txt', 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+        Logger.info('Wrote profile {}.prof'.format(path))
+    except OSError:
+        Logger.error('Failed to write profile {}'.format(path), exc_info=True)
@@ -0,0 +1,119 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Rate limiting for hosts that publish request limits (zKillboard). A single TokenBucket is shared by every coroutine and
+thread talking to the host, so requests are spaced by the configured rate instead of bursting and then sleeping a random
+amount, and Retry-After / 429 / 503 responses push back every queued request at once.
+"""
+import asyncio
+import datetime
+import email.utils
+import logging
+import threading
+import time
+
+Logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """
+        :param rate: Sustained requests per second
+        :param burst: Number of requests that may be sent back to back after the bucket has been idle
+        """
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._lock = threading.Lock()
+        # Theoretical arrival time of the next request (GCRA), a full bucket is any value <= now
+        self._tat = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the counters reported by stats()
+        """
+        with self._lock:
+            self.requests = 0
+            self.queued_requests = 0
+            self.queued_seconds = 0.0
+            self.max_queued_seconds = 0.0
+            self.throttled = 0
+
+    def _reserve(self):
+        """
+        Reserve the next slot in the bucket.
+        :return: Seconds to wait before the reserved slot starts
+        """
+        with self._lock:
+            now = time.monotonic()
+            tolerance = (self.burst - 1) / self.rate
+            tat = max(self._tat, now)
+            wait = max(0.0, tat - tolerance - now)
+            self._tat = tat + 1 / self.rate
+            self.requests += 1
+            if wait > 0:
+                self.queued_requests += 1
+                self.queued_seconds += wait
+                self.max_queued_seconds = max(self.max_queued_seconds, wait)
+            return wait
+
+    async def acquire(self):
+        """
+        Wait until a request may be sent.
+        :return: Seconds this request was queued
+        """
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, seconds):
+        """
+        Block the whole bucket for a number of seconds, used when the server asks us to back off.
+        :param seconds: Seconds until the next request may be sent
+        """
+        with self._lock:
+            now = time.monotonic()
+            tolerance = (self.burst - 1) / self.rate
+            self._tat = max(self._tat, now + seconds + tolerance)
+            self.throttled += 1
+
+    def stats(self):
+        """
+        :return: Dictionary of request and queueing counters since the last reset_stats()
+        """
+        with self._lock:
+            return {'requests': self.requests,
+                    'queued_requests': self.queued_requests,
+                    'queued_seconds': round(self.queued_seconds, 2),
+                    'max_queued_seconds': round(self.max_queued_seconds, 2),
+                    'throttled': self.throttled}
+
+    def summary(self):
+        """
+        :return: Human readable version of stats()
+        """
+        s = self.stats()
+        return '{} requests, {} queued for {} seconds in total ({} seconds max), throttled {} times'.format(
+            s['requests'], s['queued_requests'], s['queued_seconds'], s['max_queued_seconds'], s['throttled'])
+
+
+def retry_after(headers, default):
+    """
+    Parse a Retry-After header, which is either a number of seconds or an HTTP date.
+    :param headers: Response headers
+    :param default: Seconds to return if the header is missing or invalid
+    :return: Seconds to wait
+    """
+    value = headers.get('Retry-After')
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,160 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Persistent cache of finished pilot rows in PREF_PATH/results.db. A row is stored together with the key it was computed
+from: pilot_id, the maxKillmails and maxKillmailAge settings, the pilot's corporation and alliance (associates depend on
+them) and the newest kill and loss killmail_ids seen on zKillboard. If the key of a new paste matches, the finished row
+is reused without fetching a single killmail or running the stats again.
+The raw kill and loss accumulators analyze.py finalizes into a row are stored as well, so when a pilot's killboard did
+change only the new killmails have to be processed.
+"""
+import config
+import datetime
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import zlib
+
+Logger = logging.getLogger(__name__)
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+class ResultCache:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.execute("""create table if not exists results(
+                            pilot_id int primary key,
+                            cache_key str,
+                            data blob)""")
+        self._db.execute("""create table if not exists accumulators(
+                            pilot_id int,
+                            kind str,
+                            data blob,
+                            primary key (pilot_id, kind))""")
+        self._db.commit()
+
+    def get(self, pilot_id, key):
+        """
+        :param pilot_id: Pilot ID
+        :param key: Key built by make_key()
+        :return: Cached row with day counters refreshed, or None if nothing is cached under this key
+        """
+        with self._lock:
+            row = self._db.execute("select cache_key, data from results where pilot_id = ?", (pilot_id,)).fetchone()
+        if row is None or row[0] != key:
+            return None
+        try:
+            stats = pickle.loads(zlib.decompress(row[1]))
+        except Exception:
+            Logger.warning('Discarding unreadable cached result for {}'.format(pilot_id), exc_info=True)
+            return None
+        return _refresh_ages(stats)
+
+    def has(self, pilot_id):
+        """
+        :param pilot_id: Pilot ID
+        :return: Boolean, True if any row is cached for this pilot
+        """
+        with self._lock:
+            return self._db.execute("select 1 from results where pilot_id = ?", (pilot_id,)).fetchone() is not None
+
+    def put(self, pilot_id, key, stats):
+        """
+        Store a finished row under key, replacing whatever was cached for the pilot before.
+        :param pilot_id: Pilot ID
+        :param key: Key built by make_key()
+        :param stats: Finished row as returned by analyze.main()
+        """
+        blob = zlib.compress(pickle.dumps(stats, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._db.execute("insert or replace into results (pilot_id, cache_key, data) values (?, ?, ?)",
+                             (pilot_id, key, blob))
+            self._db.commit()
+
+    def get_accumulator(self, pilot_id, kind):
+        """
+        :param pilot_id: Pilot ID
+        :param kind: 'kills' or 'losses'
+        :return: Stored accumulator, or None
+        """
+        with self._lock:
+            row = self._db.execute("select data from accumulators where pilot_id = ? and kind = ?",
+                                   (pilot_id, kind)).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(zlib.decompress(row[0]))
+        except Exception:
+            Logger.warning('Discarding unreadable {} accumulator for {}'.format(kind, pilot_id), exc_info=True)
+            return None
+
+    def put_accumulator(self, pilot_id, kind, acc):
+        """
+        :param pilot_id: Pilot ID
+        :param kind: 'kills' or 'losses'
+        :param acc: Accumulator built by analyze.py
+        """
+        blob = zlib.compress(pickle.dumps(acc, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._db.execute("insert or replace into accumulators (pilot_id, kind, data) values (?, ?, ?)",
+                             (pilot_id, kind, blob))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("delete from results")
+            self._db.execute("delete from accumulators")
+            self._db.commit()
+            self._db.execute("vacuum")
+
+
+def make_key(pilot_data, max_killmails, kills, losses, max_age=None):
+    """
+    :param pilot_data: Dictionary of pilot data
+    :param max_killmails: maxKillmails setting
+    :param kills: zkill kills list (or None)
+    :param losses: zkill losses list (or None)
+    :param max_age: maxKillmailAge setting, with a horizon killmails age out daily so the key includes today's date
+    :return: Cache key string
+    """
+    return '{}:{}:{}:{}:{}:{}:{}'.format(pilot_data['pilot_id'],
+                                         max_killmails,
+                                         pilot_data['corp_id'],
+                                         pilot_data['alliance_id'],
+                                         max(k['killmail_id'] for k in kills) if kills else None,
+                                         max(k['killmail_id'] for k in losses) if losses else None,
+                                         '{}@{}'.format(max_age, datetime.date.today()) if max_age else None)
+
+
+def _refresh_ages(stats):
+    """
+    "Days ago" values are relative to today, recompute them for a row that may have been cached days ago.
+    :param stats: Cached row
+    :return: The row with killed_when, last_kill and last_loss refreshed
+    """
+    today = datetime.date.today()
+    for key, last in [('last_five_kills', 'last_kill'), ('last_five_losses', 'last_loss')]:
+        recent = stats.get(key) or []
+        for kill in recent:
+            kill['killed_when'] = (today - kill['killmail_time'].date()).days
+        if recent:
+            stats[last] = recent[0]['killed_when']
+    return stats
+
+
+def get_cache():
+    """
+    :return: The process wide ResultCache, opened on first use
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = ResultCache(os.path.join(config.PREF_PATH, 'results.db'))
+    return _CACHE
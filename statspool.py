@@ -0,0 +1,84 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Process pool for the CPU bound stats phase. Large accumulator updates are handed to worker processes so the analysis
+event loop keeps fetching zkill pages and killmails while other cores crunch the stats of pilots already fetched.
+Every worker loads the static tables once through its own EveDB(static_only=True) when it starts, the compact
+KillRecords are sent over and only the updated accumulator comes back.
+"""
+import concurrent.futures
+import config
+import logging
+import multiprocessing
+import os
+import threading
+
+Logger = logging.getLogger(__name__)
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_BROKEN = False
+_WORKER_DB = None
+
+
+def use_pool(killmail_count):
+    """
+    :param killmail_count: Number of killmails in the accumulator update
+    :return: Boolean, True if the update should run in the process pool
+    """
+    return not _BROKEN and 0 < config.STATS_POOL_THRESHOLD <= killmail_count
+
+
+def get_pool():
+    """
+    :return: The process wide stats ProcessPoolExecutor, started on first use
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            workers = config.STATS_POOL_WORKERS or max(1, (os.cpu_count() or 2) - 1)
+            Logger.info('Starting {} stats worker processes'.format(workers))
+            # Always spawn, forking a process that runs wx and asyncio threads is not safe
+            _POOL = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                           mp_context=multiprocessing.get_context('spawn'),
+                                                           initializer=_init_worker)
+    return _POOL
+
+
+async def accumulate(loop, kind, acc, pilot_data, batches):
+    """
+    Run analyze._accumulate_batches() in the pool. If the pool broke (a worker died or can't start), it's disabled for
+    the rest of the session and None is returned so the caller runs the update itself.
+    :param loop: Event loop of the caller
+    :param kind: 'kills' or 'losses'
+    :param acc: Accumulator to update
+    :param pilot_data: Dictionary of pilot data
+    :param batches: List of (killmails, sign) tuples, applied in order
+    :return: Updated accumulator, or None
+    """
+    global _BROKEN
+    try:
+        return await loop.run_in_executor(get_pool(), _accumulate, kind, acc, pilot_data, batches)
+    except (concurrent.futures.BrokenExecutor, OSError):
+        Logger.error('Stats process pool failed, running stats in process from now on', exc_info=True)
+        _BROKEN = True
+        return None
+
+
+def shutdown():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False)
+            _POOL = None
+
+
+def _init_worker():
+    global _WORKER_DB
+    import eveDB
+    _WORKER_DB = eveDB.EveDB(static_only=True)
+
+
+def _accumulate(kind, acc, pilot_data, batches):
+    import analyze
+    return analyze._accumulate_batches(kind, acc, pilot_data, batches, _WORKER_DB)
@@ -1,10 +1,201 @@
 # !/usr/local/bin/python3.8
 # Github: https://github.com/Toolage13/HawkEye
 """
-Full credit to White Russsian, most of this was shamelessly stolen from him: https://github.com/Eve-PySpy/PySpy
+Status and progress reporting. Besides the free text status pushed with push_status(), an analysis reports structured
+progress: pilots done out of the total, requests in flight, requests sent and cache hits. Nothing is handed to the
+sinks directly. Updates only mark the status dirty, and a snapshot of the latest state is sent to every sink at most
+config.STATUS_FPS times per second, so thousands of updates during a big paste cost a handful of GUI events. The
+last update is always delivered.
+Sinks are callables taking a snapshot dictionary: GuiSink for the status bar, log_sink and CliSink for headless.py.
+Full credit to White Russsian for the original status bar relay: https://github.com/Eve-PySpy/PySpy
 """
-import __main__
-import wx
+import config
+import contextlib
+import logging
+import sys
+import threading
+import time
+
+try:
+    import wx
+except ImportError:
+    wx = None  # Headless, see headless.py
+
+Logger = logging.getLogger(__name__)
+
+COUNTERS = ['pilots_done', 'pilots_total', 'in_flight', 'requests', 'cache_hits']
+
+_THREAD_STATE = threading.local()
+_LOCK = threading.Lock()
+_SINKS = []
+_STATE = dict({'message': None}, **{c: 0 for c in COUNTERS})
+_dirty = False
+_timer = None
+_last_emit = 0.0
+
+
+class GuiSink:
+    def __init__(self, frame):
+        """
+        :param frame: gui.Frame whose status bar shows the status
+        """
+        self.frame = frame
+
+    def __call__(self, snapshot):
+        wx.CallAfter(self.frame.updateStatusbar, format_status(snapshot))
+
+
+class CliSink:
+    def __init__(self, stream=None, width=30):
+        """
+        Progress bar redrawn on one terminal line
+        :param stream: File object to draw on, defaults to stderr
+        :param width: Width of the bar in characters
+        """
+        self.stream = stream or sys.stderr
+        self.width = width
+
+    def __call__(self, snapshot):
+        total = snapshot['pilots_total']
+        if total:
+            filled = int(self.width * snapshot['pilots_done'] / total)
+            bar = '[{}{}] '.format('#' * filled, '-' * (self.width - filled))
+        else:
+            bar = ''
+        self.stream.write('\r\033[K' + bar + format_status(snapshot))
+        self.stream.flush()
+
+
+def log_sink(snapshot):
+    Logger.info(format_status(snapshot))
+
+
+def format_status(snapshot):
+    """
+    :param snapshot: Status snapshot
+    :return: One line of text, the message followed by the progress of a running analysis
+    """
+    text = snapshot['message'] or ''
+    if snapshot['pilots_total']:
+        text += ' ({}/{} pilots, {} requests in flight, {} sent, {} cache hits)'.format(
+            snapshot['pilots_done'], snapshot['pilots_total'], snapshot['in_flight'], snapshot['requests'],
+            snapshot['cache_hits'])
+    return text.strip()
+
+
+def add_sink(sink):
+    """
+    Register a sink, it is sent the current status right away
+    :param sink: Callable taking a status snapshot
+    """
+    with _LOCK:
+        _SINKS.append(sink)
+        snapshot = dict(_STATE)
+    sink(snapshot)
+
+
+def remove_sink(sink):
+    with _LOCK:
+        if sink in _SINKS:
+            _SINKS.remove(sink)
+
+
+def mute():
+    """
+    Drop every update made from the calling thread from now on, used by background threads like the cache warmer
+    """
+    _THREAD_STATE.muted = True
+
 
 def push_status(msg):
-    wx.CallAfter(__main__.app.MyFrame.updateStatusbar, msg)
+    """
+    :param msg: Status message
+    """
+    _update(message=msg)
+
+
+def begin(pilots_total):
+    """
+    Reset the progress counters for an analysis of pilots_total pilots
+    :param pilots_total: Number of pilots
+    """
+    _update(**dict({c: 0 for c in COUNTERS}, pilots_total=pilots_total))
+
+
+def end():
+    """
+    The analysis is done, stop reporting progress next to the message
+    """
+    _update(**{c: 0 for c in COUNTERS})
+
+
+def count(counter, n=1):
+    """
+    :param counter: One of COUNTERS
+    :param n: Amount to add, negative to subtract
+    """
+    if getattr(_THREAD_STATE, 'muted', False):
+        return
+    with _LOCK:
+        _STATE[counter] += n
+    _schedule()
+
+
+@contextlib.contextmanager
+def request():
+    """
+    Count a request as sent, and as in flight while the block runs
+    """
+    count('requests')
+    count('in_flight')
+    try:
+        yield
+    finally:
+        count('in_flight', -1)
+
+
+def _update(**values):
+    if getattr(_THREAD_STATE, 'muted', False):
+        return
+    with _LOCK:
+        _STATE.update(values)
+    _schedule()
+
+
+def _schedule():
+    """
+    Mark the status dirty and emit it now if the last emit is at least one frame ago, otherwise make sure a timer
+    emits it when the frame is over
+    """
+    global _dirty, _timer
+    frame = 1.0 / config.STATUS_FPS
+    with _LOCK:
+        _dirty = True
+        if _timer is not None:
+            return
+        wait = _last_emit + frame - time.monotonic()
+        if wait > 0:
+            _timer = threading.Timer(wait, _emit)
+            _timer.daemon = True
+            _timer.start()
+            return
+    _emit()
+
+
+def _emit():
+    global _dirty, _timer, _last_emit
+    with _LOCK:
+        _timer = None
+        if not _dirty:
+            return
+        _dirty = False
+        _last_emit = time.monotonic()
+        snapshot = dict(_STATE)
+        sinks = list(_SINKS)
+    if not sinks:
+        Logger.debug(format_status(snapshot))
+    for sink in sinks:
+        try:
+            sink(snapshot)
+        except Exception:
+            Logger.error('Status sink {} failed'.format(sink), exc_info=True)
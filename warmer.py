@@ -0,0 +1,123 @@
+# !/usr/local/bin/python3.8
+# Github: https://github.com/Toolage13/HawkEye
+"""
+Optional background cache warmer. While no paste is being analyzed, a low priority thread refreshes the zKillboard
+pages, ESI killmails and affiliations of the pilots in highlightedList and of the pilots in the most recent outlist, so
+the first paste of a session already hits a warm pagecache, killstore and character cache. Every round sends at most
+config.WARMER_BUDGET requests, retries included, and pauses as soon as analyze.py runs an analysis. Warming is enabled
+by the "warmCache" option.
+"""
+import analyze
+import asyncio
+import config
+import eveDB
+import history
+import httpclient
+import killmails
+import logging
+import metrics
+import statusmsg
+import threading
+
+Logger = logging.getLogger(__name__)
+
+_THREAD = None
+_WAKE = threading.Event()
+
+
+def start():
+    """
+    Start the warmer thread, it sleeps until the "warmCache" option is set.
+    """
+    global _THREAD
+    if _THREAD is None:
+        _THREAD = threading.Thread(target=_run, daemon=True)
+        _THREAD.start()
+
+
+def wake():
+    """
+    Start the next round now instead of after config.WARMER_INTERVAL, used when warming is switched on
+    """
+    _WAKE.set()
+
+
+def _run():
+    statusmsg.mute()
+    # Let startup and the first paste have the static data and the network to themselves
+    _WAKE.wait(config.WARMER_IDLE)
+    while True:
+        _WAKE.clear()
+        if config.OPTIONS_OBJECT.Get("warmCache", False):
+            try:
+                with eveDB.EveDB() as db:
+                    httpclient.run(warm(db))
+            except Exception:
+                Logger.error('Cache warming round failed', exc_info=True)
+        _WAKE.wait(config.WARMER_INTERVAL)
+
+
+async def warm(db, budget=None):
+    """
+    Run one warming round: affiliations of the target pilots first, then for every pilot the first zkill kills and
+    losses page and their killmails, highlighted pilots before the pilots of the last outlist. Killmails are resolved
+    config.WARMER_SLICE at a time, the round pauses for a running analysis before every page and every slice. Every
+    zKillboard and ESI request that goes out, retries included, counts against the budget, which is checked before
+    each page and slice. Cached pages and killmails cost nothing.
+    :param db: EveDB object to use
+    :param budget: Most requests to send, defaults to config.WARMER_BUDGET
+    :return: Number of requests sent
+    """
+    budget = config.WARMER_BUDGET if budget is None else budget
+    targets = _get_targets()
+    if not targets:
+        return 0
+    max_killmails = config.OPTIONS_OBJECT.Snapshot().max_killmails
+    resolver = killmails.KillmailResolver(db)
+
+    with metrics.recording('warmer') as recorder:
+        def left():
+            return budget - recorder.counters['zkill_requests'] - recorder.counters['esi_requests']
+
+        await _pause()
+        # One affiliation and one names lookup at most, pilots with a current affiliation are served from the cache
+        await db.get_pilot_affiliations([{'pilot_id': i, 'pilot_name': name} for i, name in targets])
+
+        for pilot_id, name in targets:
+            for page in ['kills', 'losses']:
+                if left() <= 0:
+                    break
+                await _pause()
+                zkill_data = await analyze._get_zkill_data(page, pilot_id, name)
+                for start in range(0, min(len(zkill_data or []), max_killmails), config.WARMER_SLICE):
+                    if left() <= 0:
+                        break
+                    await _pause()
+                    await resolver.merge(zkill_data[start:min(start + config.WARMER_SLICE, max_killmails,
+                                                              start + left())])
+        sent = budget - left()
+    Logger.info('Warmed the cache for {} pilots with {} requests, {}'.format(len(targets), sent, resolver.summary()))
+    return sent
+
+
+def _get_targets():
+    """
+    :return: List of (pilot ID, name) tuples, highlighted pilots first, then the pilots of the most recent outlist,
+    without duplicates. Highlighted corporations and alliances are not warmed, pastes only ever request pilot lists.
+    """
+    targets = [(entity_id, name) for entity_id, name, entity_type in
+               config.OPTIONS_OBJECT.Snapshot().highlighted_list if entity_type == 'Character']
+    targets.extend((p['pilot_id'], p['pilot_name']) for p in history.get_store().latest())
+    unique = []
+    for target in targets:
+        if not any(t[0] == target[0] for t in unique):
+            unique.append(target)
+    return unique
+
+
+async def _pause():
+    """
+    Wait while analyze.py is running an analysis, the warmer must never compete with a paste for zkill slots
+    """
+    while analyze.is_running():
+        await asyncio.sleep(config.WARMER_IDLE)